@@ -0,0 +1,101 @@
+"""
+End-to-end benchmark of the ecs-deploy commands against the in-process
+fake ECS/EventBridge backend (tests/fake_aws.py).
+
+Reports the wall time, number of API calls and API calls per second of
+deploy, scale, run and cron for services of different sizes:
+
+    $ python -m benchmarks.e2e
+    $ python -m benchmarks.e2e --tasks 1 100 1000 --latency 0.02 --max-calls-per-second 20
+"""
+import argparse
+import os
+import sys
+from time import time
+
+from click.testing import CliRunner
+
+from ecs_deploy import cli
+from ecs_deploy.ecs import clear_client_pool, clear_task_definition_cache
+from tests.fake_aws import FakeAwsBackend, FakeAwsServer
+
+CLUSTER = u'benchmark-cluster'
+SERVICE = u'benchmark-service'
+FAMILY = u'benchmark-task'
+RULE = u'benchmark-rule'
+
+
+def get_commands(tasks, sleep_time):
+    sleep_time = str(sleep_time)
+    return [
+        (u'deploy', cli.deploy, (CLUSTER, SERVICE, u'-t', u'v2', u'--sleep-time', sleep_time)),
+        (u'scale', cli.scale, (CLUSTER, SERVICE, str(tasks * 2), u'--sleep-time', sleep_time)),
+        (u'run', cli.run, (CLUSTER, FAMILY, str(min(tasks, 10)))),
+        (u'cron', cli.cron, (CLUSTER, FAMILY, RULE, u'-t', u'v3')),
+    ]
+
+
+def run_benchmark(tasks, latency, max_calls_per_second, rollout_polls, sleep_time):
+    backend = FakeAwsBackend(latency=latency, max_calls_per_second=max_calls_per_second,
+                             rollout_polls=rollout_polls)
+    backend.create_service(CLUSTER, SERVICE, FAMILY, desired_count=tasks)
+    backend.create_rule(RULE, CLUSTER, backend.task_definitions[(FAMILY, 1)][u'taskDefinitionArn'])
+
+    results = []
+    with FakeAwsServer(backend) as server:
+        environ = dict(os.environ)
+        os.environ.update(server.environ)
+        os.environ['ECS_DEPLOY_CREDENTIAL_CACHE'] = '0'
+        clear_client_pool()
+        clear_task_definition_cache()
+        try:
+            runner = CliRunner()
+            for name, command, args in get_commands(tasks, sleep_time):
+                backend.reset_calls()
+                started = time()
+                result = runner.invoke(command, args)
+                duration = time() - started
+                if result.exit_code != 0:
+                    raise RuntimeError(u'%s failed:\n%s' % (name, result.output))
+                results.append((name, tasks, duration, backend.total_calls,
+                                sum(backend.throttled_calls.values())))
+        finally:
+            clear_client_pool()
+            clear_task_definition_cache()
+            os.environ.clear()
+            os.environ.update(environ)
+    return results
+
+
+def print_results(results):
+    header = (u'command', u'tasks', u'wall time', u'API calls', u'throttled', u'calls/sec')
+    print(u'%-8s %8s %10s %10s %10s %10s' % header)
+    for name, tasks, duration, calls, throttled in results:
+        print(u'%-8s %8d %9.3fs %10d %10d %10.1f' % (
+            name, tasks, duration, calls, throttled, calls / duration if duration else 0
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark ecs-deploy against a fake ECS backend')
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1, 100, 1000],
+                        help=u'Number of tasks of the benchmarked service (default: 1 100 1000)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help=u'Seconds every API call takes (default: 0)')
+    parser.add_argument('--max-calls-per-second', type=float, default=None,
+                        help=u'Throttle API calls exceeding this rate (default: no throttling)')
+    parser.add_argument('--rollout-polls', type=int, default=3,
+                        help=u'Number of DescribeServices polls a rollout needs (default: 3)')
+    parser.add_argument('--sleep-time', type=float, default=0,
+                        help=u'Sleep time between the checks of the service (default: 0)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for tasks in args.tasks:
+        results.extend(run_benchmark(tasks, args.latency, args.max_calls_per_second,
+                                     args.rollout_polls, args.sleep_time))
+    print_results(results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
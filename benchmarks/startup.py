@@ -0,0 +1,92 @@
+"""
+Startup benchmark of the ecs command. Measures the import time of the CLI
+module (via python -X importtime) and the wall time of short commands in
+fresh interpreters, and fails if the import exceeds its budget or loads
+one of the heavy dependencies, which only the subcommands need:
+
+    $ python -m benchmarks.startup
+    $ python -m benchmarks.startup --repeat 20
+"""
+import argparse
+import json
+import subprocess
+import sys
+from time import time
+
+# Maximum cumulative import time of ecs_deploy.cli in seconds
+IMPORT_TIME_BUDGET = 0.15
+
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'dictdiffer', 'dateutil')
+
+MODULE = 'ecs_deploy.cli'
+
+COMMANDS = (
+    ('--version', ('--version',)),
+    ('--help', ('--help',)),
+    ('deploy --help', ('deploy', '--help')),
+)
+
+
+def measure_import(module=MODULE):
+    """Imports the module in a fresh interpreter and returns its cumulative
+    import time in seconds and the heavy modules it loaded.
+    """
+    script = 'import sys, json, %s; print(json.dumps([m for m in %r if m in sys.modules]))' % (
+        module, HEAVY_MODULES
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    import_time = None
+    for line in process.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            import_time = int(fields[1]) / 1000000.0
+    return import_time, json.loads(process.stdout)
+
+
+def measure_command(args, repeat):
+    """Returns the median wall time of running the ecs command with the
+    given arguments in a fresh interpreter.
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time()
+        subprocess.run(
+            [sys.executable, '-m', MODULE] + list(args),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        durations.append(time() - started)
+    return sorted(durations)[len(durations) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark the startup time of the ecs command')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help=u'Number of runs per command, of which the median is reported (default: 5)')
+    parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET,
+                        help=u'Maximum import time of %s in seconds (default: %s)' % (MODULE, IMPORT_TIME_BUDGET))
+    args = parser.parse_args(argv)
+
+    import_time, heavy_modules = measure_import()
+    print(u'import %s: %.3fs (budget: %.3fs)' % (MODULE, import_time, args.budget))
+    for name, command in COMMANDS:
+        print(u'ecs %s: %.3fs' % (name, measure_command(command, args.repeat)))
+
+    if heavy_modules:
+        print(u'Heavy modules loaded at import: %s' % u', '.join(heavy_modules))
+        return 1
+    if import_time > args.budget:
+        print(u'Import time exceeds the budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,4 @@
 VERSION = '1.15.2'
+
+LAUNCH_TYPE_EC2 = 'EC2'
+LAUNCH_TYPE_FARGATE = 'FARGATE'
@@ -0,0 +1,156 @@
+"""
+Asyncio variant of the ECS client and actions.
+
+boto3 has no asynchronous transport, so the blocking API calls are offloaded
+to a thread pool. A thread is only occupied for the duration of a single
+call, while waiting between the checks of a service does not occupy one, so
+a single event loop can drive many deployments at the same time:
+
+    client = AsyncEcsClient(EcsClient())
+    deployment = await AsyncDeployAction.create(client, 'my-cluster', 'my-service')
+    service = await deployment.get_service_snapshot()
+"""
+import asyncio
+import contextvars
+from functools import partial
+
+from ecs_deploy.ecs import EcsAction, DeployAction, ScaleAction, RunAction
+
+
+def run(coroutine):
+    """Runs the coroutine in a new event loop and returns its result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncEcsClient(object):
+    """Wraps an EcsClient. Every method of the client returns a coroutine,
+    which executes the call in the executor (default: the executor of the
+    running event loop).
+    """
+
+    def __init__(self, client, executor=None):
+        self._client = client
+        self._executor = executor
+
+    @property
+    def client(self):
+        return self._client
+
+    async def call(self, function, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        # the call runs in the context of the calling task (e.g. its output prefix)
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, partial(context.run, function, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+        return partial(self.call, attribute)
+
+
+class AsyncEcsAction(object):
+    action_class = EcsAction
+
+    def __init__(self, action, client=None):
+        self._action = action
+        self._client = client or AsyncEcsClient(action.client)
+
+    @classmethod
+    async def create(cls, client, *args, **kwargs):
+        """Creates the action, which fetches the service, in the executor."""
+        action = await client.call(cls.action_class, client.client, *args, **kwargs)
+        return cls(action, client)
+
+    def _call(self, method, *args, **kwargs):
+        return self._client.call(method, *args, **kwargs)
+
+    def get_service_snapshot(self):
+        return self._call(self._action.get_service_snapshot)
+
+    def get_current_task_definition(self, service):
+        return self._call(self._action.get_current_task_definition, service)
+
+    def get_task_definition(self, task_definition, use_cache=True):
+        return self._call(self._action.get_task_definition, task_definition, use_cache)
+
+    def find_task_definition(self, task_definition):
+        return self._call(self._action.find_task_definition, task_definition)
+
+    def update_task_definition(self, task_definition, fingerprint=False):
+        return self._call(self._action.update_task_definition, task_definition, fingerprint)
+
+    def deregister_task_definition(self, task_definition):
+        return self._call(self._action.deregister_task_definition, task_definition)
+
+    def is_deployed(self, service):
+        return self._call(self._action.is_deployed, service)
+
+    def set_waiter(self, waiter):
+        self._action.set_waiter(waiter)
+
+    def set_status_aggregator(self, status_aggregator):
+        self._action.set_status_aggregator(status_aggregator)
+
+    @property
+    def action(self):
+        return self._action
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def service(self):
+        return self._action.service
+
+    @property
+    def cluster_name(self):
+        return self._action.cluster_name
+
+    @property
+    def service_name(self):
+        return self._action.service_name
+
+    @property
+    def waiter(self):
+        return self._action.waiter
+
+
+class AsyncDeployAction(AsyncEcsAction):
+    action_class = DeployAction
+
+    def deploy(self, task_definition):
+        return self._call(self._action.deploy, task_definition)
+
+
+class AsyncScaleAction(AsyncEcsAction):
+    action_class = ScaleAction
+
+    def scale(self, desired_count):
+        return self._call(self._action.scale, desired_count)
+
+
+class AsyncRunAction(AsyncEcsAction):
+    action_class = RunAction
+
+    def run(self, task_definition, count, started_by, launchtype, subnets,
+            security_groups, public_ip, platform_version):
+        return self._call(self._action.run, task_definition, count, started_by, launchtype, subnets,
+                          security_groups, public_ip, platform_version)
+
+    @property
+    def started_tasks(self):
+        return self._action.started_tasks
+
+
+def get_async_action(action, client=None):
+    """Returns the asynchronous variant of a synchronous action."""
+    for action_class in (AsyncDeployAction, AsyncScaleAction, AsyncRunAction):
+        if isinstance(action, action_class.action_class):
+            return action_class(action, client)
+    return AsyncEcsAction(action, client)
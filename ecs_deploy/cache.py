@@ -0,0 +1,239 @@
+import calendar
+import copy
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from time import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ecs-deploy')
+
+# Cached credentials are considered expired this amount of seconds before
+# their actual expiration, so they do not expire during a deployment
+CREDENTIALS_EXPIRY_MARGIN = 300
+
+# Maximum number of task definitions kept in memory and on disk
+TASK_DEFINITION_CACHE_SIZE = 500
+
+# Seconds the index of scheduled tasks is reused, before all rules are
+# listed again
+RULE_INDEX_TTL = 300
+
+DISABLED_VALUES = ('0', 'false', 'no', 'off')
+
+
+def get_cache_dir(*path):
+    return os.path.join(os.getenv('ECS_DEPLOY_CACHE_DIR', CACHE_DIR), *path)
+
+
+def is_cache_enabled(name, default=True):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in DISABLED_VALUES
+
+
+def to_timestamp(value):
+    if not isinstance(value, datetime):
+        from dateutil.parser import parse as parse_datetime
+        value = parse_datetime(value)
+    return calendar.timegm(value.utctimetuple())
+
+
+class FileCache(object):
+    """JSON documents stored in one file per key. Reads take a shared and
+    writes an exclusive lock, so parallel processes can share the cache.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    @contextmanager
+    def lock(self, key, exclusive=True):
+        self._ensure_directory()
+        with open(self.get_path(key) + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key):
+        with self.lock(key, exclusive=False):
+            return self._read(key)
+
+    def set(self, key, value):
+        with self.lock(key):
+            self._write(key, value)
+
+    def delete(self, key):
+        with self.lock(key):
+            try:
+                os.remove(self.get_path(key))
+            except OSError:
+                pass
+
+    def _read(self, key):
+        try:
+            with open(self.get_path(key)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, key, value):
+        path = self.get_path(key)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f, default=str)
+        os.rename(temp_path, path)
+
+    def _ensure_directory(self):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o700)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+
+class CredentialCache(FileCache):
+    """Temporary credentials of assumed roles, keyed by target account,
+    role and the source credentials (profile or access key id).
+    """
+
+    def __init__(self, directory=None, expiry_margin=CREDENTIALS_EXPIRY_MARGIN):
+        super(CredentialCache, self).__init__(directory or get_cache_dir('sts'))
+        self.expiry_margin = expiry_margin
+
+    @staticmethod
+    def get_key(assume_account, assume_role, profile=None, access_key_id=None):
+        return u'%s|%s|%s|%s' % (assume_account, assume_role, profile or u'', access_key_id or u'')
+
+    def is_valid(self, credentials):
+        if not credentials or not credentials.get('Expiration'):
+            return False
+        return to_timestamp(credentials['Expiration']) - self.expiry_margin > time()
+
+    def fetch(self, key, request_credentials):
+        with self.lock(key):
+            credentials = self._read(key)
+            if self.is_valid(credentials):
+                return credentials
+            credentials = request_credentials()
+            self._write(key, credentials)
+            return credentials
+
+
+class RuleIndexCache(FileCache):
+    """The index of scheduled tasks (task definition family to EventBridge
+    rules and targets), keyed by the cache scope of the client. An index is
+    rebuilt, once it is older than ttl seconds.
+    """
+
+    def __init__(self, directory=None, ttl=RULE_INDEX_TTL):
+        super(RuleIndexCache, self).__init__(directory or get_cache_dir('rules'))
+        self.ttl = ttl
+
+    def fetch(self, key, build_index):
+        with self.lock(key):
+            entry = self._read(key)
+            if entry and entry.get('built_at', 0) + self.ttl > time():
+                return entry['index']
+            index = build_index()
+            self._write(key, {'index': index, 'built_at': time()})
+            return index
+
+
+class TaskDefinitionCache(object):
+    """Task definition payloads by immutable reference: a revision never
+    changes, once it is registered. Entries are kept in memory and
+    optionally on disk, both bounded to max_entries (least recently used
+    entries are evicted first).
+    """
+
+    def __init__(self, directory=None, max_entries=TASK_DEFINITION_CACHE_SIZE, disk=False):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = Lock()
+        self._disk = FileCache(directory or get_cache_dir('task-definitions')) if disk else None
+
+    @staticmethod
+    def has_revision(reference):
+        return u':' in reference.rpartition(u'/')[2]
+
+    def get(self, key):
+        with self._lock:
+            payload = self._memory.pop(key, None)
+            if payload is not None:
+                self._memory[key] = payload
+                return copy.deepcopy(payload)
+        if self._disk is None:
+            return None
+        payload = self._disk.get(key)
+        if payload is None:
+            return None
+        self._touch(key)
+        self._remember(key, payload)
+        return copy.deepcopy(payload)
+
+    def set(self, key, payload):
+        payload = copy.deepcopy(payload)
+        self._remember(key, payload)
+        if self._disk is not None:
+            self._disk.set(key, payload)
+            self._prune()
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key, payload):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._memory[key] = payload
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._disk.get_path(key), None)
+        except OSError:
+            pass
+
+    def _prune(self):
+        directory = self._disk.directory
+        try:
+            names = [name for name in os.listdir(directory) if name.endswith('.json')]
+        except OSError:
+            return
+        if len(names) <= self.max_entries:
+            return
+        paths = [os.path.join(directory, name) for name in names]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            for obsolete in (path, path + '.lock'):
+                try:
+                    os.remove(obsolete)
+                except OSError:
+                    pass
@@ -1,27 +1,55 @@
 from __future__ import print_function, absolute_import
 
+import logging
+import sys
 from os import getenv
-from time import sleep
 
 import click
+import click_log
 import json
 import getpass
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from botocore.exceptions import ClientError
-from ecs_deploy import VERSION
-from ecs_deploy.ecs import DeployAction, ScaleAction, RunAction, EcsClient, DiffAction, \
-    TaskPlacementError, EcsError, UpdateAction, LAUNCH_TYPE_EC2, LAUNCH_TYPE_FARGATE
-from ecs_deploy.newrelic import Deployment, NewRelicException
-from ecs_deploy.slack import SlackNotification
+from time import sleep
+from ecs_deploy import VERSION, LAUNCH_TYPE_EC2, LAUNCH_TYPE_FARGATE
+from ecs_deploy.metrics import MetricsCollector, set_collector
+from ecs_deploy.waiter import FixedWaiter, get_waiter, WAITER_FIXED, WAITER_ADAPTIVE
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every output line of the current deployment, so the output of
+# deployments running in parallel (deploy-many) can be told apart
+output_prefix = ContextVar('output_prefix', default=None)
 
 
 @click.group()
 @click.version_option(version=VERSION, prog_name='ecs-deploy')
-def ecs():  # pragma: no cover
-    pass
+@click.option('--metrics', is_flag=True, help='Print a summary of all AWS API calls (count, latency, retries, throttling) at the end of the command')
+@click.option('--metrics-file', type=click.Path(dir_okay=False), help='Write the metrics of all AWS API calls as JSON to this file at the end of the command')
+@click.pass_context
+def ecs(ctx, metrics, metrics_file):
+    click_log.basic_config(logging.getLogger('ecs_deploy'))
+    if metrics or metrics_file:
+        collect_metrics(ctx, metrics, metrics_file)
+
+
+def collect_metrics(ctx, print_summary, metrics_file):
+    collector = MetricsCollector()
+    set_collector(collector)
+
+    def report():
+        set_collector(None)
+        if print_summary:
+            click.secho(collector.format_summary(), err=True)
+        if metrics_file:
+            collector.write(metrics_file)
+
+    ctx.call_on_close(report)
 
 
 def get_client(access_key_id, secret_access_key, region, profile, assume_account, assume_role):
+    from ecs_deploy.ecs import EcsClient
+
     return EcsClient(access_key_id, secret_access_key, region, profile, assume_account=assume_account, assume_role=assume_role)
 
 
@@ -70,12 +98,17 @@ def get_client(access_key_id, secret_access_key, region, profile, assume_account
 @click.option('--user', required=False, help='User who executes the deployment (used for recording)')
 @click.option('--diff/--no-diff', default=True, help='Print which values were changed in the task definition (default: --diff)')
 @click.option('--deregister/--no-deregister', default=True, help='Deregister or keep the old task definition (default: --deregister)')
+@click.option('--reuse-task-definition', is_flag=True, default=False, help='Reuse an existing revision, which was registered with the same task definition, instead of registering a new one (the service is only redeployed, if it does not run that revision yet)')
+@click.option('--validate-images', is_flag=True, default=False, help='Resolve all changed images in their container registries before registering the task definition and fail, if an image does not exist. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+@click.option('--pin-digests', is_flag=True, default=False, help='Replace the images of all containers by their digests (e.g. my-app@sha256:...), so all tasks of the new revision run exactly the same images. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
 @click.option('--rollback/--no-rollback', default=False, help='Rollback to previous revision, if deployment failed (default: --no-rollback)')
 @click.option('--exclusive-env', is_flag=True, default=False, help='Set the given environment variables exclusively and remove all other pre-existing env variables from all containers')
 @click.option('--exclusive-secrets', is_flag=True, default=False, help='Set the given secrets exclusively and remove all other pre-existing secrets from all containers')
 @click.option('--exclusive-docker-labels', is_flag=True, default=False, help='Set the given docker labels exclusively and remove all other pre-existing docker-labels from all containers')
 @click.option('--exclusive-s3-env-file', is_flag=True, default=False, help='Set the given s3 env files exclusively and remove all other pre-existing s3 env files from all containers')
-@click.option('--sleep-time', default=1, type=int, help='Amount of seconds to wait between each check of the service (default: 1)')
+@click.option('--sleep-time', default=1, type=float, help='Amount of seconds to wait between each check of the service (default: 1). With --waiter adaptive this is the shortest wait')
+@click.option('--waiter', type=click.Choice([WAITER_FIXED, WAITER_ADAPTIVE]), default=WAITER_FIXED, help='Strategy for waiting between the checks of the service: fixed sleep time or adaptive backoff (default: fixed)')
+@click.option('--max-sleep-time', default=10, type=float, help='Maximum amount of seconds to wait between each check of the service with --waiter adaptive (default: 10)')
 @click.option('--slack-url', required=False, help='Webhook URL of the Slack integration. Can also be defined via environment variable SLACK_URL')
 @click.option('--slack-service-match', default=".*", required=False, help='A regular expression for defining, which services should be notified. (default: .* =all). Can also be defined via environment variable SLACK_SERVICE_MATCH')
 @click.option('--exclusive-ulimits', is_flag=True, default=False, help='Set the given ulimits exclusively and remove all other pre-existing ulimits from all containers')
@@ -85,7 +118,7 @@ def get_client(access_key_id, secret_access_key, region, profile, assume_account
 @click.option('--volume', type=(str, str), multiple=True, required=False, help='Set volume mapping from host to container in the task definition.')
 @click.option('--add-container', type=str, multiple=True, required=False, help='Add a placeholder container in the task definition.')
 @click.option('--remove-container', type=str, multiple=True, required=False, help='Remove a container from the task definition.')
-def deploy(cluster, service, tag, image, command, health_check, cpu, memory, memoryreservation, task_cpu, task_memory, privileged, essential, env, env_file, s3_env_file, secret, secrets_env_file, ulimit, system_control, port, mount, log, role, execution_role, runtime_platform, task, region, access_key_id, secret_access_key, profile, account, assume_role, timeout, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user, ignore_warnings, diff, deregister, rollback, exclusive_env, exclusive_secrets, exclusive_s3_env_file, sleep_time, exclusive_ulimits, exclusive_system_controls, exclusive_ports, exclusive_mounts, volume, add_container, remove_container, slack_url, docker_label, exclusive_docker_labels, slack_service_match='.*'):
+def deploy(cluster, service, tag, image, command, health_check, cpu, memory, memoryreservation, task_cpu, task_memory, privileged, essential, env, env_file, s3_env_file, secret, secrets_env_file, ulimit, system_control, port, mount, log, role, execution_role, runtime_platform, task, region, access_key_id, secret_access_key, profile, account, assume_role, timeout, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user, ignore_warnings, diff, deregister, reuse_task_definition, validate_images, pin_digests, rollback, exclusive_env, exclusive_secrets, exclusive_s3_env_file, sleep_time, exclusive_ulimits, exclusive_system_controls, exclusive_ports, exclusive_mounts, volume, add_container, remove_container, slack_url, docker_label, exclusive_docker_labels, waiter, max_sleep_time, slack_service_match='.*'):
     """
     Redeploy or modify a service.
 
@@ -97,41 +130,59 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
     It will just be duplicated, so that all container images will be pulled
     and redeployed.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import DeployAction, TaskPlacementError, EcsError, TaskDefinitionChangeSet
+    from ecs_deploy.newrelic import NewRelicException
+    from ecs_deploy.notification import get_dispatcher
+    from ecs_deploy.slack import SlackNotification
+
+    dispatcher = None
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
         deployment = DeployAction(client, cluster, service)
+        deployment.set_waiter(get_waiter(waiter, sleep_time, max_sleep_time))
 
         td = get_task_definition(deployment, task)
         # If there is a new container, add it at frist.
-        td.add_containers(add_container)
-        td.remove_containers(remove_container)
-        td.set_images(tag, **{key: value for (key, value) in image})
-        td.set_commands(**{key: value for (key, value) in command})
-        td.set_health_checks(health_check)
-        td.set_cpu(**{key: value for (key, value) in cpu})
-        td.set_memory(**{key: value for (key, value) in memory})
-        td.set_memoryreservation(**{key: value for (key, value) in memoryreservation})
-        td.set_task_cpu(task_cpu)
-        td.set_task_memory(task_memory)
-        td.set_privileged(**{key: value for (key, value) in privileged})
-        td.set_essential(**{key: value for (key, value) in essential})
-        td.set_environment(env, exclusive_env, env_file)
-        td.set_docker_labels(docker_label, exclusive_docker_labels)
-        td.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
-        td.set_secrets(secret, exclusive_secrets, secrets_env_file)
-        td.set_ulimits(ulimit, exclusive_ulimits)
-        td.set_system_controls(system_control, exclusive_system_controls)
-        td.set_port_mappings(port, exclusive_ports)
-        td.set_mount_points(mount, exclusive_mounts)
-        td.set_log_configurations(log)
-        td.set_role_arn(role)
-        td.set_execution_role_arn(execution_role)
-        td.set_runtime_platform(runtime_platform)
-        td.set_volumes(volume)
-
+        changes = TaskDefinitionChangeSet()
+        changes.add_containers(add_container)
+        changes.remove_containers(remove_container)
+        changes.set_images(tag, **{key: value for (key, value) in image})
+        changes.set_commands(**{key: value for (key, value) in command})
+        changes.set_health_checks(health_check)
+        changes.set_cpu(**{key: value for (key, value) in cpu})
+        changes.set_memory(**{key: value for (key, value) in memory})
+        changes.set_memoryreservation(**{key: value for (key, value) in memoryreservation})
+        changes.set_task_cpu(task_cpu)
+        changes.set_task_memory(task_memory)
+        changes.set_privileged(**{key: value for (key, value) in privileged})
+        changes.set_essential(**{key: value for (key, value) in essential})
+        changes.set_environment(env, exclusive_env, env_file)
+        changes.set_docker_labels(docker_label, exclusive_docker_labels)
+        changes.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
+        changes.set_secrets(secret, exclusive_secrets, secrets_env_file)
+        changes.set_ulimits(ulimit, exclusive_ulimits)
+        changes.set_system_controls(system_control, exclusive_system_controls)
+        changes.set_port_mappings(port, exclusive_ports)
+        changes.set_mount_points(mount, exclusive_mounts)
+        changes.set_log_configurations(log)
+        changes.set_role_arn(role)
+        changes.set_execution_role_arn(execution_role)
+        changes.set_runtime_platform(runtime_platform)
+        changes.set_volumes(volume)
+        td.apply_changes(changes)
+
+        if validate_images:
+            validate_changed_images(client, td)
+
+        if pin_digests:
+            pin_image_digests(client, td)
+
+        dispatcher = get_dispatcher()
         slack = SlackNotification(
             getenv('SLACK_URL', slack_url),
-            getenv('SLACK_SERVICE_MATCH', slack_service_match)
+            getenv('SLACK_SERVICE_MATCH', slack_service_match),
+            dispatcher=dispatcher
         )
         slack.notify_start(cluster, tag, td, comment, user, service=service)
 
@@ -140,7 +191,7 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
         if diff:
             print_diff(td)
 
-        new_td = create_task_definition(deployment, td)
+        new_td = create_task_definition(deployment, td, reuse_task_definition)
 
         try:
             deploy_task_definition(
@@ -150,7 +201,7 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
                 success_message='Deployment successful',
                 failure_message='Deployment failed',
                 timeout=timeout,
-                deregister=deregister,
+                deregister=deregister and not is_reused_revision(td, new_td, reuse_task_definition),
                 previous_task_definition=td,
                 ignore_warnings=ignore_warnings,
                 sleep_time=sleep_time
@@ -160,16 +211,95 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
             slack.notify_failure(cluster, str(e), service=service)
             if rollback:
                 click.secho('%s\n' % str(e), fg='red', err=True)
-                rollback_task_definition(deployment, td, new_td, sleep_time=sleep_time)
+                rollback_task_definition(deployment, td, new_td, sleep_time=sleep_time,
+                                         deregister=not is_reused_revision(td, new_td, reuse_task_definition))
+                flush_notifications(dispatcher, ignore_errors=True)
                 exit(1)
             else:
                 raise
 
-        record_deployment(tag, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user)
+        record_deployment(tag, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user,
+                          dispatcher=dispatcher)
 
         slack.notify_success(cluster, td.revision, service=service)
 
+        flush_notifications(dispatcher)
+
     except (EcsError, NewRelicException, ClientError) as e:
+        click.secho('%s\n' % str(e), fg='red', err=True)
+        flush_notifications(dispatcher, ignore_errors=True)
+        exit(1)
+
+
+@click.command(name='deploy-many')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('-t', '--tag', help='Changes the tag for ALL container images of services without an explicit tag in the manifest')
+@click.option('--concurrency', default=5, type=click.IntRange(min=1), help='Maximum number of services deployed at the same time (default: 5)')
+@click.option('--region', required=False, help='AWS region (e.g. eu-central-1)')
+@click.option('--access-key-id', required=False, help='AWS access key id')
+@click.option('--secret-access-key', required=False, help='AWS secret access key')
+@click.option('--profile', required=False, help='AWS configuration profile name')
+@click.option('--account', help='Target AWS account id to deploy in')
+@click.option('--assume-role', help='AWS Role to assume in target account')
+@click.option('--timeout', required=False, default=300, type=int, help='Amount of seconds to wait for each deployment before it fails (default: 300). To disable timeout (fire and forget) set to -1')
+@click.option('--ignore-warnings', is_flag=True, help='Do not fail deployments on warnings (port already in use or insufficient memory/CPU)')
+@click.option('--diff/--no-diff', default=True, help='Print which values were changed in the task definitions (default: --diff)')
+@click.option('--deregister/--no-deregister', default=True, help='Deregister or keep the old task definitions (default: --deregister)')
+@click.option('--reuse-task-definition', is_flag=True, default=False, help='Reuse an existing revision, which was registered with the same task definition, instead of registering a new one (services are only redeployed, if they do not run that revision yet)')
+@click.option('--validate-images', is_flag=True, default=False, help='Resolve all changed images in their container registries before registering the task definition and fail, if an image does not exist. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+@click.option('--pin-digests', is_flag=True, default=False, help='Replace the images of all containers by their digests (e.g. my-app@sha256:...), so all tasks of the new revision run exactly the same images. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+@click.option('--rollback/--no-rollback', default=False, help='Rollback to previous revision, if a deployment failed (default: --no-rollback)')
+@click.option('--sleep-time', default=1, type=float, help='Amount of seconds to wait between each check of a service (default: 1). With --waiter adaptive this is the shortest wait')
+@click.option('--waiter', type=click.Choice([WAITER_FIXED, WAITER_ADAPTIVE]), default=WAITER_FIXED, help='Strategy for waiting between the checks of a service: fixed sleep time or adaptive backoff (default: fixed)')
+@click.option('--max-sleep-time', default=10, type=float, help='Maximum amount of seconds to wait between each check of a service with --waiter adaptive (default: 10)')
+def deploy_many(manifest, tag, concurrency, region, access_key_id, secret_access_key, profile, account, assume_role, timeout, ignore_warnings, diff, deregister, reuse_task_definition, validate_images, pin_digests, rollback, sleep_time, waiter, max_sleep_time):
+    """
+    Redeploy or modify several services in parallel.
+
+    \b
+    MANIFEST is a JSON file listing the services to deploy, e.g.:
+    [{"cluster": "my-cluster", "service": "my-app", "tag": "1.2.3"},
+     {"cluster": "my-cluster", "service": "my-worker",
+      "image": {"worker": "my-worker:1.2.3"},
+      "env": {"worker": {"QUEUE": "default"}}}]
+
+    Besides "cluster" and "service", every entry may define "task", "tag",
+    "image", "command", "env", "secret" and "docker_label".
+    """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.aio import AsyncEcsClient, run
+    from ecs_deploy.ecs import EcsError, ServiceStatusAggregator
+
+    try:
+        services = read_manifest(manifest)
+        client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
+        status_aggregator = ServiceStatusAggregator(client, max_age=sleep_time)
+
+        results = run(deploy_services_async(
+            client=AsyncEcsClient(client),
+            status_aggregator=status_aggregator,
+            services=services,
+            concurrency=concurrency,
+            tag=tag,
+            timeout=timeout,
+            ignore_warnings=ignore_warnings,
+            diff=diff,
+            deregister=deregister,
+            reuse_task_definition=reuse_task_definition,
+            validate_images=validate_images,
+            pin_digests=pin_digests,
+            rollback=rollback,
+            waiter=waiter,
+            sleep_time=sleep_time,
+            max_sleep_time=max_sleep_time,
+        ))
+
+        print_deployment_results(results)
+
+        if any(not result.successful for result in results):
+            exit(1)
+
+    except (EcsError, ClientError) as e:
         click.secho('%s\n' % str(e), fg='red', err=True)
         exit(1)
 
@@ -177,7 +307,11 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
 @click.command()
 @click.argument('cluster')
 @click.argument('task')
-@click.argument('rule')
+@click.argument('rules', nargs=-1)
+@click.option('--rule-prefix', help='Update all rules, whose name starts with the given prefix (in addition to the given rules)')
+@click.option('--discover', is_flag=True, default=False, help='Update all rules with targets of the task definition family (in addition to the given rules), found via an index of all rules, which is cached for 5 minutes')
+@click.option('--refresh-index', is_flag=True, default=False, help='Rebuild the index of all rules for --discover instead of using the cached one')
+@click.option('--concurrency', default=5, type=click.IntRange(min=1), help='Maximum number of rules updated at the same time (default: 5)')
 @click.option('-i', '--image', type=(str, str), multiple=True, help='Overwrites the image for a container: <container> <image>')
 @click.option('-t', '--tag', help='Changes the tag for ALL container images')
 @click.option('-c', '--command', type=(str, str), multiple=True, help='Overwrites the command in a container: <container> <command>')
@@ -214,6 +348,9 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
 @click.option('--assume-role', help='AWS Role to assume in target account')
 @click.option('--diff/--no-diff', default=True, help='Print what values were changed in the task definition')
 @click.option('--deregister/--no-deregister', default=True, help='Deregister or keep the old task definition (default: --deregister)')
+@click.option('--reuse-task-definition', is_flag=True, default=False, help='Reuse an existing revision, which was registered with the same task definition, instead of registering a new one')
+@click.option('--validate-images', is_flag=True, default=False, help='Resolve all changed images in their container registries before registering the task definition and fail, if an image does not exist. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+@click.option('--pin-digests', is_flag=True, default=False, help='Replace the images of all containers by their digests (e.g. my-app@sha256:...), so all tasks of the new revision run exactly the same images. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
 @click.option('--rollback/--no-rollback', default=False, help='Rollback to previous revision, if deployment failed (default: --no-rollback)')
 @click.option('--exclusive-env', is_flag=True, default=False, help='Set the given environment variables exclusively and remove all other pre-existing env variables from all containers')
 @click.option('--exclusive-secrets', is_flag=True, default=False, help='Set the given secrets exclusively and remove all other pre-existing secrets from all containers')
@@ -226,71 +363,125 @@ def deploy(cluster, service, tag, image, command, health_check, cpu, memory, mem
 @click.option('--exclusive-ports', is_flag=True, default=False, help='Set the given port mappings exclusively and remove all other pre-existing port mappings from all containers')
 @click.option('--exclusive-mounts', is_flag=True, default=False, help='Set the given mount points exclusively and remove all other pre-existing mount points from all containers')
 @click.option('--volume', type=(str, str), multiple=True, required=False, help='Set volume mapping from host to container in the task definition.')
-def cron(cluster, task, rule, image, tag, command, cpu, memory, memoryreservation, task_cpu, task_memory, privileged, env, env_file, s3_env_file, secret, secrets_env_file, ulimit, system_control, port, mount, log, role, execution_role, region, access_key_id, secret_access_key, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user, profile, account, assume_role, diff, deregister, rollback, exclusive_env, exclusive_secrets, exclusive_s3_env_file, slack_url, slack_service_match, exclusive_ulimits, exclusive_system_controls, exclusive_ports, exclusive_mounts, volume, docker_label, exclusive_docker_labels):
+def cron(cluster, task, rules, rule_prefix, discover, refresh_index, concurrency, image, tag, command, cpu, memory, memoryreservation, task_cpu, task_memory, privileged, env, env_file, s3_env_file, secret, secrets_env_file, ulimit, system_control, port, mount, log, role, execution_role, region, access_key_id, secret_access_key, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user, profile, account, assume_role, diff, deregister, reuse_task_definition, validate_images, pin_digests, rollback, exclusive_env, exclusive_secrets, exclusive_s3_env_file, slack_url, slack_service_match, exclusive_ulimits, exclusive_system_controls, exclusive_ports, exclusive_mounts, volume, docker_label, exclusive_docker_labels):
     """
     Update a scheduled task.
 
     \b
     CLUSTER is the name of your cluster (e.g. 'my-cluster') within ECS.
     TASK is the name of your task definition (e.g. 'my-task') within ECS.
-    RULE is the name of the rule to use the new task definition.
+    RULES are the names of the rules to use the new task definition.
+
+    All targets of the rules, which run a revision of TASK, are updated.
+    Rules given by name, without such targets, get their first target
+    updated. Other rules without such targets are skipped.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import CronAction, EcsError, TaskDefinitionChangeSet
+    from ecs_deploy.newrelic import NewRelicException
+    from ecs_deploy.notification import get_dispatcher
+    from ecs_deploy.slack import SlackNotification
+
+    dispatcher = None
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
-        action = RunAction(client, cluster)
+        action = CronAction(client, cluster)
 
         td = action.get_task_definition(task)
-        click.secho('Update task definition based on: %s\n' % td.family_revision)
 
-        td.set_images(tag, **{key: value for (key, value) in image})
-        td.set_commands(**{key: value for (key, value) in command})
-        td.set_cpu(**{key: value for (key, value) in cpu})
-        td.set_memory(**{key: value for (key, value) in memory})
-        td.set_memoryreservation(**{key: value for (key, value) in memoryreservation})
-        td.set_task_cpu(task_cpu)
-        td.set_task_memory(task_memory)
-        td.set_privileged(**{key: value for (key, value) in privileged})
-        td.set_environment(env, exclusive_env, env_file)
-        td.set_docker_labels(docker_label, exclusive_docker_labels)
-        td.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
-        td.set_secrets(secret, exclusive_secrets, secrets_env_file)
-        td.set_ulimits(ulimit, exclusive_ulimits)
-        td.set_system_controls(system_control, exclusive_system_controls)
-        td.set_port_mappings(port, exclusive_ports)
-        td.set_mount_points(mount, exclusive_mounts)
-        td.set_log_configurations(log)
-        td.set_role_arn(role)
-        td.set_execution_role_arn(execution_role)
-        td.set_volumes(volume)
+        named_rules = rules
+        rules = action.get_rules(named_rules, rule_prefix, td.family if discover else None, refresh_index)
+        if not rules:
+            if discover:
+                raise EcsError(u'No rules found with targets of task definition family: %s' % td.family)
+            if rule_prefix:
+                raise EcsError(u'No rules found with prefix: %s' % rule_prefix)
+            raise EcsError(u'Please specify at least one rule, a --rule-prefix or --discover')
 
+        click.secho('Update task definition based on: %s\n' % td.family_revision)
+
+        changes = TaskDefinitionChangeSet()
+        changes.set_images(tag, **{key: value for (key, value) in image})
+        changes.set_commands(**{key: value for (key, value) in command})
+        changes.set_cpu(**{key: value for (key, value) in cpu})
+        changes.set_memory(**{key: value for (key, value) in memory})
+        changes.set_memoryreservation(**{key: value for (key, value) in memoryreservation})
+        changes.set_task_cpu(task_cpu)
+        changes.set_task_memory(task_memory)
+        changes.set_privileged(**{key: value for (key, value) in privileged})
+        changes.set_environment(env, exclusive_env, env_file)
+        changes.set_docker_labels(docker_label, exclusive_docker_labels)
+        changes.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
+        changes.set_secrets(secret, exclusive_secrets, secrets_env_file)
+        changes.set_ulimits(ulimit, exclusive_ulimits)
+        changes.set_system_controls(system_control, exclusive_system_controls)
+        changes.set_port_mappings(port, exclusive_ports)
+        changes.set_mount_points(mount, exclusive_mounts)
+        changes.set_log_configurations(log)
+        changes.set_role_arn(role)
+        changes.set_execution_role_arn(execution_role)
+        changes.set_volumes(volume)
+        td.apply_changes(changes)
+
+        if validate_images:
+            validate_changed_images(client, td)
+
+        if pin_digests:
+            pin_image_digests(client, td)
+
+        dispatcher = get_dispatcher()
         slack = SlackNotification(
             getenv('SLACK_URL', slack_url),
-            getenv('SLACK_SERVICE_MATCH', slack_service_match)
+            getenv('SLACK_SERVICE_MATCH', slack_service_match),
+            dispatcher=dispatcher
         )
-        slack.notify_start(cluster, tag, td, comment, user, rule=rule)
+        rule_names = u', '.join(rules)
+        slack.notify_start(cluster, tag, td, comment, user, rule=rule_names)
 
         if diff:
             print_diff(td)
 
-        new_td = create_task_definition(action, td)
+        new_td = create_task_definition(action, td, reuse_task_definition)
 
-        client.update_rule(
-            cluster=cluster,
-            rule=rule,
-            task_definition=new_td
-        )
-        click.secho('Updating scheduled task')
-        click.secho('Successfully updated scheduled task %s\n' % rule, fg='green')
+        if len(rules) == 1:
+            click.secho('Updating scheduled task')
+        else:
+            click.secho('Updating %d scheduled tasks' % len(rules))
+        results = action.update_rules(rules, new_td, concurrency=concurrency, named_rules=named_rules)
+        failed = [(rule, error) for rule, _, error in results if error]
+        skipped = [rule for rule, target_ids, error in results if not error and not target_ids]
+        for rule, target_ids, error in results:
+            if error:
+                click.secho('- %s: %s' % (rule, error), fg='red', err=True)
+            elif not target_ids:
+                click.secho('Skipped scheduled task %s (no targets of %s)' % (rule, td.family))
+            else:
+                click.secho('Successfully updated scheduled task %s (%d targets)' % (rule, len(target_ids)),
+                            fg='green')
+        click.secho('')
+
+        error = None
+        if failed:
+            error = u'Failed to update %d of %d scheduled tasks' % (len(failed), len(rules))
+        elif len(skipped) == len(rules):
+            error = u'No rules found with targets of task definition family: %s' % td.family
+        if error:
+            slack.notify_failure(cluster, error, rule=rule_names)
+            raise EcsError(error)
 
-        slack.notify_success(cluster, td.revision, rule=rule)
+        slack.notify_success(cluster, td.revision, rule=rule_names)
 
-        record_deployment(tag, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user)
+        record_deployment(tag, newrelic_apikey, newrelic_appid, newrelic_region, newrelic_revision, comment, user,
+                          dispatcher=dispatcher)
 
-        if deregister:
+        if deregister and not is_reused_revision(td, new_td, reuse_task_definition):
             deregister_task_definition(action, td)
 
-    except (EcsError, ClientError) as e:
+        flush_notifications(dispatcher)
+
+    except (EcsError, NewRelicException, ClientError) as e:
         click.secho('%s\n' % str(e), fg='red', err=True)
+        flush_notifications(dispatcher, ignore_errors=True)
         exit(1)
 
 
@@ -319,13 +510,19 @@ def cron(cluster, task, rule, image, tag, command, cpu, memory, memoryreservatio
 @click.option('--exclusive-docker-labels', is_flag=True, default=False, help='Set the given docker labels exclusively and remove all other pre-existing docker-labels from all containers')
 @click.option('--exclusive-s3-env-file', is_flag=True, default=False, help='Set the given s3 env files exclusively and remove all other pre-existing s3 env files from all containers')
 @click.option('--deregister/--no-deregister', default=True, help='Deregister or keep the old task definition (default: --deregister)')
-def update(task, image, tag, command, env, env_file, s3_env_file, secret, secrets_env_file, role, region, access_key_id, secret_access_key, profile, account, assume_role, diff, exclusive_env, exclusive_s3_env_file, exclusive_secrets, runtime_platform, deregister, docker_label, exclusive_docker_labels):
+@click.option('--reuse-task-definition', is_flag=True, default=False, help='Reuse an existing revision, which was registered with the same task definition, instead of registering a new one')
+@click.option('--validate-images', is_flag=True, default=False, help='Resolve all changed images in their container registries before registering the task definition and fail, if an image does not exist. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+@click.option('--pin-digests', is_flag=True, default=False, help='Replace the images of all containers by their digests (e.g. my-app@sha256:...), so all tasks of the new revision run exactly the same images. Private registries other than ECR are only supported, if they issue anonymous pull tokens')
+def update(task, image, tag, command, env, env_file, s3_env_file, secret, secrets_env_file, role, region, access_key_id, secret_access_key, profile, account, assume_role, diff, exclusive_env, exclusive_s3_env_file, exclusive_secrets, runtime_platform, deregister, reuse_task_definition, validate_images, pin_digests, docker_label, exclusive_docker_labels):
     """
     Update a task definition.
 
     \b
     TASK is the name of your task definition family (e.g. 'my-task') within ECS.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import EcsError, UpdateAction, TaskDefinitionChangeSet
+
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
         action = UpdateAction(client)
@@ -333,21 +530,29 @@ def update(task, image, tag, command, env, env_file, s3_env_file, secret, secret
         td = action.get_task_definition(task)
         click.secho('Update task definition based on: %s\n' % td.family_revision)
 
-        td.set_images(tag, **{key: value for (key, value) in image})
-        td.set_commands(**{key: value for (key, value) in command})
-        td.set_environment(env, exclusive_env, env_file)
-        td.set_docker_labels(docker_label, exclusive_docker_labels)
-        td.set_secrets(secret, exclusive_secrets, secrets_env_file)
-        td.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
-        td.set_role_arn(role)
-        td.set_runtime_platform(runtime_platform)
+        changes = TaskDefinitionChangeSet()
+        changes.set_images(tag, **{key: value for (key, value) in image})
+        changes.set_commands(**{key: value for (key, value) in command})
+        changes.set_environment(env, exclusive_env, env_file)
+        changes.set_docker_labels(docker_label, exclusive_docker_labels)
+        changes.set_secrets(secret, exclusive_secrets, secrets_env_file)
+        changes.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
+        changes.set_role_arn(role)
+        changes.set_runtime_platform(runtime_platform)
+        td.apply_changes(changes)
+
+        if validate_images:
+            validate_changed_images(client, td)
+
+        if pin_digests:
+            pin_image_digests(client, td)
 
         if diff:
             print_diff(td)
 
-        create_task_definition(action, td)
+        new_td = create_task_definition(action, td, reuse_task_definition)
 
-        if deregister:
+        if deregister and not is_reused_revision(td, new_td, reuse_task_definition):
             deregister_task_definition(action, td)
 
     except (EcsError, ClientError) as e:
@@ -367,8 +572,10 @@ def update(task, image, tag, command, env, env_file, s3_env_file, secret, secret
 @click.option('--assume-role', help='AWS Role to assume in target account')
 @click.option('--timeout', default=300, type=int, help='Amount of seconds to wait for deployment before command fails (default: 300). To disable timeout (fire and forget) set to -1')
 @click.option('--ignore-warnings', is_flag=True, help='Do not fail deployment on warnings (port already in use or insufficient memory/CPU)')
-@click.option('--sleep-time', default=1, type=int, help='Amount of seconds to wait between each check of the service (default: 1)')
-def scale(cluster, service, desired_count, access_key_id, secret_access_key, region, profile, account, assume_role, timeout, ignore_warnings, sleep_time):
+@click.option('--sleep-time', default=1, type=float, help='Amount of seconds to wait between each check of the service (default: 1). With --waiter adaptive this is the shortest wait')
+@click.option('--waiter', type=click.Choice([WAITER_FIXED, WAITER_ADAPTIVE]), default=WAITER_FIXED, help='Strategy for waiting between the checks of the service: fixed sleep time or adaptive backoff (default: fixed)')
+@click.option('--max-sleep-time', default=10, type=float, help='Maximum amount of seconds to wait between each check of the service with --waiter adaptive (default: 10)')
+def scale(cluster, service, desired_count, access_key_id, secret_access_key, region, profile, account, assume_role, timeout, ignore_warnings, sleep_time, waiter, max_sleep_time):
     """
     Scale a service up or down.
 
@@ -377,9 +584,13 @@ def scale(cluster, service, desired_count, access_key_id, secret_access_key, reg
     SERVICE is the name of your service (e.g. 'my-app') within ECS.
     DESIRED_COUNT is the number of tasks your service should run.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import ScaleAction, EcsError
+
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
         scaling = ScaleAction(client, cluster, service)
+        scaling.set_waiter(get_waiter(waiter, sleep_time, max_sleep_time))
         click.secho('Updating service')
         scaling.scale(desired_count)
         click.secho(
@@ -428,7 +639,10 @@ def scale(cluster, service, desired_count, access_key_id, secret_access_key, reg
 @click.option('--exclusive-docker-labels', is_flag=True, default=False, help='Set the given docker labels exclusively and remove all other pre-existing docker-labels from all containers')
 @click.option('--exclusive-s3-env-file', is_flag=True, default=False, help='Set the given s3 env files exclusively and remove all other pre-existing s3 env files from all containers')
 @click.option('--diff/--no-diff', default=True, help='Print what values were changed in the task definition')
-def run(cluster, task, count, command, env, env_file, s3_env_file, secret, secrets_env_file, launchtype, subnet, securitygroup, public_ip, platform_version, region, access_key_id, secret_access_key, profile, account, assume_role, exclusive_env, exclusive_secrets, exclusive_s3_env_file, diff, docker_label, exclusive_docker_labels):
+@click.option('--wait', is_flag=True, default=False, help='Wait until all started tasks stopped, print the exit codes of their containers and fail, if an essential container exited with a non-zero exit code or not all tasks could be started')
+@click.option('--timeout', default=600, type=int, help='Amount of seconds to wait for the tasks with --wait before the command fails (default: 600). To wait without limit set to -1')
+@click.option('--sleep-time', default=5, type=float, help='Amount of seconds to wait between each check of the tasks with --wait (default: 5)')
+def run(cluster, task, count, command, env, env_file, s3_env_file, secret, secrets_env_file, launchtype, subnet, securitygroup, public_ip, platform_version, region, access_key_id, secret_access_key, profile, account, assume_role, exclusive_env, exclusive_secrets, exclusive_s3_env_file, diff, wait, timeout, sleep_time, docker_label, exclusive_docker_labels):
     """
     Run a one-off task.
 
@@ -436,17 +650,26 @@ def run(cluster, task, count, command, env, env_file, s3_env_file, secret, secre
     CLUSTER is the name of your cluster (e.g. 'my-cluster') within ECS.
     TASK is the name of your task definition (e.g. 'my-task') within ECS.
     COUNT is the number of tasks your service should run.
+
+    With --wait, the exit code is the first non-zero exit code of the
+    essential containers of the tasks. It is 1, if fewer tasks than COUNT
+    could be started.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import RunAction, EcsError, TaskDefinitionChangeSet
+
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
         action = RunAction(client, cluster)
 
         td = action.get_task_definition(task)
-        td.set_commands(**{key: value for (key, value) in command})
-        td.set_environment(env, exclusive_env, env_file)
-        td.set_docker_labels(docker_label, exclusive_docker_labels)
-        td.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
-        td.set_secrets(secret, exclusive_secrets, secrets_env_file)
+        changes = TaskDefinitionChangeSet()
+        changes.set_commands(**{key: value for (key, value) in command})
+        changes.set_environment(env, exclusive_env, env_file)
+        changes.set_docker_labels(docker_label, exclusive_docker_labels)
+        changes.set_s3_env_file(s3_env_file, exclusive_s3_env_file)
+        changes.set_secrets(secret, exclusive_secrets, secrets_env_file)
+        td.apply_changes(changes)
 
         if diff:
             print_diff(td, 'Using task definition: %s' % task)
@@ -465,6 +688,35 @@ def run(cluster, task, count, command, env, env_file, s3_env_file, secret, secre
             click.secho('- %s' % started_task['taskArn'], fg='green')
         click.secho(' ')
 
+        if action.failures:
+            click.secho('Failed to start %d instances of task: %s' % (len(action.failures), td.family_revision),
+                        fg='red', err=True)
+            for failure in action.failures:
+                click.secho('- %s' % format_run_failure(failure), fg='red', err=True)
+            click.secho(' ', err=True)
+
+        if wait:
+            task_arns = [started_task['taskArn'] for started_task in action.started_tasks]
+            tasks, pending = wait_for_tasks(action, task_arns, timeout, sleep_time) if task_arns else ([], [])
+            print_task_results(tasks)
+
+            if pending:
+                click.secho('Timeout: %d of %d tasks did not stop within %d seconds\n' % (
+                    len(pending), len(task_arns), timeout
+                ), fg='red', err=True)
+                exit(1)
+
+            failed = [stopped_task for stopped_task in tasks if not stopped_task.succeeded]
+            if failed:
+                click.secho('%d of %d tasks failed\n' % (len(failed), len(tasks)), fg='red', err=True)
+                exit(failed[0].exit_code or 1)
+
+            if len(task_arns) < count:
+                click.secho('Only %d of %d tasks started\n' % (len(task_arns), count), fg='red', err=True)
+                exit(1)
+
+            click.secho('All %d tasks succeeded\n' % len(tasks), fg='green')
+
     except (EcsError, ClientError) as e:
         click.secho('%s\n' % str(e), fg='red', err=True)
         exit(1)
@@ -488,6 +740,8 @@ def diff(task, revision_a, revision_b, region, access_key_id, secret_access_key,
     TASK is the name of your task definition (e.g. 'my-task') within ECS.
     COUNT is the number of tasks your service should run.
     """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import DiffAction, EcsError
 
     try:
         client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
@@ -518,13 +772,332 @@ def diff(task, revision_a, revision_b, region, access_key_id, secret_access_key,
         exit(1)
 
 
+@click.command()
+@click.argument('family')
+@click.option('--keep', default=10, type=click.IntRange(min=0), help='Number of newest revisions to keep (default: 10)')
+@click.option('--cluster', multiple=True, help='Cluster whose services are checked for revisions in use (default: all clusters)')
+@click.option('--concurrency', default=5, type=click.IntRange(min=1), help='Maximum number of revisions deregistered at the same time (default: 5)')
+@click.option('--rate', default=5, type=click.FloatRange(min=0), help='Maximum number of revisions deregistered per second (default: 5)')
+@click.option('--dry-run', is_flag=True, help='Only report which revisions would be deregistered')
+@click.option('--region', help='AWS region (e.g. eu-central-1)')
+@click.option('--access-key-id', help='AWS access key id')
+@click.option('--secret-access-key', help='AWS secret access key')
+@click.option('--profile', help='AWS configuration profile name')
+@click.option('--account', help='Target AWS account id to deploy in')
+@click.option('--assume-role', help='AWS Role to assume in target account')
+def gc(family, keep, cluster, concurrency, rate, dry_run, region, access_key_id, secret_access_key, profile, account, assume_role):
+    """
+    Deregister old revisions of a task definition family.
+
+    Keeps the newest revisions and all revisions, which are used by a
+    service or a scheduled task (EventBridge rule).
+
+    \b
+    FAMILY is the name of your task definition (e.g. 'my-task') within ECS.
+    """
+    from botocore.exceptions import ClientError
+    from ecs_deploy.ecs import EcsError, GarbageCollectAction
+
+    if rate == 0:
+        raise click.BadParameter('%s is not greater than 0.' % rate, param_hint="'--rate'")
+
+    try:
+        client = get_client(access_key_id, secret_access_key, region, profile, account, assume_role)
+        action = GarbageCollectAction(client)
+
+        kept, in_use, obsolete = action.get_obsolete_revisions(family, keep, cluster)
+
+        click.secho('Found %d active revisions of %s: keeping %d newest and %d in use\n' % (
+            len(kept) + len(in_use) + len(obsolete), family, len(kept), len(in_use)
+        ))
+
+        for arn in in_use:
+            click.secho('- %s (in use)' % arn, fg='yellow')
+
+        if not obsolete:
+            click.secho('No revisions to deregister\n', fg='green')
+            return
+
+        if dry_run:
+            click.secho('Would deregister %d revisions:' % len(obsolete))
+            for arn in obsolete:
+                click.secho('- %s' % arn)
+            click.secho('')
+            return
+
+        click.secho('Deregistering %d revisions' % len(obsolete))
+        results = action.deregister_revisions(obsolete, concurrency=concurrency, rate=rate)
+        failed = 0
+        for arn, error in results:
+            if error:
+                failed += 1
+                click.secho('- %s: %s' % (arn, error), fg='red', err=True)
+            else:
+                click.secho('- %s' % arn, fg='green')
+
+        click.secho('\nDeregistered %d revisions\n' % (len(results) - failed), fg='green')
+        if failed:
+            click.secho('Failed to deregister %d revisions\n' % failed, fg='red', err=True)
+            exit(1)
+
+    except (EcsError, ClientError) as e:
+        click.secho('%s\n' % str(e), fg='red', err=True)
+        exit(1)
+
+
+@click.command()
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), help='Path of the Unix socket to listen on (default: $ECS_DEPLOY_SOCKET or ~/.cache/ecs-deploy/daemon.sock)')
+@click.option('--idle-timeout', default=1800, type=click.IntRange(min=0), help='Shut down after this amount of seconds without commands, 0 to never shut down (default: 1800)')
+def serve(socket_path, idle_timeout):
+    """
+    Start a daemon, which keeps AWS clients and caches warm.
+
+    While the daemon is running, the deploy, scale, run, update and diff
+    commands are forwarded to it and executed in the environment and working
+    directory of the calling process. Commands are executed one at a time,
+    while the daemon is busy, they are executed locally.
+    """
+    from ecs_deploy.server import Daemon, DaemonError
+
+    daemon = Daemon(ecs, socket_path, idle_timeout)
+    try:
+        daemon.bind()
+    except (DaemonError, OSError) as e:
+        click.secho('%s\n' % str(e), fg='red', err=True)
+        exit(1)
+
+    click.secho('Listening on %s' % daemon.path)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+class DeploymentResult(object):
+    def __init__(self, cluster, service, successful, message):
+        self.cluster = cluster
+        self.service = service
+        self.successful = successful
+        self.message = message
+
+
+# Types of the optional fields of a service in a deploy-many manifest
+MANIFEST_STRING = 'string'
+MANIFEST_CONTAINER_STRINGS = 'container strings'
+MANIFEST_CONTAINER_VARIABLES = 'container variables'
+
+MANIFEST_FIELDS = {
+    'task': MANIFEST_STRING,
+    'tag': MANIFEST_STRING,
+    'image': MANIFEST_CONTAINER_STRINGS,
+    'command': MANIFEST_CONTAINER_STRINGS,
+    'env': MANIFEST_CONTAINER_VARIABLES,
+    'secret': MANIFEST_CONTAINER_VARIABLES,
+    'docker_label': MANIFEST_CONTAINER_VARIABLES,
+}
+
+MANIFEST_FIELD_TYPES = {
+    MANIFEST_STRING: u'a string',
+    MANIFEST_CONTAINER_STRINGS: u'an object of container names and strings',
+    MANIFEST_CONTAINER_VARIABLES: u'an object of container names and objects of names and strings',
+}
+
+
+def read_manifest(manifest):
+    from ecs_deploy.ecs import EcsError
+
+    try:
+        with open(manifest) as f:
+            services = json.load(f)
+    except (IOError, ValueError) as e:
+        raise EcsError(u'Unable to read manifest %s: %s' % (manifest, str(e)))
+
+    if isinstance(services, dict):
+        services = services.get('services')
+
+    if not isinstance(services, list) or not services:
+        raise EcsError(u'Manifest %s does not list any services' % manifest)
+
+    for definition in services:
+        if not isinstance(definition, dict) or not is_string(definition.get('cluster')) or \
+                not is_string(definition.get('service')):
+            raise EcsError(u'Every service in manifest %s requires a "cluster" and a "service"' % manifest)
+        for key, expected in MANIFEST_FIELDS.items():
+            if key in definition and not is_manifest_value(definition[key], expected):
+                raise EcsError(u'Invalid "%s" of service %s/%s in manifest %s: expected %s' % (
+                    key, definition['cluster'], definition['service'], manifest, MANIFEST_FIELD_TYPES[expected]
+                ))
+
+    return services
+
+
+def is_string(value):
+    return isinstance(value, str) and bool(value)
+
+
+def is_manifest_value(value, expected):
+    if expected == MANIFEST_STRING:
+        return isinstance(value, str)
+    if not isinstance(value, dict):
+        return False
+    if expected == MANIFEST_CONTAINER_STRINGS:
+        return all(isinstance(item, str) for item in value.values())
+    return all(
+        isinstance(variables, dict) and all(isinstance(item, str) for item in variables.values())
+        for variables in value.values()
+    )
+
+
+async def deploy_services_async(client, status_aggregator, services, concurrency, tag, timeout,
+                                ignore_warnings, diff, deregister, reuse_task_definition, rollback,
+                                waiter, sleep_time, max_sleep_time, validate_images=False, pin_digests=False):
+    """Deploys the services in one event loop, at most concurrency at the
+    same time, and returns their results in the order of the services.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deploy(definition):
+        # every deployment runs in its own task, so the prefix is its own as well
+        if concurrency > 1:
+            output_prefix.set(u'%s/%s: ' % (definition['cluster'], definition['service']))
+        async with semaphore:
+            return await deploy_service_async(
+                client=client,
+                status_aggregator=status_aggregator,
+                definition=definition,
+                tag=definition.get('tag', tag),
+                timeout=timeout,
+                ignore_warnings=ignore_warnings,
+                diff=diff,
+                deregister=deregister,
+                reuse_task_definition=reuse_task_definition,
+                validate_images=validate_images,
+                pin_digests=pin_digests,
+                rollback=rollback,
+                waiter=get_waiter(waiter, sleep_time, max_sleep_time),
+                sleep_time=sleep_time,
+            )
+
+    return await asyncio.gather(*[deploy(definition) for definition in services])
+
+
+async def deploy_service_async(client, status_aggregator, definition, tag, timeout,
+                               ignore_warnings, diff, deregister, rollback, waiter, sleep_time,
+                               reuse_task_definition=False, validate_images=False, pin_digests=False):
+    from botocore.exceptions import ClientError
+    from ecs_deploy.aio import AsyncDeployAction
+    from ecs_deploy.ecs import TaskPlacementError, EcsError, TaskDefinitionChangeSet
+
+    cluster = definition['cluster']
+    service = definition['service']
+
+    try:
+        deployment = await AsyncDeployAction.create(client, cluster, service, status_aggregator=status_aggregator)
+        deployment.set_waiter(waiter)
+
+        td = await client.call(get_task_definition, deployment.action, definition.get('task'))
+        changes = TaskDefinitionChangeSet()
+        changes.set_images(tag, **definition.get('image', {}))
+        changes.set_commands(**definition.get('command', {}))
+        changes.set_environment(get_manifest_variables(definition.get('env')))
+        changes.set_secrets(get_manifest_variables(definition.get('secret')))
+        changes.set_docker_labels(get_manifest_variables(definition.get('docker_label')))
+        td.apply_changes(changes)
+
+        if validate_images:
+            await client.call(validate_changed_images, client.client, td)
+
+        if pin_digests:
+            await client.call(pin_image_digests, client.client, td)
+
+        secho('Deploying %s/%s based on task definition: %s\n' % (cluster, service, td.family_revision))
+
+        if diff:
+            print_diff(td, 'Updating task definition of %s/%s' % (cluster, service))
+
+        new_td = await client.call(create_task_definition, deployment.action, td, reuse_task_definition)
+
+        try:
+            await deploy_task_definition_async(
+                deployment=deployment,
+                task_definition=new_td,
+                title='Deploying new task definition of %s/%s' % (cluster, service),
+                success_message='Deployment of %s/%s successful' % (cluster, service),
+                failure_message='Deployment of %s/%s failed' % (cluster, service),
+                timeout=timeout,
+                deregister=deregister and not is_reused_revision(td, new_td, reuse_task_definition),
+                previous_task_definition=td,
+                ignore_warnings=ignore_warnings,
+                sleep_time=sleep_time
+            )
+        except TaskPlacementError as e:
+            if not rollback:
+                raise
+            secho('%s\n' % str(e), fg='red', err=True)
+            await rollback_task_definition_async(deployment, td, new_td, sleep_time=sleep_time,
+                                                 deregister=not is_reused_revision(td, new_td, reuse_task_definition))
+            return DeploymentResult(cluster, service, False, u'Rolled back to %s' % td.family_revision)
+
+        return DeploymentResult(cluster, service, True, u'Deployed %s' % new_td.family_revision)
+
+    except (EcsError, ClientError) as e:
+        return DeploymentResult(cluster, service, False, str(e))
+
+    except Exception as e:
+        # a single service must never abort the deployment of the others
+        return DeploymentResult(cluster, service, False, u'Unexpected error: %s: %s' % (type(e).__name__, e))
+
+    finally:
+        status_aggregator.unregister(cluster, service)
+
+
+def get_manifest_variables(variables):
+    return tuple(
+        (container, name, value)
+        for container, values in (variables or {}).items()
+        for name, value in values.items()
+    )
+
+
+def print_deployment_results(results):
+    click.secho('Results:')
+    for result in results:
+        click.secho(
+            '- %s/%s: %s' % (result.cluster, result.service, result.message),
+            fg='green' if result.successful else 'red'
+        )
+    click.secho('')
+
+
 def wait_for_finish(action, timeout, title, success_message, failure_message,
                     ignore_warnings, sleep_time=1):
-    click.secho(title)
+    from ecs_deploy.aio import get_async_action, run
+
+    run(wait_for_finish_async(
+        action=get_async_action(action),
+        timeout=timeout,
+        title=title,
+        success_message=success_message,
+        failure_message=failure_message,
+        ignore_warnings=ignore_warnings,
+        sleep_time=sleep_time
+    ))
+
+
+async def wait_for_finish_async(action, timeout, title, success_message, failure_message,
+                                ignore_warnings, sleep_time=1):
+    import asyncio
+    from ecs_deploy.ecs import EventCursor
+
+    secho(title)
+    waiter = action.waiter or FixedWaiter(sleep_time)
     start_timestamp = datetime.now()
     waiting_timeout = datetime.now() + timedelta(seconds=timeout)
-    service = action.get_service()
+    service = await action.get_service_snapshot()
     inspected_until = None
+    cursor = EventCursor()
 
     if timeout == -1:
         waiting = False
@@ -532,46 +1105,68 @@ def wait_for_finish(action, timeout, title, success_message, failure_message,
         waiting = True
 
     while waiting and datetime.now() < waiting_timeout:
-        click.secho('.', nl=False)
-        service = action.get_service()
+        if not output_prefix.get():
+            secho('.', nl=False)
+        service = await action.get_service_snapshot()
         inspected_until = inspect_errors(
             service=service,
             failure_message=failure_message,
             ignore_warnings=ignore_warnings,
             since=inspected_until,
-            timeout=False
+            timeout=False,
+            cursor=cursor
         )
-        waiting = not action.is_deployed(service)
+        waiting = not await action.is_deployed(service)
 
         if waiting:
-            sleep(sleep_time)
+            await asyncio.sleep(waiter.next_delay(service))
 
     inspect_errors(
         service=service,
         failure_message=failure_message,
         ignore_warnings=ignore_warnings,
         since=inspected_until,
-        timeout=waiting
+        timeout=waiting,
+        cursor=cursor
     )
 
-    click.secho('\n%s' % success_message, fg='green')
-    click.secho('Duration: %s sec\n' % (datetime.now() - start_timestamp).seconds)
+    secho('\n%s' % success_message, fg='green')
+    secho('Duration: %s sec\n' % (datetime.now() - start_timestamp).seconds)
 
 
 def deploy_task_definition(deployment, task_definition, title, success_message,
                            failure_message, timeout, deregister,
                            previous_task_definition, ignore_warnings, sleep_time):
-    click.secho('Updating service')
-    deployment.deploy(task_definition)
+    from ecs_deploy.aio import get_async_action, run
+
+    run(deploy_task_definition_async(
+        deployment=get_async_action(deployment),
+        task_definition=task_definition,
+        title=title,
+        success_message=success_message,
+        failure_message=failure_message,
+        timeout=timeout,
+        deregister=deregister,
+        previous_task_definition=previous_task_definition,
+        ignore_warnings=ignore_warnings,
+        sleep_time=sleep_time
+    ))
+
+
+async def deploy_task_definition_async(deployment, task_definition, title, success_message,
+                                       failure_message, timeout, deregister,
+                                       previous_task_definition, ignore_warnings, sleep_time):
+    secho('Updating service')
+    await deployment.deploy(task_definition)
 
     message = 'Successfully changed task definition to: %s:%s\n' % (
         task_definition.family,
         task_definition.revision
     )
 
-    click.secho(message, fg='green')
+    secho(message, fg='green')
 
-    wait_for_finish(
+    await wait_for_finish_async(
         action=deployment,
         timeout=timeout,
         title=title,
@@ -582,7 +1177,7 @@ def deploy_task_definition(deployment, task_definition, title, success_message,
     )
 
     if deregister:
-        deregister_task_definition(deployment, previous_task_definition)
+        await deployment.client.call(deregister_task_definition, deployment.action, previous_task_definition)
 
 
 def get_task_definition(action, task):
@@ -593,11 +1188,76 @@ def get_task_definition(action, task):
     return task_definition
 
 
-def create_task_definition(action, task_definition):
-    click.secho('Creating new task definition revision')
-    new_td = action.update_task_definition(task_definition)
+def wait_for_tasks(action, task_arns, timeout=600, sleep_time=5):
+    """Polls the tasks until all of them stopped or the timeout is reached.
+    Only tasks, which did not stop yet, are described again. Returns the
+    stopped tasks and the ARNs of the tasks, which did not stop.
+    """
+    click.secho('Waiting for %d tasks to stop' % len(task_arns))
+    start_timestamp = datetime.now()
+    waiting_timeout = start_timestamp + timedelta(seconds=timeout)
+    stopped = {}
+    pending = list(task_arns)
 
-    click.secho(
+    while pending:
+        click.secho('.', nl=False)
+        for task in action.describe_tasks(pending):
+            if task.is_stopped:
+                stopped[task.arn] = task
+        pending = [task_arn for task_arn in pending if task_arn not in stopped]
+        if not pending or (timeout != -1 and datetime.now() >= waiting_timeout):
+            break
+        sleep(sleep_time)
+
+    click.secho('\nDuration: %s sec\n' % (datetime.now() - start_timestamp).seconds)
+    return [stopped[task_arn] for task_arn in task_arns if task_arn in stopped], pending
+
+
+def format_run_failure(failure):
+    message = failure.get('reason') or 'Unknown reason'
+    if failure.get('detail'):
+        message += ': %s' % failure['detail']
+    if failure.get('arn'):
+        message += ' (%s)' % failure['arn']
+    return message
+
+
+def print_task_results(tasks):
+    for task in tasks:
+        color = 'green' if task.succeeded else 'red'
+        click.secho('%s: %s' % (task.arn, task.stopped_reason or task.last_status), fg=color)
+        deciding_containers = task.deciding_containers
+        for container in task.containers:
+            exit_code = container.get('exitCode')
+            message = '- %s: exit code %s' % (container.get('name'), 'unknown' if exit_code is None else exit_code)
+            if container.get('reason'):
+                message += ' (%s)' % container['reason']
+            if container not in deciding_containers:
+                click.secho(message + ' (not essential)', fg='green' if exit_code == 0 else 'yellow')
+            else:
+                click.secho(message, fg='green' if exit_code == 0 else 'red')
+    click.secho('')
+
+
+def create_task_definition(action, task_definition, reuse=False):
+    if reuse and is_unchanged(task_definition) and is_active(action, task_definition):
+        # nothing changed, so the revision itself is the one to reuse
+        secho('Reusing unchanged task definition revision: %d\n' % task_definition.revision, fg='green')
+        return task_definition
+
+    if reuse:
+        existing_td = action.find_task_definition(task_definition)
+        if existing_td:
+            secho(
+                'Reusing task definition revision with the same definition: %d\n' % existing_td.revision,
+                fg='green'
+            )
+            return existing_td
+
+    secho('Creating new task definition revision')
+    new_td = action.update_task_definition(task_definition, fingerprint=reuse)
+
+    secho(
         'Successfully created revision: %d\n' % new_td.revision,
         fg='green'
     )
@@ -605,39 +1265,107 @@ def create_task_definition(action, task_definition):
     return new_td
 
 
+def is_active(action, task_definition):
+    """Whether the revision is still active. The cached status may be
+    outdated (e.g. the revision got deregistered by another process), so
+    the revision is described again.
+    """
+    return action.get_task_definition(task_definition.arn, use_cache=False).status != u'INACTIVE'
+
+
+def is_unchanged(task_definition):
+    """Whether no change set a value different from the one before, e.g.
+    deploying the tag a service already runs.
+    """
+    return all(diff.value == diff.old_value for diff in task_definition.diff)
+
+
+def get_changed_images(task_definition):
+    return [diff.value for diff in task_definition.diff if diff.field == u'image']
+
+
+def validate_changed_images(client, task_definition):
+    """Resolves the changed images of the task definition in parallel, so a
+    missing image or tag fails the command before anything is changed in ECS.
+    """
+    from ecs_deploy.registry import get_resolver, resolve_images
+
+    images = get_changed_images(task_definition)
+    if not images:
+        return {}
+
+    secho('Validating %d changed images' % len(images))
+    digests = resolve_images(images, get_resolver(client.session))
+    secho('All images exist\n', fg='green')
+    return digests
+
+
+def pin_image_digests(client, task_definition):
+    """Replaces the images of all containers by their digests, so every
+    task of the new revision runs the same images, even if a tag is moved.
+    """
+    from ecs_deploy.registry import ImageReference, get_resolver, resolve_images
+
+    images = [container[u'image'] for container in task_definition.containers if u'@' not in container[u'image']]
+    if not images:
+        return
+
+    secho('Pinning %d images to their digests' % len(set(images)))
+    digests = resolve_images(images, get_resolver(client.session))
+    task_definition.pin_images(dict(
+        (image, ImageReference(image).with_digest(digest)) for image, digest in digests.items()
+    ))
+    secho('Successfully pinned images\n', fg='green')
+
+
+def is_reused_revision(task_definition, new_task_definition, reuse):
+    """Whether the revision a deployment is based on got reused, in which
+    case it must not be deregistered.
+    """
+    return reuse and new_task_definition.arn == task_definition.arn
+
+
 def deregister_task_definition(action, task_definition):
-    click.secho('Deregister task definition revision')
+    secho('Deregister task definition revision')
     action.deregister_task_definition(task_definition)
-    click.secho(
+    secho(
         'Successfully deregistered revision: %d\n' % task_definition.revision,
         fg='green'
     )
 
 
-def rollback_task_definition(deployment, old, new, timeout=600, sleep_time=1):
-    click.secho(
+def rollback_task_definition(deployment, old, new, timeout=600, sleep_time=1, deregister=True):
+    from ecs_deploy.aio import get_async_action, run
+
+    run(rollback_task_definition_async(get_async_action(deployment), old, new, timeout, sleep_time, deregister))
+
+
+async def rollback_task_definition_async(deployment, old, new, timeout=600, sleep_time=1, deregister=True):
+    secho(
         'Rolling back to task definition: %s\n' % old.family_revision,
         fg='yellow',
     )
-    deploy_task_definition(
+    await deploy_task_definition_async(
         deployment=deployment,
         task_definition=old,
         title='Deploying previous task definition',
         success_message='Rollback successful',
         failure_message='Rollback failed. Please check ECS Console',
         timeout=timeout,
-        deregister=True,
+        deregister=deregister,
         previous_task_definition=new,
         ignore_warnings=False,
         sleep_time=sleep_time
     )
-    click.secho(
+    secho(
         'Deployment failed, but service has been rolled back to previous '
         'task definition: %s\n' % old.family_revision, fg='yellow', err=True
     )
 
 
-def record_deployment(tag, api_key, app_id, region, revision, comment, user):
+def record_deployment(tag, api_key, app_id, region, revision, comment, user, dispatcher=None):
+    from ecs_deploy.newrelic import Deployment
+
     api_key = getenv('NEW_RELIC_API_KEY', api_key)
     app_id = getenv('NEW_RELIC_APP_ID', app_id)
     region = getenv('NEW_RELIC_REGION', region)
@@ -651,9 +1379,15 @@ def record_deployment(tag, api_key, app_id, region, revision, comment, user):
 
     user = user or getpass.getuser()
 
+    deployment = Deployment(api_key, app_id, user, region)
+
+    if dispatcher:
+        click.secho('Recording deployment in New Relic (in the background)\n')
+        dispatcher.submit(deployment.deploy, revision, '', comment)
+        return True
+
     click.secho('Recording deployment in New Relic', nl=False)
 
-    deployment = Deployment(api_key, app_id, user, region)
     deployment.deploy(revision, '', comment)
 
     click.secho('\nDone\n', fg='green')
@@ -661,43 +1395,75 @@ def record_deployment(tag, api_key, app_id, region, revision, comment, user):
     return True
 
 
+def flush_notifications(dispatcher, ignore_errors=False):
+    """Waits for the pending notifications. Failed notifications are logged
+    as warnings and never fail the command; a failed New Relic recording is
+    raised, unless ignore_errors is set.
+    """
+    from ecs_deploy.newrelic import NewRelicException
+
+    if dispatcher is None:
+        return
+    recording_errors = []
+    for error in dispatcher.flush():
+        if isinstance(error, NewRelicException) and not ignore_errors:
+            recording_errors.append(error)
+        else:
+            logger.warning('Sending notification failed: %s', error)
+    if recording_errors:
+        raise recording_errors[0]
+
+
+def secho(message='', **styles):
+    """Like click.secho, but prefixes every line with the output prefix of
+    the current deployment, if any.
+    """
+    prefix = output_prefix.get()
+    if prefix and message:
+        message = u'\n'.join(prefix + line if line else line for line in message.split(u'\n'))
+    click.secho(message, **styles)
+
+
 def print_diff(task_definition, title='Updating task definition'):
     if task_definition.diff:
-        click.secho(title)
+        secho(title)
         for diff in task_definition.diff:
-            click.secho(str(diff), fg='blue')
-        click.secho('')
+            secho(str(diff), fg='blue')
+        secho('')
+
 
+def inspect_errors(service, failure_message, ignore_warnings, since, timeout, cursor=None):
+    from ecs_deploy.ecs import TaskPlacementError
 
-def inspect_errors(service, failure_message, ignore_warnings, since, timeout):
     error = False
     last_error_timestamp = since
-    warnings = service.get_warnings(since)
+    warnings = service.get_warnings(since, cursor=cursor)
     for timestamp in warnings:
         message = warnings[timestamp]
-        click.secho('')
+        secho('')
         if ignore_warnings:
             last_error_timestamp = timestamp
-            click.secho(
+            secho(
                 '%s\nWARNING: %s' % (timestamp, message),
                 fg='yellow',
                 err=False
             )
-            click.secho('Continuing.', nl=False)
+            secho('Continuing.', nl=False)
         else:
-            click.secho(
+            secho(
                 '%s\nERROR: %s\n' % (timestamp, message),
                 fg='red',
                 err=True
             )
             error = True
 
-    if service.older_errors:
-        click.secho('')
-        click.secho('Older errors', fg='yellow', err=True)
-        for timestamp in service.older_errors:
-            click.secho(
-                text='%s\n%s\n' % (timestamp, service.older_errors[timestamp]),
+    older_errors = service.older_errors
+    if older_errors:
+        secho('')
+        secho('Older errors', fg='yellow', err=True)
+        for timestamp in older_errors:
+            secho(
+                '%s\n%s\n' % (timestamp, older_errors[timestamp]),
                 fg='yellow',
                 err=True
             )
@@ -706,7 +1472,7 @@ def inspect_errors(service, failure_message, ignore_warnings, since, timeout):
         error = True
         failure_message += ' due to timeout. Please see: ' \
                            'https://github.com/fabfuel/ecs-deploy#timeout'
-        click.secho('')
+        secho('')
 
     if error:
         raise TaskPlacementError(failure_message)
@@ -715,11 +1481,34 @@ def inspect_errors(service, failure_message, ignore_warnings, since, timeout):
 
 
 ecs.add_command(deploy)
+ecs.add_command(deploy_many)
 ecs.add_command(scale)
 ecs.add_command(run)
 ecs.add_command(cron)
 ecs.add_command(update)
 ecs.add_command(diff)
+ecs.add_command(gc)
+ecs.add_command(serve)
+
+
+def main(args=None):
+    """
+    Entry point of the ecs command. Forwards the command to the ecs daemon,
+    if it is running, and executes it locally otherwise.
+    """
+    from ecs_deploy.server import DaemonError, should_forward, forward
+
+    args = sys.argv[1:] if args is None else list(args)
+    if should_forward(args):
+        try:
+            exit_code = forward(args)
+        except DaemonError as e:
+            click.secho('%s\n' % str(e), fg='red', err=True)
+            exit(1)
+        if exit_code is not None:
+            exit(exit_code)
+    ecs(args=args)
+
 
 if __name__ == '__main__':  # pragma: no cover
-    ecs()
+    main()
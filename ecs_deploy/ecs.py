@@ -1,16 +1,26 @@
 from datetime import datetime
+import hashlib
 import json
 import re
 import copy
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, RLock
+from time import sleep, time
 import logging
-import click_log
 
 from boto3.session import Session
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 from dateutil.tz.tz import tzlocal
 from dictdiffer import diff
 
+from ecs_deploy import LAUNCH_TYPE_EC2, LAUNCH_TYPE_FARGATE  # noqa: F401
+from ecs_deploy.cache import CredentialCache, RuleIndexCache, TaskDefinitionCache, is_cache_enabled, to_timestamp, \
+    CREDENTIALS_EXPIRY_MARGIN
+from ecs_deploy.envfile import parse_env_file
+from ecs_deploy.metrics import instrument
+
 JSON_LIST_REGEX = re.compile(r'^\[.*\]$')
 
 # Python2 raises ValueError
@@ -19,64 +29,282 @@ try:
 except AttributeError:
     JSONDecodeError = ValueError
 
-LAUNCH_TYPE_EC2 = 'EC2'
-LAUNCH_TYPE_FARGATE = 'FARGATE'
+# DescribeTasks accepts at most 100 task ARNs per call
+DESCRIBE_TASKS_MAX_RESULTS = 100
+
+# DescribeServices accepts at most 10 services per call
+DESCRIBE_SERVICES_MAX_RESULTS = 10
+
+# PutTargets accepts at most 10 targets per call
+PUT_TARGETS_MAX_RESULTS = 10
+
+# Maximum number of rules, whose targets are listed at the same time
+RULE_INDEX_WORKERS = 10
+
+# Tag storing the fingerprint of the definition a revision was registered with
+FINGERPRINT_TAG_KEY = u'ecs-deploy:fingerprint'
+
+# Number of newest revisions searched for a matching fingerprint
+REUSE_LOOKUP_REVISIONS = 10
+
+# Size of the HTTP connection pool of every boto client. Has to cover the
+# concurrent task inspection and multi-service deployments.
+MAX_POOL_CONNECTIONS = 50
 
 logger = logging.getLogger(__name__)
-click_log.basic_config(logger)
 
 
-def read_env_file(container_name, file):
-    env_vars = []
+def get_env_file_variables(file):
     try:
-        with open(file) as f:
-            for line in f:
-                if line.startswith('#') or not line.strip() or '=' not in line:
-                    continue
-                key, value = line.strip().split('=', 1)
-                env_vars.append((container_name,key,value))
+        return parse_env_file(file)
     except Exception as e:
         raise EcsTaskDefinitionCommandError(str(e))
-    return tuple(env_vars)
-
 
-class EcsClient(object):
-    def __init__(self, access_key_id=None, secret_access_key=None,
-                 region=None, profile=None, session_token=None, assume_account=None, assume_role=None):
 
+def read_env_file(container_name, file):
+    return tuple(
+        (container_name, name, value)
+        for name, value in get_env_file_variables(file).items()
+    )
+
+
+def get_family(task_definition_arn):
+    return task_definition_arn.rpartition(u'/')[2].rpartition(u':')[0]
+
+
+def normalize_definition(value):
+    """Returns a canonical form of a (task) definition: empty values are
+    dropped and lists of objects are sorted, because their order has no
+    meaning to ECS. Lists of plain values (e.g. commands) keep their order.
+    """
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            item = normalize_definition(item)
+            if item is not None and item != {} and item != [] and item != u'':
+                normalized[key] = item
+        return normalized
+    if isinstance(value, (list, tuple)):
+        items = [normalize_definition(item) for item in value]
+        if items and all(isinstance(item, dict) for item in items):
+            items.sort(key=lambda item: json.dumps(item, sort_keys=True, default=str))
+        return items
+    return value
+
+
+def merge_by_key(old_items, new_items, key):
+    """Merges new_items into a copy of old_items: an item updates the existing
+    items with the same key or is appended, if the key is new.
+    """
+    merged = copy.deepcopy(old_items)
+    index = defaultdict(list)
+    for item in merged:
+        index[item[key]].append(item)
+    for new_item in new_items:
+        existing = index.get(new_item[key])
+        if existing:
+            for item in existing:
+                item.update(new_item)
+        else:
+            merged.append(new_item)
+            index[new_item[key]].append(new_item)
+    return merged
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def paginate(list_method, result_key, token_key=u'nextToken', **kwargs):
+    while True:
+        response = list_method(**kwargs)
+        for item in response.get(result_key, []):
+            yield item
+        if not response.get(token_key):
+            break
+        kwargs[u'next_token'] = response[token_key]
+
+
+class RateLimiter(object):
+    """Spaces out calls from several threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next_call = 0
+        self._lock = Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+_sessions = {}
+_clients = {}
+_pool_lock = RLock()
+_task_definitions = None
+
+
+def get_session(access_key_id=None, secret_access_key=None, region=None, profile=None, session_token=None,
+                assume_account=None, assume_role=None):
+    key = (access_key_id, secret_access_key, session_token, region, profile, assume_account, assume_role)
+    with _pool_lock:
+        session, expires_at = _sessions.get(key, (None, None))
+        if session is not None and (expires_at is None or expires_at > time()):
+            return session
+        if session is not None:
+            evict_session_clients(session)
+
+        expires_at = None
         if assume_account and assume_role:
-            access_key_id, secret_access_key, session_token = self.assume_role(access_key_id, secret_access_key, region,
-                                                                               profile, session_token, assume_account,
-                                                                               assume_role)
+            credentials = EcsClient.get_role_credentials(
+                access_key_id, secret_access_key, region, profile, session_token, assume_account, assume_role
+            )
+            access_key_id = credentials['AccessKeyId']
+            secret_access_key = credentials['SecretAccessKey']
+            session_token = credentials['SessionToken']
             profile = None
+            expires_at = to_timestamp(credentials['Expiration']) - CREDENTIALS_EXPIRY_MARGIN
 
         session = Session(aws_access_key_id=access_key_id,
                           aws_secret_access_key=secret_access_key,
                           aws_session_token=session_token,
                           region_name=region,
                           profile_name=profile)
-        self.boto = session.client(u'ecs')
-        self.events = session.client(u'events')
+        _sessions[key] = session, expires_at
+        return session
+
+
+def get_boto_client(session, service_name, region_name=None):
+    """Returns the pooled client of the service, in the region of the session
+    or the given region (e.g. of an ECR registry).
+    """
+    key = (session, service_name, region_name)
+    with _pool_lock:
+        if key not in _clients:
+            kwargs = dict(config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+            if region_name:
+                kwargs[u'region_name'] = region_name
+            _clients[key] = instrument(session.client(service_name, **kwargs))
+        return _clients[key]
+
+
+def evict_session_clients(session):
+    """Removes the pooled clients of an expired session, so they and their
+    connection pools are released, once no action uses them any longer.
+    """
+    with _pool_lock:
+        for key in [key for key in _clients if key[0] is session]:
+            del _clients[key]
+
+
+def clear_client_pool():
+    with _pool_lock:
+        _sessions.clear()
+        _clients.clear()
+
+
+def get_task_definition_cache():
+    global _task_definitions
+    with _pool_lock:
+        if _task_definitions is None:
+            _task_definitions = TaskDefinitionCache(
+                disk=is_cache_enabled('ECS_DEPLOY_TASK_DEFINITION_CACHE', default=False)
+            )
+        return _task_definitions
+
+
+def clear_task_definition_cache():
+    global _task_definitions
+    with _pool_lock:
+        _task_definitions = None
+
+
+def get_source_identity(session):
+    """Returns the profile and access key the session resolved to."""
+    credentials = session.get_credentials()
+    return session.profile_name, credentials.access_key if credentials else None
+
+
+def get_cache_scope(session, account=None):
+    """Returns the region and the identity (the account, if known, or the
+    access key) the session resolved to. family:revision references and
+    rule names are only unique within an account and region.
+    """
+    if not account:
+        credentials = session.get_credentials()
+        account = credentials.access_key if credentials else u''
+    return u'%s|%s' % (session.region_name or u'', account)
+
+
+class EcsClient(object):
+    def __init__(self, access_key_id=None, secret_access_key=None,
+                 region=None, profile=None, session_token=None, assume_account=None, assume_role=None):
+        self._session = get_session(access_key_id, secret_access_key, region, profile, session_token,
+                                    assume_account, assume_role)
+        self.boto = get_boto_client(self._session, u'ecs')
+        self._assume_account = assume_account
+        self._cache_scope = None
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def cache_scope(self):
+        """The resolved region and identity, resolved on first use."""
+        if self._cache_scope is None:
+            self._cache_scope = get_cache_scope(self._session, self._assume_account)
+        return self._cache_scope
+
+    @property
+    def events(self):
+        return get_boto_client(self._session, u'events')
 
     @staticmethod
     def assume_role(access_key_id=None, secret_access_key=None, region=None, profile=None, session_token=None,
                     assume_account=None, assume_role=None):
-        role_arn = 'arn:aws:iam::%s:role/%s' % (assume_account, assume_role)
-        sts_session = Session(aws_access_key_id=access_key_id,
-                              aws_secret_access_key=secret_access_key,
-                              aws_session_token=session_token,
-                              region_name=region,
-                              profile_name=profile)
-        sts = sts_session.client('sts')
-        response = sts.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName='ecsDeploy',
-        )
-        access_key_id = response['Credentials']['AccessKeyId']
-        secret_access_key = response['Credentials']['SecretAccessKey']
-        session_token = response['Credentials']['SessionToken']
+        credentials = EcsClient.get_role_credentials(access_key_id, secret_access_key, region, profile,
+                                                     session_token, assume_account, assume_role)
+        access_key_id = credentials['AccessKeyId']
+        secret_access_key = credentials['SecretAccessKey']
+        session_token = credentials['SessionToken']
         return access_key_id, secret_access_key, session_token
 
+    @staticmethod
+    def get_role_credentials(access_key_id=None, secret_access_key=None, region=None, profile=None,
+                             session_token=None, assume_account=None, assume_role=None):
+        role_arn = 'arn:aws:iam::%s:role/%s' % (assume_account, assume_role)
+
+        def request_credentials():
+            sts_session = get_session(access_key_id, secret_access_key, region, profile, session_token)
+            sts = get_boto_client(sts_session, u'sts')
+            response = sts.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName='ecsDeploy',
+            )
+            return response['Credentials']
+
+        if not is_cache_enabled('ECS_DEPLOY_CREDENTIAL_CACHE'):
+            return request_credentials()
+
+        # the source credentials may come from the environment or a config
+        # file, so the key is based on the identity the session resolved to
+        source_session = get_session(access_key_id, secret_access_key, region, profile, session_token)
+        source_profile, source_access_key_id = get_source_identity(source_session)
+        cache = CredentialCache()
+        key = CredentialCache.get_key(assume_account, assume_role, source_profile, source_access_key_id)
+        return cache.fetch(key, request_credentials)
 
     def describe_services(self, cluster_name, service_name):
         return self.boto.describe_services(
@@ -84,9 +312,29 @@ class EcsClient(object):
             services=[service_name]
         )
 
-    def describe_task_definition(self, task_definition_arn):
+    def describe_services_batch(self, cluster_name, service_names):
+        return self.boto.describe_services(
+            cluster=cluster_name,
+            services=list(service_names)
+        )
+
+    def describe_task_definition(self, task_definition_arn, use_cache=True):
+        """Describes the task definition. Revisions are immutable, so they
+        are served from cache, except for their status, which changes once a
+        revision is deregistered: without use_cache, the revision is described
+        again and the cache updated.
+        """
+        cache = get_task_definition_cache()
+        cache_key = self.get_task_definition_cache_key(task_definition_arn)
+        if cache_key and use_cache:
+            response = cache.get(cache_key)
+            if response is not None and u'alias' in response:
+                response = cache.get(response[u'alias'])
+            if response is not None:
+                return response
+
         try:
-            return self.boto.describe_task_definition(
+            response = self.boto.describe_task_definition(
                 taskDefinition=task_definition_arn,
                 include=[
                     'TAGS',
@@ -97,10 +345,36 @@ class EcsClient(object):
                 u'Unknown task definition arn: %s' % task_definition_arn
             )
 
-    def list_tasks(self, cluster_name, service_name):
+        response.pop(u'ResponseMetadata', None)
+        arn = response[u'taskDefinition'][u'taskDefinitionArn']
+        cache.set(arn, response)
+        if cache_key and cache_key != arn:
+            # family:revision keys only refer to the ARN, so evicting the ARN
+            # evicts all of them
+            cache.set(cache_key, {u'alias': arn})
+        return response
+
+    def get_task_definition_cache_key(self, task_definition_arn):
+        """Returns the cache key of an immutable task definition reference.
+        A family without revision resolves to the latest revision, which
+        changes with every registration, so it is never served from cache.
+        """
+        if not TaskDefinitionCache.has_revision(task_definition_arn):
+            return None
+        if task_definition_arn.startswith(u'arn:'):
+            return task_definition_arn
+        return u'%s|%s' % (self.cache_scope, task_definition_arn)
+
+    def list_tasks(self, cluster_name, service_name, next_token=None):
+        if next_token is None:
+            return self.boto.list_tasks(
+                cluster=cluster_name,
+                serviceName=service_name
+            )
         return self.boto.list_tasks(
             cluster=cluster_name,
-            serviceName=service_name
+            serviceName=service_name,
+            nextToken=next_token
         )
 
     def describe_tasks(self, cluster_name, task_arns):
@@ -132,9 +406,13 @@ class EcsClient(object):
         )
 
     def deregister_task_definition(self, task_definition_arn):
-        return self.boto.deregister_task_definition(
+        response = self.boto.deregister_task_definition(
             taskDefinition=task_definition_arn
         )
+        # the status of the revision changes to INACTIVE
+        cache = get_task_definition_cache()
+        cache.delete(response[u'taskDefinition'][u'taskDefinitionArn'])
+        return response
 
     def update_service(self, cluster, service, desired_count, task_definition):
         if desired_count is None:
@@ -191,15 +469,73 @@ class EcsClient(object):
             overrides=overrides
         )
 
-    def update_rule(self, cluster, rule, task_definition):
-        target = self.events.list_targets_by_rule(Rule=rule)['Targets'][0]
-        target['Arn'] = task_definition.arn.partition('task-definition')[0] + 'cluster/' + cluster
-        target['EcsParameters']['TaskDefinitionArn'] = task_definition.arn
-        self.events.put_targets(Rule=rule, Targets=[target])
-        return target['Id']
-
+    def list_task_definitions(self, family, next_token=None):
+        kwargs = dict(familyPrefix=family, status=u'ACTIVE', sort=u'DESC')
+        if next_token is not None:
+            kwargs[u'nextToken'] = next_token
+        return self.boto.list_task_definitions(**kwargs)
+
+    def list_clusters(self, next_token=None):
+        if next_token is None:
+            return self.boto.list_clusters()
+        return self.boto.list_clusters(nextToken=next_token)
+
+    def list_services(self, cluster_name, next_token=None):
+        if next_token is None:
+            return self.boto.list_services(cluster=cluster_name)
+        return self.boto.list_services(cluster=cluster_name, nextToken=next_token)
+
+    def list_rules(self, next_token=None, name_prefix=None):
+        kwargs = {}
+        if next_token is not None:
+            kwargs[u'NextToken'] = next_token
+        if name_prefix:
+            kwargs[u'NamePrefix'] = name_prefix
+        return self.events.list_rules(**kwargs)
+
+    def list_targets_by_rule(self, rule, next_token=None):
+        if next_token is None:
+            return self.events.list_targets_by_rule(Rule=rule)
+        return self.events.list_targets_by_rule(Rule=rule, NextToken=next_token)
+
+    def put_targets(self, rule, targets):
+        return self.events.put_targets(Rule=rule, Targets=targets)
+
+    def update_rule(self, cluster, rule, task_definition, any_family=False):
+        """Points all ECS targets of the rule, which run a revision of the
+        family of the task definition, to the task definition. Returns the
+        ids of the updated targets, an empty list if the rule has none.
+        With any_family, a rule without targets of the family gets its first
+        ECS target re-pointed, regardless of the family it runs.
+        """
+        cluster_arn = task_definition.arn.partition('task-definition')[0] + 'cluster/' + cluster
+        ecs_targets = [
+            target for target in paginate(self.list_targets_by_rule, u'Targets', token_key=u'NextToken', rule=rule)
+            if target.get(u'EcsParameters')
+        ]
+        targets = [
+            target for target in ecs_targets
+            if get_family(target[u'EcsParameters'][u'TaskDefinitionArn']) == task_definition.family
+        ]
+        if not targets and any_family:
+            if not ecs_targets:
+                raise EcsError(u'Rule %s has no ECS targets' % rule)
+            targets = ecs_targets[:1]
+        for target in targets:
+            target[u'Arn'] = cluster_arn
+            target[u'EcsParameters'][u'TaskDefinitionArn'] = task_definition.arn
+        for targets_chunk in chunked(targets, PUT_TARGETS_MAX_RESULTS):
+            response = self.put_targets(rule, targets_chunk)
+            if response.get(u'FailedEntryCount'):
+                raise EcsError(u'Unable to update targets of rule %s:\n%s' % (rule, u'\n'.join(
+                    u'- %s: %s' % (entry[u'TargetId'], entry[u'ErrorMessage']) for entry in response[u'FailedEntries']
+                )))
+        return [target[u'Id'] for target in targets]
+
+
+class BaseEcsDeployment(object):
+    __slots__ = ()
 
-class EcsDeployment(dict):
     STATUS_ACTIVE = u'ACTIVE'
     STATUS_PRIMARY = u'PRIMARY'
     ROLLOUT_STATE_FAILED = u'FAILED'
@@ -229,17 +565,104 @@ class EcsDeployment(dict):
     def failed_tasks(self):
         return self.get(u'failedTasks', 0)
 
+    @property
+    def desired_count(self):
+        return self.get(u'desiredCount', 0)
 
-class EcsService(dict):
-    def __init__(self, cluster, service_definition=None, **kwargs):
-        self._cluster = cluster
-        self._deployments = []
-        for deployment in service_definition.get(u'deployments', []):
-            self._deployments.append(EcsDeployment(deployment))
-        super(EcsService, self).__init__(service_definition, **kwargs)
+    @property
+    def running_count(self):
+        return self.get(u'runningCount', 0)
 
-    def set_task_definition(self, task_definition):
-        self[u'taskDefinition'] = task_definition.arn
+    @property
+    def pending_count(self):
+        return self.get(u'pendingCount', 0)
+
+
+class EcsDeployment(BaseEcsDeployment, dict):
+    pass
+
+
+class EcsDeploymentSnapshot(BaseEcsDeployment):
+    """Read-only view on a deployment payload, which is not copied."""
+    __slots__ = ('_payload',)
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def get(self, key, default=None):
+        return self._payload.get(key, default)
+
+    def __getitem__(self, key):
+        return self._payload[key]
+
+    def __contains__(self, key):
+        return key in self._payload
+
+
+class EcsTask(dict):
+    """A task as described by DescribeTasks. If the names of the essential
+    containers are given, only they decide about the exit code, so e.g. a
+    sidecar killed at the end of the task does not fail it.
+    """
+
+    STATUS_STOPPED = u'STOPPED'
+
+    def __init__(self, payload=None, essential_containers=None, **kwargs):
+        super(EcsTask, self).__init__(payload or {}, **kwargs)
+        self.essential_containers = essential_containers
+
+    @property
+    def arn(self):
+        return self.get(u'taskArn')
+
+    @property
+    def last_status(self):
+        return self.get(u'lastStatus')
+
+    @property
+    def is_stopped(self):
+        return self.last_status == self.STATUS_STOPPED
+
+    @property
+    def stopped_reason(self):
+        return self.get(u'stoppedReason')
+
+    @property
+    def containers(self):
+        return self.get(u'containers', [])
+
+    @property
+    def deciding_containers(self):
+        if self.essential_containers is None:
+            return self.containers
+        essential = [container for container in self.containers
+                     if container.get(u'name') in self.essential_containers]
+        return essential or self.containers
+
+    @property
+    def exit_code(self):
+        """The first non-zero exit code of the essential containers, 0 if
+        all of them exited with 0 or None, if one has no exit code (e.g. it
+        never started).
+        """
+        exit_codes = [container.get(u'exitCode') for container in self.deciding_containers]
+        for exit_code in exit_codes:
+            if exit_code:
+                return exit_code
+        if not exit_codes or None in exit_codes:
+            return None
+        return 0
+
+    @property
+    def succeeded(self):
+        return self.is_stopped and self.exit_code == 0
+
+
+class BaseEcsService(object):
+    """Properties shared by the mutable EcsService and the read-only
+    EcsServiceSnapshot. Both provide get() and _deployments.
+    """
+    __slots__ = ()
 
     @property
     def cluster(self):
@@ -292,23 +715,252 @@ class EcsService(dict):
 
     @property
     def older_errors(self):
-        return self.get_warnings(
-            since=self.deployment_created_at,
-            until=self.deployment_updated_at
-        )
+        if self._older_errors is None:
+            self._older_errors = self.get_warnings(
+                since=self.deployment_created_at,
+                until=self.deployment_updated_at
+            )
+        return self._older_errors
 
-    def get_warnings(self, since=None, until=None):
+    def get_warnings(self, since=None, until=None, cursor=None, matcher=None):
         since = since or self.deployment_created_at
-        until = until or datetime.now(tz=tzlocal())
+        # the cursor skips every event it returned once, so an event created
+        # after the local now (clock skew) must not be dropped by the default bound
+        if until is None and cursor is None:
+            until = datetime.now(tz=tzlocal())
+        matcher = matcher or WARNING_EVENTS
+        events = cursor.get_new_events(self) if cursor else self.get(u'events')
         errors = {}
-        for event in self.get(u'events'):
-            if u'unable' not in event[u'message']:
+        for event in events:
+            if not matcher.matches(event[u'message']):
                 continue
-            if since < event[u'createdAt'] < until:
+            if since < event[u'createdAt'] and (until is None or event[u'createdAt'] < until):
                 errors[event[u'createdAt']] = event[u'message']
         return errors
 
 
+class EcsService(BaseEcsService, dict):
+    def __init__(self, cluster, service_definition=None, **kwargs):
+        self._cluster = cluster
+        self._deployments = []
+        for deployment in service_definition.get(u'deployments', []):
+            self._deployments.append(EcsDeployment(deployment))
+        self._older_errors = None
+        super(EcsService, self).__init__(service_definition, **kwargs)
+
+    def set_task_definition(self, task_definition):
+        self[u'taskDefinition'] = task_definition.arn
+
+
+class EcsServiceSnapshot(BaseEcsService):
+    """Compact, read-only view on a describe_services payload for polling.
+    It references the payload instead of copying it and wraps the
+    deployments only on first access.
+    """
+    __slots__ = ('_cluster', '_payload', '_deployment_snapshots', '_older_errors')
+
+    def __init__(self, cluster, service_definition):
+        self._cluster = cluster
+        self._payload = service_definition
+        self._deployment_snapshots = None
+        self._older_errors = None
+
+    @property
+    def _deployments(self):
+        if self._deployment_snapshots is None:
+            self._deployment_snapshots = [
+                EcsDeploymentSnapshot(deployment)
+                for deployment in self._payload.get(u'deployments', [])
+            ]
+        return self._deployment_snapshots
+
+    def get(self, key, default=None):
+        return self._payload.get(key, default)
+
+    def __getitem__(self, key):
+        return self._payload[key]
+
+    def __contains__(self, key):
+        return key in self._payload
+
+
+class EventMatcher(object):
+    """Classifies service event messages with a single precompiled regular
+    expression, built from all registered patterns.
+    """
+
+    def __init__(self, patterns=()):
+        self._patterns = list(patterns)
+        self._regex = None
+        self._compile()
+
+    @property
+    def patterns(self):
+        return tuple(self._patterns)
+
+    def add(self, pattern):
+        self._patterns.append(pattern)
+        self._compile()
+
+    def matches(self, message):
+        return self._regex is not None and self._regex.search(message) is not None
+
+    def _compile(self):
+        if self._patterns:
+            self._regex = re.compile(u'|'.join(u'(?:%s)' % pattern for pattern in self._patterns))
+        else:
+            self._regex = None
+
+
+# Service events, which are reported as warnings during a deployment.
+# Extend with WARNING_EVENTS.add(<regular expression>).
+WARNING_EVENTS = EventMatcher([u'unable'])
+
+
+class EventCursor(object):
+    """Remembers the newest service event seen across polls of a service,
+    so every poll only processes the events, which were added since.
+    """
+
+    def __init__(self):
+        self.last_event_id = None
+
+    def get_new_events(self, service):
+        events = service.get(u'events') or []
+        new_events = []
+        for event in events:
+            if self.last_event_id is not None and event.get(u'id') == self.last_event_id:
+                break
+            new_events.append(event)
+        if events and events[0].get(u'id'):
+            self.last_event_id = events[0][u'id']
+        return new_events
+
+
+class ServiceStatusAggregator(object):
+    """Fetches the status of several services in batched DescribeServices
+    calls. All services registered for a cluster are refreshed together,
+    once the cached status of any of them is older than max_age seconds.
+    The calls are made outside of the lock, so clusters are refreshed in
+    parallel, while callers of a cluster share its refresh in flight.
+    """
+
+    def __init__(self, client, max_age=1):
+        self._client = client
+        self._max_age = max_age
+        self._services = defaultdict(set)
+        self._definitions = {}
+        self._failures = {}
+        self._fetched_at = {}
+        self._versions = defaultdict(int)
+        self._refreshes = {}
+        self._lock = Lock()
+
+    def register(self, cluster_name, service_name):
+        with self._lock:
+            self._services[cluster_name].add(service_name)
+
+    def unregister(self, cluster_name, service_name):
+        with self._lock:
+            self._services[cluster_name].discard(service_name)
+            self._definitions.pop((cluster_name, service_name), None)
+            self._failures.pop((cluster_name, service_name), None)
+            self._fetched_at.pop((cluster_name, service_name), None)
+            self._versions.pop((cluster_name, service_name), None)
+
+    def invalidate(self, cluster_name, service_name):
+        with self._lock:
+            self._fetched_at.pop((cluster_name, service_name), None)
+            # a refresh in flight may return the status from before the change
+            self._versions[(cluster_name, service_name)] += 1
+
+    def get_service(self, cluster_name, service_name):
+        return EcsService(
+            cluster=cluster_name,
+            service_definition=self.get_service_definition(cluster_name, service_name)
+        )
+
+    def get_service_snapshot(self, cluster_name, service_name):
+        return EcsServiceSnapshot(
+            cluster=cluster_name,
+            service_definition=self.get_service_definition(cluster_name, service_name)
+        )
+
+    def get_service_definition(self, cluster_name, service_name):
+        key = (cluster_name, service_name)
+        while True:
+            with self._lock:
+                self._services[cluster_name].add(service_name)
+                fetched_at = self._fetched_at.get(key)
+                if fetched_at is not None and time() - fetched_at < self._max_age:
+                    return self._get_definition(key)
+                refresh = self._refreshes.get(cluster_name)
+                is_owner = refresh is None
+                if is_owner:
+                    refresh = self._refreshes[cluster_name] = Future()
+                    versions = dict(
+                        (name, self._versions[(cluster_name, name)]) for name in self._services[cluster_name]
+                    )
+            if is_owner:
+                self._refresh(cluster_name, versions, refresh)
+            # otherwise the refresh in flight may have started before the
+            # service was registered or invalidated, so it is checked again
+            if service_name in refresh.result():
+                with self._lock:
+                    return self._get_definition(key)
+
+    def _get_definition(self, key):
+        if key not in self._definitions:
+            message = u'Service not found: %s' % key[1]
+            if self._failures.get(key):
+                message += u' (%s)' % self._failures[key]
+            raise EcsConnectionError(
+                u'An error occurred when calling the DescribeServices operation: %s' % message
+            )
+        return self._definitions[key]
+
+    def _refresh(self, cluster_name, versions, refresh):
+        """Describes the services and resolves the refresh with the names of
+        the services, whose status is up to date.
+        """
+        try:
+            refreshed = set()
+            for batch in chunked(sorted(versions), DESCRIBE_SERVICES_MAX_RESULTS):
+                fetched_at = time()
+                response = self._client.describe_services_batch(
+                    cluster_name=cluster_name,
+                    service_names=batch
+                )
+                with self._lock:
+                    self._update(cluster_name, batch, versions, response, fetched_at, refreshed)
+            refresh.set_result(refreshed)
+        except Exception as e:
+            refresh.set_exception(e)
+        finally:
+            with self._lock:
+                self._refreshes.pop(cluster_name, None)
+
+    def _update(self, cluster_name, batch, versions, response, fetched_at, refreshed):
+        for service_name in batch:
+            key = (cluster_name, service_name)
+            if service_name not in self._services[cluster_name]:
+                continue
+            self._definitions.pop(key, None)
+            self._failures.pop(key, None)
+            if self._versions[key] == versions[service_name]:
+                refreshed.add(service_name)
+        for service_definition in response[u'services']:
+            key = (cluster_name, service_definition[u'serviceName'])
+            if key[1] in refreshed:
+                self._definitions[key] = service_definition
+                self._fetched_at[key] = fetched_at
+        for failure in response.get(u'failures', []):
+            # the arn of a failure is the service arn or the requested name
+            key = (cluster_name, failure[u'arn'].split(u'/')[-1])
+            if key[1] in refreshed:
+                self._failures[key] = failure.get(u'reason')
+
+
 class EcsTaskDefinition(object):
     def __init__(self, containerDefinitions, volumes, family, revision,
                  status, taskDefinitionArn, runtimePlatform=None, cpu=None, memory=None, requiresAttributes=None,
@@ -331,6 +983,8 @@ class EcsTaskDefinition(object):
         self.tags = tags
         self.additional_properties = kwargs
         self._diff = []
+        self._indexed_containers = None
+        self._container_index = {}
 
         # the following parameters are returned from the ECS API, when
         # describing a task, but may not be included, when registering a new
@@ -345,6 +999,24 @@ class EcsTaskDefinition(object):
         for container in self.containers:
             yield container[u'name']
 
+    @property
+    def essential_container_names(self):
+        # containers are essential, unless they are explicitly marked otherwise
+        for container in self.containers:
+            if container.get(u'essential', True):
+                yield container[u'name']
+
+    @property
+    def containers_by_name(self):
+        """The containers indexed by name. The index is rebuilt, once the
+        container list is replaced or containers are added or removed.
+        """
+        if self._indexed_containers is not self.containers or \
+                len(self._container_index) != len(self.containers):
+            self._container_index = dict((container[u'name'], container) for container in self.containers)
+            self._indexed_containers = self.containers
+        return self._container_index
+
     @property
     def family_revision(self):
         return '%s:%d' % (self.family, self.revision)
@@ -353,6 +1025,42 @@ class EcsTaskDefinition(object):
     def diff(self):
         return self._diff
 
+    @property
+    def fingerprint(self):
+        """A hash of everything that is sent, when registering this task
+        definition. Equal definitions have equal fingerprints, regardless of
+        the order of containers, variables, mount points etc.
+        """
+        definition = normalize_definition({
+            u'family': self.family,
+            u'containers': self.containers,
+            u'volumes': self.volumes,
+            u'role_arn': self.role_arn,
+            u'execution_role_arn': self.execution_role_arn,
+            u'runtime_platform': self.runtime_platform,
+            u'cpu': str(self.cpu) if self.cpu is not None else None,
+            u'memory': str(self.memory) if self.memory is not None else None,
+            u'tags': [tag for tag in self.tags or [] if tag.get(u'key') != FINGERPRINT_TAG_KEY],
+            u'additional_properties': self.additional_properties,
+        })
+        payload = json.dumps(definition, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode(u'utf-8')).hexdigest()
+
+    def get_tag(self, key):
+        for tag in self.tags or []:
+            if tag.get(u'key') == key:
+                return tag.get(u'value')
+        return None
+
+    def get_tags_without_fingerprint(self):
+        # the fingerprint of a previous revision does not apply to a new one
+        return [tag for tag in self.tags or [] if tag.get(u'key') != FINGERPRINT_TAG_KEY]
+
+    def get_tags_with_fingerprint(self):
+        tags = self.get_tags_without_fingerprint()
+        tags.append({u'key': FINGERPRINT_TAG_KEY, u'value': self.fingerprint})
+        return tags
+
     def diff_raw(self, task_b):
         containers_a = {c['name']: c for c in self.containers}
         containers_b = {c['name']: c for c in task_b.containers}
@@ -450,66 +1158,151 @@ class EcsTaskDefinition(object):
     def get_overrides_docker_labels(dockerlabels):
         return dockerlabels.copy()
 
+    def apply_changes(self, change_set):
+        """Applies a TaskDefinitionChangeSet with a single traversal of the
+        containers and returns the diffs it produced. The container names are
+        validated, before any container is changed.
+        """
+        diff_count = len(self._diff)
+        self.add_containers(change_set.added_containers)
+        self.remove_containers(change_set.removed_containers)
+        self.validate_container_options(**dict.fromkeys(change_set.container_names))
+
+        for container in self.containers:
+            self.apply_container_changes(container, change_set)
+
+        self.set_task_cpu(change_set.task_cpu)
+        self.set_task_memory(change_set.task_memory)
+        self.set_role_arn(change_set.role_arn)
+        self.set_execution_role_arn(change_set.execution_role_arn)
+        self.set_runtime_platform(change_set.runtime_platform)
+        self.set_volumes(change_set.volumes)
+        return self._diff[diff_count:]
+
+    def apply_container_changes(self, container, change_set):
+        name = container[u'name']
+
+        if name in change_set.images:
+            self.apply_container_value(container, u'image', change_set.images[name])
+        elif change_set.tag:
+            # a new tag replaces the digest of a pinned image as well
+            image_definition = container[u'image'].partition(u'@')[0].rsplit(u':', 1)
+            self.apply_container_value(container, u'image', u'%s:%s' % (image_definition[0], change_set.tag.strip()))
+
+        if name in change_set.commands:
+            new_command = change_set.commands[name]
+            self._diff.append(EcsTaskDefinitionDiff(
+                container=name,
+                field=u'command',
+                value=new_command,
+                old_value=container.get(u'command')
+            ))
+            container[u'command'] = self.parse_command(new_command)
+
+        if name in change_set.health_checks:
+            self.apply_container_value(container, u'healthCheck', change_set.health_checks[name])
+        if name in change_set.cpu:
+            self.apply_container_value(container, u'cpu', int(change_set.cpu[name]))
+        if name in change_set.memory:
+            self.apply_container_value(container, u'memory', int(change_set.memory[name]))
+        if name in change_set.memory_reservations:
+            self.apply_container_value(container, u'memoryReservation', int(change_set.memory_reservations[name]))
+        if name in change_set.privileged:
+            self.apply_container_flag(container, u'privileged', change_set.privileged[name])
+        if name in change_set.essential:
+            self.apply_container_flag(container, u'essential', change_set.essential[name])
+        if name in change_set.log_configurations:
+            self.apply_container_value(container, u'logConfiguration', change_set.log_configurations[name])
+
+        if name in change_set.environment or change_set.exclusive_environment:
+            self.apply_container_environment(
+                container=container,
+                new_environment=change_set.environment.get(name, {}),
+                exclusive=change_set.exclusive_environment,
+            )
+        if name in change_set.docker_labels or change_set.exclusive_docker_labels:
+            self.apply_docker_labels(
+                container=container,
+                new_dockerlabels=change_set.docker_labels.get(name, {}),
+                exclusive=change_set.exclusive_docker_labels,
+            )
+        if name in change_set.s3_env_files or change_set.exclusive_s3_env_files:
+            self.apply_s3_env_file(
+                container=container,
+                new_s3_env_file=change_set.s3_env_files.get(name, {}),
+                exclusive=change_set.exclusive_s3_env_files
+            )
+        if name in change_set.secrets or change_set.exclusive_secrets:
+            self.apply_container_secrets(
+                container=container,
+                new_secrets=change_set.secrets.get(name, {}),
+                exclusive=change_set.exclusive_secrets,
+            )
+        if name in change_set.ulimits or change_set.exclusive_ulimits:
+            self.apply_container_ulimits(
+                container=container,
+                new_ulimits=change_set.ulimits.get(name, []),
+                exclusive=change_set.exclusive_ulimits,
+            )
+        if name in change_set.system_controls or change_set.exclusive_system_controls:
+            self.apply_container_system_controls(
+                container=container,
+                new_system_controls=change_set.system_controls.get(name, []),
+                exclusive=change_set.exclusive_system_controls,
+            )
+        if name in change_set.port_mappings or change_set.exclusive_port_mappings:
+            self.apply_container_port_mappings(
+                container=container,
+                new_port_mappings=change_set.port_mappings.get(name, []),
+                exclusive=change_set.exclusive_port_mappings,
+            )
+        if name in change_set.mount_points or change_set.exclusive_mount_points:
+            self.apply_container_mount_points(
+                container=container,
+                new_mount_points=change_set.mount_points.get(name, []),
+                exclusive=change_set.exclusive_mount_points,
+            )
+
+    def apply_container_value(self, container, field, value):
+        diff = EcsTaskDefinitionDiff(
+            container=container[u'name'],
+            field=field,
+            value=value,
+            old_value=container.get(field)
+        )
+        self._diff.append(diff)
+        container[field] = value
+
+    def apply_container_flag(self, container, field, value):
+        new_value = bool(value)
+        if not new_value == container.get(field):
+            self.apply_container_value(container, field, new_value)
+
     def set_images(self, tag=None, **images):
-        self.validate_container_options(**images)
+        self.apply_changes(TaskDefinitionChangeSet().set_images(tag, **images))
+
+    def pin_images(self, pinned_images):
+        """Replaces the images of the containers by the given pinned images
+        (by image). If the image of a container was already changed, its diff
+        is updated, so it shows the original and the pinned image.
+        """
         for container in self.containers:
-            if container[u'name'] in images:
-                new_image = images[container[u'name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'image',
-                    value=new_image,
-                    old_value=container[u'image']
-                )
-                self._diff.append(diff)
-                container[u'image'] = new_image
-            elif tag:
-                image_definition = container[u'image'].rsplit(u':', 1)
-                new_image = u'%s:%s' % (image_definition[0], tag.strip())
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'image',
-                    value=new_image,
-                    old_value=container[u'image']
-                )
-                self._diff.append(diff)
-                container[u'image'] = new_image
+            pinned_image = pinned_images.get(container[u'image'])
+            if not pinned_image or pinned_image == container[u'image']:
+                continue
+            for diff in self._diff:
+                if diff.container == container[u'name'] and diff.field == u'image':
+                    diff.value = pinned_image
+                    container[u'image'] = pinned_image
+                    break
+            else:
+                self.apply_container_value(container, u'image', pinned_image)
 
     def set_commands(self, **commands):
-        self.validate_container_options(**commands)
-        for container in self.containers:
-            if container[u'name'] in commands:
-                new_command = commands[container[u'name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'command',
-                    value=new_command,
-                    old_value=container.get(u'command')
-                )
-                self._diff.append(diff)
-                container[u'command'] = self.parse_command(new_command)
+        self.apply_changes(TaskDefinitionChangeSet().set_commands(**commands))
 
     def set_health_checks(self, health_checks_list):
-        health_checks = defaultdict(dict)
-        for health_check in health_checks_list:
-            health_checks[health_check[0]]["command"] = ['CMD-SHELL', health_check[1]]
-            health_checks[health_check[0]]["interval"] = health_check[2]
-            health_checks[health_check[0]]["timeout"] = health_check[3]
-            health_checks[health_check[0]]["retries"] = health_check[4]
-            health_checks[health_check[0]]["startPeriod"] = health_check[5]
-
-        self.validate_container_options(**health_checks)
-        for container in self.containers:
-            if container[u'name'] in health_checks:
-                new_health_checks = health_checks[container[u'name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'healthCheck',
-                    value=new_health_checks,
-                    old_value=container.get(u'healthCheck')
-                )
-                self._diff.append(diff)
-                container[u'healthCheck'] = new_health_checks
+        self.apply_changes(TaskDefinitionChangeSet().set_health_checks(health_checks_list))
 
     def set_runtime_platform(self, runtime_platform):
         if runtime_platform:
@@ -526,19 +1319,7 @@ class EcsTaskDefinition(object):
             self._diff.append(diff)
 
     def set_cpu(self, **cpu):
-        self.validate_container_options(**cpu)
-        for container in self.containers:
-            if container[u'name'] in cpu:
-                new_cpu = int(cpu[container[u'name']])
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'cpu',
-                    value=new_cpu,
-                    old_value=container.get(u'cpu')
-                )
-
-                self._diff.append(diff)
-                container[u'cpu'] = new_cpu
+        self.apply_changes(TaskDefinitionChangeSet().set_cpu(**cpu))
 
     def set_task_cpu(self, task_cpu):
         if task_cpu:
@@ -565,108 +1346,22 @@ class EcsTaskDefinition(object):
             self.memory = new_memory
 
     def set_memory(self, **memory):
-        self.validate_container_options(**memory)
-        for container in self.containers:
-            if container[u'name'] in memory:
-                new_memory = int(memory[container[u'name']])
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'memory',
-                    value=new_memory,
-                    old_value=container.get(u'memory')
-                )
-                self._diff.append(diff)
-                container[u'memory'] = new_memory
+        self.apply_changes(TaskDefinitionChangeSet().set_memory(**memory))
 
     def set_memoryreservation(self, **memoryreservation):
-        self.validate_container_options(**memoryreservation)
-        for container in self.containers:
-            if container[u'name'] in memoryreservation:
-                new_memoryreservation = int(memoryreservation[container[u'name']])
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'memoryReservation',
-                    value=new_memoryreservation,
-                    old_value=container.get(u'memoryReservation')
-                )
-                self._diff.append(diff)
-                container[u'memoryReservation'] = new_memoryreservation
+        self.apply_changes(TaskDefinitionChangeSet().set_memoryreservation(**memoryreservation))
 
     def set_privileged(self, **privileged):
-        self.validate_container_options(**privileged)
-        for container in self.containers:
-            if container[u'name'] in privileged:
-                new_privileged = bool(privileged[container[u'name']])
-                old_privileged = container.get(u'privileged')
-                if not new_privileged == old_privileged:
-                    diff = EcsTaskDefinitionDiff(
-                        container=container[u'name'],
-                        field=u'privileged',
-                        value=new_privileged,
-                        old_value=old_privileged
-                    )
-                    self._diff.append(diff)
-                    container[u'privileged'] = new_privileged
+        self.apply_changes(TaskDefinitionChangeSet().set_privileged(**privileged))
 
     def set_essential(self, **essential):
-        self.validate_container_options(**essential)
-        for container in self.containers:
-            if container[u'name'] in essential:
-                new_essential = bool(essential[container[u'name']])
-                old_essential = container.get(u'essential')
-                if not new_essential == old_essential:
-                    diff = EcsTaskDefinitionDiff(
-                        container=container[u'name'],
-                        field=u'essential',
-                        value=new_essential,
-                        old_value=old_essential
-                    )
-                    self._diff.append(diff)
-                    container[u'essential'] = new_essential
+        self.apply_changes(TaskDefinitionChangeSet().set_essential(**essential))
 
     def set_log_configurations(self, log_configurations_list):
-        log_configurations = defaultdict(dict)
-        for log_configuration in log_configurations_list:
-            log_configurations[log_configuration[0]]["logDriver"] = log_configuration[1]
-            log_configurations[log_configuration[0]].setdefault("options", {})
-            log_configurations[log_configuration[0]]["options"][log_configuration[2]] = log_configuration[3]
-            log_configurations[log_configuration[0]]["secretOptions"] = []
-
-        self.validate_container_options(**log_configurations)
-        for container in self.containers:
-            if container[u'name'] in log_configurations:
-                new_log_configurations = log_configurations[container[u'name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container[u'name'],
-                    field=u'logConfiguration',
-                    value=new_log_configurations,
-                    old_value=container.get(u'logConfiguration')
-                )
-                self._diff.append(diff)
-                container[u'logConfiguration'] = new_log_configurations
+        self.apply_changes(TaskDefinitionChangeSet().set_log_configurations(log_configurations_list))
 
     def set_environment(self, environment_list, exclusive=False, env_file=((None, None),)):
-        environment = defaultdict(dict)
-        if None not in env_file[0]:
-            for env in env_file:
-                l = read_env_file(env[0], env[1])
-                environment_list = l + environment_list
-        for env in environment_list:
-            environment[env[0]][env[1]] = env[2]
-        self.validate_container_options(**environment)
-        for container in self.containers:
-            if container[u'name'] in environment:
-                self.apply_container_environment(
-                    container=container,
-                    new_environment=environment[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_environment(
-                    container=container,
-                    new_environment={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_environment(environment_list, exclusive, env_file))
 
     def apply_container_environment(self, container, new_environment, exclusive=False):
         environment = container.get('environment', {})
@@ -694,23 +1389,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_docker_labels(self, dockerlabel_list, exclusive=False):
-        dockerlabels = defaultdict(dict)
-        for label in dockerlabel_list:
-            dockerlabels[label[0]][label[1]] = label[2]
-        self.validate_container_options(**dockerlabels)
-        for container in self.containers:
-            if container[u'name'] in dockerlabels:
-                self.apply_docker_labels(
-                    container=container,
-                    new_dockerlabels=dockerlabels[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_docker_labels(
-                    container=container,
-                    new_dockerlabels={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_docker_labels(dockerlabel_list, exclusive))
 
     def apply_docker_labels(self, container, new_dockerlabels, exclusive=False):
         old_dockerlabels = container.get('dockerLabels', {})
@@ -733,33 +1412,9 @@ class EcsTaskDefinition(object):
         self._diff.append(diff)
 
         container[u'dockerLabels'] = merged.copy()
-    def set_s3_env_file(self, s3_env_files, exclusive=False):
-        # environmentFiles in task definition https://docs.aws.amazon.com/AmazonECS/latest/developerguide/taskdef-envfiles.html
-        s3_files_by_container = defaultdict(list)
-        if s3_env_files:
-            multiple_s3_env_files = any(isinstance(i, tuple) for i in s3_env_files)
-            if not multiple_s3_env_files:
-                s3_files_by_container[s3_env_files[0]] = {s3_env_files[1]}
-            if multiple_s3_env_files:
-                for s3_file in s3_env_files:
-                    if s3_files_by_container[s3_file[0]]:
-                        s3_files_by_container[s3_file[0]].add(s3_file[1])
-                        break
-                    s3_files_by_container[s3_file[0]] = {s3_file[1]}
 
-        for container in self.containers:
-            if container[u'name'] in s3_files_by_container:
-                self.apply_s3_env_file(
-                    container=container,
-                    new_s3_env_file=s3_files_by_container[container[u'name']],
-                    exclusive=exclusive
-                )
-            elif exclusive is True:
-                self.apply_s3_env_file(
-                    container=container,
-                    new_s3_env_file={},
-                    exclusive=exclusive
-                )
+    def set_s3_env_file(self, s3_env_files, exclusive=False):
+        self.apply_changes(TaskDefinitionChangeSet().set_s3_env_file(s3_env_files, exclusive))
 
     def apply_s3_env_file(self, container, new_s3_env_file, exclusive=False):
         s3_env_file = container.get('environmentFiles', {})
@@ -786,30 +1441,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_secrets(self, secrets_list, exclusive=False, env_file=((None, None),)):
-        secrets = defaultdict(dict)
-
-        if None not in env_file[0]:
-            for secret in env_file:
-                l = read_env_file(secret[0], secret[1])
-                secrets_list = l + secrets_list
-
-        for secret in secrets_list:
-            secrets[secret[0]][secret[1]] = secret[2]
-
-        self.validate_container_options(**secrets)
-        for container in self.containers:
-            if container[u'name'] in secrets:
-                self.apply_container_secrets(
-                    container=container,
-                    new_secrets=secrets[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_secrets(
-                    container=container,
-                    new_secrets={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_secrets(secrets_list, exclusive, env_file))
 
     def apply_container_secrets(self, container, new_secrets, exclusive=False):
         secrets = container.get('secrets', {})
@@ -837,28 +1469,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_system_controls(self, system_controls_list, exclusive=False):
-        system_controls = defaultdict(list)
-        for system_control in system_controls_list:
-
-            mapping = {}
-            mapping["namespace"] = system_control[1]
-            mapping["value"] = system_control[2]
-            system_controls[system_control[0]].append(mapping)
-
-        self.validate_container_options(**system_controls)
-        for container in self.containers:
-            if container[u'name'] in system_controls:
-                self.apply_container_system_controls(
-                    container=container,
-                    new_system_controls=system_controls[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_system_controls(
-                    container=container,
-                    new_system_controls={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_system_controls(system_controls_list, exclusive))
 
     def apply_container_system_controls(self, container, new_system_controls, exclusive=False):
         system_controls = container.get('systemControls', [])
@@ -867,23 +1478,7 @@ class EcsTaskDefinition(object):
         if exclusive is True:
             merged = new_system_controls if new_system_controls else []
         else:
-            merged = copy.deepcopy(old_system_controls)
-            old_system_control_namespaces = [system_control["namespace"] for system_control in merged]
-            new_system_control_namespaces = [system_control["namespace"] for system_control in new_system_controls]
-            new = set(new_system_control_namespaces) - set(old_system_control_namespaces)
-            new_merged = list()
-            # update
-            for system_control in merged:
-                for new_system_control in new_system_controls:
-                    if system_control["namespace"] == new_system_control["namespace"]:
-                        system_control.update(new_system_control)
-            # new
-            for name in new:
-                for new_system_control in new_system_controls:
-                    if name == new_system_control["namespace"]:
-                        new_merged.append(new_system_control)
-
-            merged.extend(new_merged)
+            merged = merge_by_key(old_system_controls, new_system_controls, "namespace")
 
         if old_system_controls == merged:
             return
@@ -901,29 +1496,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_ulimits(self, ulimits_list, exclusive=False):
-        ulimits = defaultdict(list)
-        for ulimit in ulimits_list:
-
-            mapping = {}
-            mapping["name"] = ulimit[1]
-            mapping["softLimit"] = int(ulimit[2])
-            mapping["hardLimit"] = int(ulimit[3])
-            ulimits[ulimit[0]].append(mapping)
-
-        self.validate_container_options(**ulimits)
-        for container in self.containers:
-            if container[u'name'] in ulimits:
-                self.apply_container_ulimits(
-                    container=container,
-                    new_ulimits=ulimits[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_ulimits(
-                    container=container,
-                    new_ulimits={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_ulimits(ulimits_list, exclusive))
 
     def apply_container_ulimits(self, container, new_ulimits, exclusive=False):
         ulimits = container.get('ulimits', [])
@@ -932,23 +1505,7 @@ class EcsTaskDefinition(object):
         if exclusive is True:
             merged = new_ulimits if new_ulimits else []
         else:
-            merged = copy.deepcopy(old_ulimits)
-            old_ulimit_names = [ulimit["name"] for ulimit in merged]
-            new_ulimit_names = [ulimit["name"] for ulimit in new_ulimits]
-            new = set(new_ulimit_names) - set(old_ulimit_names)
-            new_merged = list()
-            # update
-            for ulimit in merged:
-                for new_ulimit in new_ulimits:
-                    if ulimit["name"] == new_ulimit["name"]:
-                        ulimit.update(new_ulimit)
-            # new
-            for name in new:
-                for new_ulimit in new_ulimits:
-                    if name == new_ulimit["name"]:
-                        new_merged.append(new_ulimit)
-
-            merged.extend(new_merged)
+            merged = merge_by_key(old_ulimits, new_ulimits, "name")
 
         if old_ulimits == merged:
             return
@@ -966,29 +1523,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_port_mappings(self, port_mappings_list, exclusive=False):
-        port_mappings = defaultdict(list)
-
-        for port_mapping in port_mappings_list:
-            mapping = {}
-            mapping["containerPort"] = int(port_mapping[1])
-            mapping["hostPort"] = int(port_mapping[2])
-            mapping["protocol"] = "tcp"
-            port_mappings[port_mapping[0]].append(mapping)
-
-        self.validate_container_options(**port_mappings)
-        for container in self.containers:
-            if container[u'name'] in port_mappings:
-                self.apply_container_port_mappings(
-                    container=container,
-                    new_port_mappings=port_mappings[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_port_mappings(
-                    container=container,
-                    new_port_mappings={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_port_mappings(port_mappings_list, exclusive))
 
     def apply_container_port_mappings(self, container, new_port_mappings, exclusive=False):
         port_mappings = container.get('portMappings', [])
@@ -997,23 +1532,7 @@ class EcsTaskDefinition(object):
         if exclusive is True:
             merged = new_port_mappings if new_port_mappings else []
         else:
-            merged = copy.deepcopy(old_port_mappings)
-            old_container_ports = [port_mapping["containerPort"] for port_mapping in merged]
-            new_container_ports = [port_mapping["containerPort"] for port_mapping in new_port_mappings]
-            new = set(new_container_ports) - set(old_container_ports)
-            new_merged = list()
-            # update
-            for port_mapping in merged:
-                for new_port_mapping in new_port_mappings:
-                    if port_mapping["containerPort"] == new_port_mapping["containerPort"]:
-                        port_mapping.update(new_port_mapping)
-            # new
-            for port in new:
-                for new_port_mapping in new_port_mappings:
-                    if port == new_port_mapping["containerPort"]:
-                        new_merged.append(new_port_mapping)
-
-            merged.extend(new_merged)
+            merged = merge_by_key(old_port_mappings, new_port_mappings, "containerPort")
         if old_port_mappings == merged:
             return
 
@@ -1030,28 +1549,7 @@ class EcsTaskDefinition(object):
         ]
 
     def set_mount_points(self, mount_points_list, exclusive=False):
-        mount_points = defaultdict(list)
-        for mount_point in mount_points_list:
-            mapping = {}
-            mapping["sourceVolume"] = mount_point[1]
-            mapping["containerPath"] = mount_point[2]
-            mapping["readOnly"] = False
-            mount_points[mount_point[0]].append(mapping)
-
-        self.validate_container_options(**mount_points)
-        for container in self.containers:
-            if container[u'name'] in mount_points:
-                self.apply_container_mount_points(
-                    container=container,
-                    new_mount_points=mount_points[container[u'name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_mount_points(
-                    container=container,
-                    new_mount_points={},
-                    exclusive=exclusive,
-                )
+        self.apply_changes(TaskDefinitionChangeSet().set_mount_points(mount_points_list, exclusive))
 
     def apply_container_mount_points(self, container, new_mount_points, exclusive=False):
         mount_points = container.get('mountPoints', [])
@@ -1060,23 +1558,7 @@ class EcsTaskDefinition(object):
         if exclusive is True:
             merged = new_mount_points if new_mount_points else []
         else:
-            merged = copy.deepcopy(old_mount_points)
-            old_source_volumes = [mount_point["sourceVolume"] for mount_point in merged]
-            new_source_volumes = [mount_point["sourceVolume"] for mount_point in new_mount_points]
-            new = set(new_source_volumes) - set(old_source_volumes)
-            new_merged = list()
-            # update
-            for mount_point in merged:
-                for new_mount_point in new_mount_points:
-                    if mount_point["sourceVolume"] == new_mount_point["sourceVolume"]:
-                        mount_point.update(new_mount_point)
-            # new
-            for volume in new:
-                for new_mount_point in new_mount_points:
-                    if volume == new_mount_point["sourceVolume"]:
-                        new_merged.append(new_mount_point)
-
-            merged.extend(new_merged)
+            merged = merge_by_key(old_mount_points, new_mount_points, "sourceVolume")
 
         if old_mount_points == merged:
             return
@@ -1094,8 +1576,9 @@ class EcsTaskDefinition(object):
         ]
 
     def validate_container_options(self, **container_options):
+        containers = self.containers_by_name
         for container_name in container_options:
-            if container_name not in self.container_names:
+            if container_name not in containers:
                 raise UnknownContainerError(
                     u'Unknown container: %s' % container_name
                 )
@@ -1154,7 +1637,7 @@ class EcsTaskDefinition(object):
         if containers_list:
             containers_tmp = list(self.containers)
             for container in set(containers_list):
-                if container in self.container_names:
+                if container in self.containers_by_name:
                     logger.warning("Cannot add container '{container}', already in the task definition.".format(container=container))
                     continue
                 mapping = {}
@@ -1188,7 +1671,7 @@ class EcsTaskDefinition(object):
                     # Leave container.
                     containers.append(container)
 
-            containers_not_found = list(containers_ - set(self.container_names))
+            containers_not_found = list(containers_ - set(self.containers_by_name))
             # Remaining containers could not be found.
             for container in containers_not_found:
                 logger.warning("Cannot remove container '{container}', not in the task definition.".format(container=container))
@@ -1208,6 +1691,230 @@ class EcsTaskDefinition(object):
                 self._diff.append(diff)
 
 
+class TaskDefinitionChangeSet(object):
+    """Collects changes of a task definition (e.g. from command line options),
+    which are applied at once by EcsTaskDefinition.apply_changes. The methods
+    take the same arguments as the setters of EcsTaskDefinition and return
+    the change set, so they can be chained.
+    """
+
+    def __init__(self):
+        self.added_containers = []
+        self.removed_containers = []
+        self.tag = None
+        self.images = {}
+        self.commands = {}
+        self.health_checks = {}
+        self.cpu = {}
+        self.memory = {}
+        self.memory_reservations = {}
+        self.privileged = {}
+        self.essential = {}
+        self.log_configurations = {}
+        self.environment = defaultdict(dict)
+        self.exclusive_environment = False
+        self.docker_labels = defaultdict(dict)
+        self.exclusive_docker_labels = False
+        self.s3_env_files = {}
+        self.exclusive_s3_env_files = False
+        self.secrets = defaultdict(dict)
+        self.exclusive_secrets = False
+        self.ulimits = defaultdict(list)
+        self.exclusive_ulimits = False
+        self.system_controls = defaultdict(list)
+        self.exclusive_system_controls = False
+        self.port_mappings = defaultdict(list)
+        self.exclusive_port_mappings = False
+        self.mount_points = defaultdict(list)
+        self.exclusive_mount_points = False
+        self.task_cpu = None
+        self.task_memory = None
+        self.role_arn = None
+        self.execution_role_arn = None
+        self.runtime_platform = None
+        self.volumes = []
+
+    @property
+    def container_names(self):
+        """Names of all containers with container specific changes (except
+        for S3 environment files, which are not validated).
+        """
+        names = set()
+        for options in (self.images, self.commands, self.health_checks, self.cpu, self.memory,
+                        self.memory_reservations, self.privileged, self.essential, self.log_configurations,
+                        self.environment, self.docker_labels, self.secrets, self.ulimits, self.system_controls,
+                        self.port_mappings, self.mount_points):
+            names.update(options)
+        return names
+
+    def add_containers(self, containers_list):
+        self.added_containers.extend(containers_list or ())
+        return self
+
+    def remove_containers(self, containers_list):
+        self.removed_containers.extend(containers_list or ())
+        return self
+
+    def set_images(self, tag=None, **images):
+        if tag:
+            self.tag = tag
+        self.images.update(images)
+        return self
+
+    def set_commands(self, **commands):
+        self.commands.update(commands)
+        return self
+
+    def set_health_checks(self, health_checks_list):
+        for health_check in health_checks_list:
+            self.health_checks[health_check[0]] = {
+                "command": ['CMD-SHELL', health_check[1]],
+                "interval": health_check[2],
+                "timeout": health_check[3],
+                "retries": health_check[4],
+                "startPeriod": health_check[5],
+            }
+        return self
+
+    def set_cpu(self, **cpu):
+        self.cpu.update(cpu)
+        return self
+
+    def set_memory(self, **memory):
+        self.memory.update(memory)
+        return self
+
+    def set_memoryreservation(self, **memoryreservation):
+        self.memory_reservations.update(memoryreservation)
+        return self
+
+    def set_privileged(self, **privileged):
+        self.privileged.update(privileged)
+        return self
+
+    def set_essential(self, **essential):
+        self.essential.update(essential)
+        return self
+
+    def set_task_cpu(self, task_cpu):
+        if task_cpu:
+            self.task_cpu = task_cpu
+        return self
+
+    def set_task_memory(self, task_memory):
+        if task_memory:
+            self.task_memory = task_memory
+        return self
+
+    def set_log_configurations(self, log_configurations_list):
+        for log_configuration in log_configurations_list:
+            configuration = self.log_configurations.setdefault(log_configuration[0], {})
+            configuration["logDriver"] = log_configuration[1]
+            configuration.setdefault("options", {})
+            configuration["options"][log_configuration[2]] = log_configuration[3]
+            configuration["secretOptions"] = []
+        return self
+
+    def set_environment(self, environment_list, exclusive=False, env_file=((None, None),)):
+        if None not in env_file[0]:
+            # variables of the first files take precedence
+            for container_name, path in reversed(env_file):
+                self.environment[container_name].update(get_env_file_variables(path))
+        for env in environment_list:
+            self.environment[env[0]][env[1]] = env[2]
+        self.exclusive_environment = self.exclusive_environment or exclusive is True
+        return self
+
+    def set_docker_labels(self, dockerlabel_list, exclusive=False):
+        for label in dockerlabel_list:
+            self.docker_labels[label[0]][label[1]] = label[2]
+        self.exclusive_docker_labels = self.exclusive_docker_labels or exclusive is True
+        return self
+
+    def set_s3_env_file(self, s3_env_files, exclusive=False):
+        # environmentFiles in task definition https://docs.aws.amazon.com/AmazonECS/latest/developerguide/taskdef-envfiles.html
+        if s3_env_files:
+            multiple_s3_env_files = any(isinstance(i, tuple) for i in s3_env_files)
+            if not multiple_s3_env_files:
+                self.s3_env_files[s3_env_files[0]] = {s3_env_files[1]}
+            if multiple_s3_env_files:
+                for s3_file in s3_env_files:
+                    if self.s3_env_files.get(s3_file[0]):
+                        self.s3_env_files[s3_file[0]].add(s3_file[1])
+                        break
+                    self.s3_env_files[s3_file[0]] = {s3_file[1]}
+        self.exclusive_s3_env_files = self.exclusive_s3_env_files or exclusive is True
+        return self
+
+    def set_secrets(self, secrets_list, exclusive=False, env_file=((None, None),)):
+        if None not in env_file[0]:
+            # variables of the first files take precedence
+            for container_name, path in reversed(env_file):
+                self.secrets[container_name].update(get_env_file_variables(path))
+        for secret in secrets_list:
+            self.secrets[secret[0]][secret[1]] = secret[2]
+        self.exclusive_secrets = self.exclusive_secrets or exclusive is True
+        return self
+
+    def set_system_controls(self, system_controls_list, exclusive=False):
+        for system_control in system_controls_list:
+            self.system_controls[system_control[0]].append({
+                "namespace": system_control[1],
+                "value": system_control[2],
+            })
+        self.exclusive_system_controls = self.exclusive_system_controls or exclusive is True
+        return self
+
+    def set_ulimits(self, ulimits_list, exclusive=False):
+        for ulimit in ulimits_list:
+            self.ulimits[ulimit[0]].append({
+                "name": ulimit[1],
+                "softLimit": int(ulimit[2]),
+                "hardLimit": int(ulimit[3]),
+            })
+        self.exclusive_ulimits = self.exclusive_ulimits or exclusive is True
+        return self
+
+    def set_port_mappings(self, port_mappings_list, exclusive=False):
+        for port_mapping in port_mappings_list:
+            self.port_mappings[port_mapping[0]].append({
+                "containerPort": int(port_mapping[1]),
+                "hostPort": int(port_mapping[2]),
+                "protocol": "tcp",
+            })
+        self.exclusive_port_mappings = self.exclusive_port_mappings or exclusive is True
+        return self
+
+    def set_mount_points(self, mount_points_list, exclusive=False):
+        for mount_point in mount_points_list:
+            self.mount_points[mount_point[0]].append({
+                "sourceVolume": mount_point[1],
+                "containerPath": mount_point[2],
+                "readOnly": False,
+            })
+        self.exclusive_mount_points = self.exclusive_mount_points or exclusive is True
+        return self
+
+    def set_role_arn(self, role_arn):
+        if role_arn:
+            self.role_arn = role_arn
+        return self
+
+    def set_execution_role_arn(self, execution_role_arn):
+        if execution_role_arn:
+            self.execution_role_arn = execution_role_arn
+        return self
+
+    def set_runtime_platform(self, runtime_platform):
+        if runtime_platform:
+            self.runtime_platform = runtime_platform
+        return self
+
+    def set_volumes(self, volumes_list):
+        self.volumes.extend(volumes_list or ())
+        return self
+
+
 class EcsTaskDefinitionDiff(object):
     def __init__(self, container, field, value, old_value):
         self.container = container
@@ -1299,11 +2006,16 @@ class EcsTaskDefinitionDiff(object):
 
 class EcsAction(object):
     FAILED_TASKS = 0
+    TASK_INSPECTION_WORKERS = 10
 
-    def __init__(self, client, cluster_name, service_name):
+    def __init__(self, client, cluster_name, service_name, status_aggregator=None):
         self._client = client
         self._cluster_name = cluster_name
         self._service_name = service_name
+        self._waiter = None
+        self._status_aggregator = None
+        # attached before the first fetch, so that one is batched as well
+        self.set_status_aggregator(status_aggregator)
 
         try:
             if service_name:
@@ -1322,21 +2034,33 @@ class EcsAction(object):
             )
 
     def get_service(self):
+        return EcsService(
+            cluster=self._cluster_name,
+            service_definition=self.get_service_definition()
+        )
+
+    def get_service_snapshot(self):
+        return EcsServiceSnapshot(
+            cluster=self._cluster_name,
+            service_definition=self.get_service_definition()
+        )
+
+    def get_service_definition(self):
+        if self._status_aggregator:
+            return self._status_aggregator.get_service_definition(self._cluster_name, self._service_name)
         services_definition = self._client.describe_services(
             cluster_name=self._cluster_name,
             service_name=self._service_name
         )
-        return EcsService(
-            cluster=self._cluster_name,
-            service_definition=services_definition[u'services'][0]
-        )
+        return services_definition[u'services'][0]
 
     def get_current_task_definition(self, service):
         return self.get_task_definition(service.task_definition)
 
-    def get_task_definition(self, task_definition):
+    def get_task_definition(self, task_definition, use_cache=True):
         task_definition_payload = self._client.describe_task_definition(
-            task_definition_arn=task_definition
+            task_definition_arn=task_definition,
+            use_cache=use_cache
         )
 
         task_definition = EcsTaskDefinition(
@@ -1345,7 +2069,29 @@ class EcsAction(object):
         )
         return task_definition
 
-    def update_task_definition(self, task_definition):
+    def find_task_definition(self, task_definition, max_revisions=REUSE_LOOKUP_REVISIONS):
+        """Returns the newest active revision of the family, which was
+        registered with the same definition, or None.
+        """
+        fingerprint = task_definition.fingerprint
+        response = self._client.list_task_definitions(task_definition.family)
+        arns = [arn for arn in response.get(u'taskDefinitionArns', []) if get_family(arn) == task_definition.family]
+        for arn in arns[:max_revisions]:
+            candidate = self.get_task_definition(arn)
+            if candidate.get_tag(FINGERPRINT_TAG_KEY) == fingerprint:
+                return candidate
+        return None
+
+    def update_task_definition(self, task_definition, fingerprint=False):
+        """Registers a new revision of the task definition. With fingerprint,
+        the revision is tagged with the fingerprint of its definition, so it
+        can be found by find_task_definition. Tagging requires the
+        ecs:TagResource permission.
+        """
+        if fingerprint:
+            tags = task_definition.get_tags_with_fingerprint()
+        else:
+            tags = task_definition.get_tags_without_fingerprint()
         response = self._client.register_task_definition(
             family=task_definition.family,
             containers=task_definition.containers,
@@ -1353,7 +2099,7 @@ class EcsAction(object):
             role_arn=task_definition.role_arn,
             execution_role_arn=task_definition.execution_role_arn,
             runtime_platform=task_definition.runtime_platform,
-            tags=task_definition.tags,
+            tags=tags,
             additional_properties=task_definition.additional_properties,
             cpu=task_definition.cpu,
             memory=task_definition.memory
@@ -1371,8 +2117,20 @@ class EcsAction(object):
             desired_count=desired_count,
             task_definition=service.task_definition
         )
+        if self._waiter:
+            self._waiter.reset()
+        if self._status_aggregator:
+            self._status_aggregator.invalidate(service.cluster, service.name)
         return EcsService(self._cluster_name, response[u'service'])
 
+    def set_waiter(self, waiter):
+        self._waiter = waiter
+
+    def set_status_aggregator(self, status_aggregator):
+        self._status_aggregator = status_aggregator
+        if status_aggregator and self._service_name:
+            status_aggregator.register(self._cluster_name, self._service_name)
+
     def is_deployed(self, service):
         if service.primary_deployment.has_failed:
             raise EcsDeploymentError(u'Deployment Failed! ' + service.primary_deployment.rollout_state_reason)
@@ -1382,19 +2140,36 @@ class EcsAction(object):
 
         if len(service[u'deployments']) != 1:
             return False
-        running_tasks = self._client.list_tasks(
-            cluster_name=service.cluster,
-            service_name=service.name
-        )
-        if not running_tasks[u'taskArns']:
-            return service.desired_count == 0
         running_count = self.get_running_tasks_count(
             service=service,
-            task_arns=running_tasks[u'taskArns']
+            task_arns=self.get_task_arns(service)
         )
         return service.desired_count == running_count
 
+    def get_task_arns(self, service):
+        kwargs = {}
+        while True:
+            running_tasks = self._client.list_tasks(
+                cluster_name=service.cluster,
+                service_name=service.name,
+                **kwargs
+            )
+            for task_arn in running_tasks[u'taskArns']:
+                yield task_arn
+            if not running_tasks.get(u'nextToken'):
+                break
+            kwargs[u'next_token'] = running_tasks[u'nextToken']
+
     def get_running_tasks_count(self, service, task_arns):
+        chunks = chunked(task_arns, DESCRIBE_TASKS_MAX_RESULTS)
+        with ThreadPoolExecutor(max_workers=self.TASK_INSPECTION_WORKERS) as executor:
+            futures = [
+                executor.submit(self.count_running_tasks, service, chunk)
+                for chunk in chunks
+            ]
+            return sum(future.result() for future in futures)
+
+    def count_running_tasks(self, service, task_arns):
         running_count = 0
         tasks_details = self._client.describe_tasks(
             cluster_name=self._cluster_name,
@@ -1423,6 +2198,14 @@ class EcsAction(object):
     def service_name(self):
         return self._service_name
 
+    @property
+    def waiter(self):
+        return self._waiter
+
+    @property
+    def status_aggregator(self):
+        return self._status_aggregator
+
 
 class DeployAction(EcsAction):
     def deploy(self, task_definition):
@@ -1447,6 +2230,8 @@ class RunAction(EcsAction):
         self._client = client
         self._cluster_name = cluster_name
         self.started_tasks = []
+        self.failures = []
+        self.essential_containers = None
 
     def run(self, task_definition, count, started_by, launchtype, subnets,
             security_groups, public_ip, platform_version):
@@ -1464,10 +2249,105 @@ class RunAction(EcsAction):
                 platform_version=platform_version,
             )
             self.started_tasks = result['tasks']
+            self.failures = result.get('failures', [])
+            self.essential_containers = list(task_definition.essential_container_names)
             return True
         except ClientError as e:
             raise EcsError(str(e))
 
+    def describe_tasks(self, task_arns):
+        """Describes the tasks with one call per 100 tasks, several calls in
+        parallel. Tasks, which could not be described, are returned as
+        stopped tasks with the reason of the failure.
+        """
+
+        def describe(task_arns_chunk):
+            return self._client.describe_tasks(cluster_name=self._cluster_name, task_arns=task_arns_chunk)
+
+        tasks = []
+        chunks = chunked(task_arns, DESCRIBE_TASKS_MAX_RESULTS)
+        with ThreadPoolExecutor(max_workers=self.TASK_INSPECTION_WORKERS) as executor:
+            for response in executor.map(describe, chunks):
+                tasks.extend(EcsTask(task, self.essential_containers) for task in response[u'tasks'])
+                tasks.extend(EcsTask(taskArn=failure[u'arn'], lastStatus=EcsTask.STATUS_STOPPED,
+                                     stoppedReason=failure.get(u'reason'))
+                             for failure in response.get(u'failures', []))
+        return tasks
+
+
+class CronAction(EcsAction):
+    """Points the targets of scheduled tasks (EventBridge rules) to a new
+    revision of a task definition.
+    """
+
+    def __init__(self, client, cluster_name):
+        super(CronAction, self).__init__(client, cluster_name, None)
+        self._cluster_name = cluster_name
+
+    def get_rules(self, rules=(), rule_prefix=None, family=None, refresh=False):
+        """Returns the given rules, all rules starting with rule_prefix and,
+        if a family is given, all rules with targets of the family.
+        """
+        names = list(rules)
+        if rule_prefix:
+            listed = paginate(self._client.list_rules, u'Rules', token_key=u'NextToken', name_prefix=rule_prefix)
+            names.extend(rule[u'Name'] for rule in listed)
+        if family:
+            names.extend(self.discover_rules(family, refresh))
+        return list(OrderedDict.fromkeys(names))
+
+    def discover_rules(self, family, refresh=False):
+        """Returns the rules with targets of the family. The rule index is
+        cached on disk, unless ECS_DEPLOY_RULE_INDEX_CACHE=0.
+        """
+        if not is_cache_enabled('ECS_DEPLOY_RULE_INDEX_CACHE'):
+            index = self.get_rule_index()
+        else:
+            # the rules of one region and account (or access key) share an index
+            key = u'rules|%s' % self._client.cache_scope
+            cache = RuleIndexCache()
+            if refresh:
+                cache.delete(key)
+            index = cache.fetch(key, self.get_rule_index)
+        return sorted(index.get(family, {}))
+
+    def get_rule_index(self, workers=RULE_INDEX_WORKERS):
+        """Lists the targets of all rules, several rules in parallel, and
+        returns the ECS targets as {family: {rule: [target id, ...]}}.
+        """
+        rules = [rule[u'Name'] for rule in paginate(self._client.list_rules, u'Rules', token_key=u'NextToken')]
+
+        def list_targets(rule):
+            return rule, list(paginate(self._client.list_targets_by_rule, u'Targets', token_key=u'NextToken',
+                                       rule=rule))
+
+        index = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(rules)))) as executor:
+            for rule, targets in executor.map(list_targets, rules):
+                for target in targets:
+                    if u'EcsParameters' in target:
+                        family = get_family(target[u'EcsParameters'][u'TaskDefinitionArn'])
+                        index.setdefault(family, {}).setdefault(rule, []).append(target[u'Id'])
+        return index
+
+    def update_rules(self, rules, task_definition, concurrency=5, named_rules=()):
+        """Updates the rules in parallel. Returns a list of
+        (rule, target ids, error) tuples, error is None on success. Rules
+        without targets of the family have no target ids, except the named
+        rules, which get their first target updated like before.
+        """
+
+        def update(rule):
+            try:
+                target_ids = self._client.update_rule(self._cluster_name, rule, task_definition,
+                                                      any_family=rule in named_rules)
+                return rule, target_ids, None
+            except (EcsError, ClientError) as e:
+                return rule, [], str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(rules)))) as executor:
+            return list(executor.map(update, rules))
+
 
 class UpdateAction(EcsAction):
     def __init__(self, client):
@@ -1479,6 +2359,67 @@ class DiffAction(EcsAction):
         super(DiffAction, self).__init__(client, None, None)
 
 
+class GarbageCollectAction(EcsAction):
+    """Deregisters old revisions of a task definition family, except the
+    newest ones and those used by a service or a scheduled task.
+    """
+
+    def __init__(self, client):
+        super(GarbageCollectAction, self).__init__(client, None, None)
+
+    def get_revisions(self, family):
+        task_definition_arns = paginate(self._client.list_task_definitions, u'taskDefinitionArns', family=family)
+        return [arn for arn in task_definition_arns if get_family(arn) == family]
+
+    def get_used_task_definitions(self, clusters=None):
+        used = set()
+        for cluster in clusters or paginate(self._client.list_clusters, u'clusterArns'):
+            service_arns = paginate(self._client.list_services, u'serviceArns', cluster_name=cluster)
+            for service_arns_chunk in chunked(service_arns, DESCRIBE_SERVICES_MAX_RESULTS):
+                response = self._client.describe_services_batch(cluster, service_arns_chunk)
+                for service in response[u'services']:
+                    used.add(service[u'taskDefinition'])
+                    for deployment in service.get(u'deployments', []):
+                        used.add(deployment[u'taskDefinition'])
+        for rule in paginate(self._client.list_rules, u'Rules', token_key=u'NextToken'):
+            targets = paginate(self._client.list_targets_by_rule, u'Targets', token_key=u'NextToken',
+                               rule=rule[u'Name'])
+            for target in targets:
+                if u'EcsParameters' in target:
+                    task_definition_arn = target[u'EcsParameters'][u'TaskDefinitionArn']
+                    name = task_definition_arn.rpartition(u'/')[2]
+                    # Without a revision, the rule runs the newest revision of the family
+                    used.add(task_definition_arn if u':' in name else name)
+        return used
+
+    def get_obsolete_revisions(self, family, keep, clusters=None):
+        revisions = self.get_revisions(family)
+        used = self.get_used_task_definitions(clusters)
+        if family in used and revisions:
+            used.add(revisions[0])
+        kept = revisions[:keep]
+        in_use = [arn for arn in revisions[keep:] if arn in used]
+        obsolete = [arn for arn in revisions[keep:] if arn not in used]
+        return kept, in_use, obsolete
+
+    def deregister_revisions(self, task_definition_arns, concurrency=5, rate=None):
+        """Deregisters the revisions in parallel, at most rate per second.
+        Returns a list of (arn, error) tuples, error is None on success.
+        """
+        rate_limiter = RateLimiter(rate)
+
+        def deregister(arn):
+            rate_limiter.wait()
+            try:
+                self._client.deregister_task_definition(arn)
+                return arn, None
+            except ClientError as e:
+                return arn, str(e)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(deregister, task_definition_arns))
+
+
 class EcsError(Exception):
     pass
 
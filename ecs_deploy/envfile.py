@@ -0,0 +1,107 @@
+import os
+import re
+from collections import OrderedDict
+from itertools import chain
+from threading import Lock
+
+# Number of parsed .env files kept in memory
+ENV_FILE_CACHE_SIZE = 32
+
+EXPORT_PREFIX = re.compile(r'^export\s+')
+DOUBLE_QUOTED_ESCAPES = re.compile(r'\\(.)', re.DOTALL)
+ESCAPED_CHARACTERS = {u'n': u'\n', u'r': u'\r', u't': u'\t'}
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+
+
+def iter_env_file(lines):
+    """Yields the (name, value) pairs of a .env file line by line. Supports
+    comments, an "export" prefix and single or double quoted values, which
+    may span several lines. Lines without "=" are skipped. Unquoted values
+    and values with unterminated quotes are taken literally.
+    """
+    lines = iter(lines)
+    while True:
+        line = next(lines, None)
+        if line is None:
+            return
+        line = line.strip()
+        if not line or line.startswith(u'#') or u'=' not in line:
+            continue
+        name, value = line.split(u'=', 1)
+        name = EXPORT_PREFIX.sub(u'', name).strip()
+        if value[:1] in (u'"', u"'"):
+            consumed = []
+            quoted = _read_quoted(name, value, lines, consumed)
+            if quoted is None:
+                # read the lines after an unterminated quote again
+                lines = chain(consumed, lines)
+            else:
+                value = quoted
+        yield name, value
+
+
+def _read_quoted(name, value, lines, consumed):
+    """Returns the unquoted value, reading further lines until the quote is
+    closed, or None, if it is never closed. Read lines are added to consumed.
+    """
+    quote = value[0]
+    value = value[1:]
+    while True:
+        end = _find_closing_quote(value, quote)
+        if end >= 0:
+            break
+        line = next(lines, None)
+        if line is None:
+            return None
+        consumed.append(line)
+        value += u'\n' + line.rstrip(u'\r\n')
+    rest = value[end + 1:].strip()
+    if rest and not rest.startswith(u'#'):
+        raise ValueError(u'Unexpected characters after the quoted value of %s: %s' % (name, rest))
+    value = value[:end]
+    if quote == u'"':
+        value = DOUBLE_QUOTED_ESCAPES.sub(lambda match: ESCAPED_CHARACTERS.get(match.group(1), match.group(1)), value)
+    return value
+
+
+def _find_closing_quote(value, quote):
+    index = 0
+    while index < len(value):
+        if value[index] == u'\\' and quote == u'"':
+            index += 2
+            continue
+        if value[index] == quote:
+            return index
+        index += 1
+    return -1
+
+
+def parse_env_file(path):
+    """Returns the variables of a .env file as ordered dict. If a variable is
+    defined several times, the last definition wins. The result is cached as
+    long as the modification time and size of the file do not change.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached_key, variables = _cache.pop(path, (None, None))
+        if cached_key == key:
+            _cache[path] = cached_key, variables
+            return OrderedDict(variables)
+
+    with open(path) as f:
+        variables = OrderedDict(iter_env_file(f))
+
+    with _cache_lock:
+        _cache[path] = key, variables
+        while len(_cache) > ENV_FILE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return OrderedDict(variables)
+
+
+def clear_env_file_cache():
+    with _cache_lock:
+        _cache.clear()
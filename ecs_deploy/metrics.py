@@ -0,0 +1,189 @@
+import json
+import math
+from threading import Lock
+from time import time
+
+# Upper bounds (in seconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+THROTTLING_ERROR_CODES = (
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RateExceeded',
+)
+
+CONTEXT_KEY = 'ecs_deploy_started_at'
+
+_collector = None
+
+
+def get_collector():
+    return _collector
+
+
+def set_collector(collector):
+    global _collector
+    _collector = collector
+
+
+def instrument(client):
+    """Registers the metric hooks on a boto3 client. The hooks are no-ops,
+    as long as no collector is set.
+    """
+    client.meta.events.register('before-call.*.*', _before_call)
+    client.meta.events.register('after-call.*.*', _after_call)
+    client.meta.events.register('after-call-error.*.*', _after_call_error)
+    client.meta.events.register('needs-retry.*.*', _needs_retry)
+    return client
+
+
+def get_operation_name(model):
+    return '%s.%s' % (model.service_model.endpoint_prefix, model.name)
+
+
+def _before_call(model, context, **kwargs):
+    if _collector is not None:
+        context[CONTEXT_KEY] = time(), get_operation_name(model)
+
+
+def _after_call(parsed, context, **kwargs):
+    started_at, operation = context.pop(CONTEXT_KEY, (None, None))
+    if _collector is None or started_at is None:
+        return
+    metadata = parsed.get('ResponseMetadata', {})
+    _collector.record(
+        operation=operation,
+        duration=time() - started_at,
+        retries=metadata.get('RetryAttempts', 0),
+        error='Error' in parsed,
+    )
+
+
+def _after_call_error(context, **kwargs):
+    started_at, operation = context.pop(CONTEXT_KEY, (None, None))
+    if _collector is None or started_at is None:
+        return
+    _collector.record(
+        operation=operation,
+        duration=time() - started_at,
+        error=True,
+    )
+
+
+def _needs_retry(response, operation, **kwargs):
+    if _collector is None or not response:
+        return
+    error_code = response[1].get('Error', {}).get('Code')
+    if error_code in THROTTLING_ERROR_CODES:
+        _collector.record_throttling(get_operation_name(operation))
+
+
+class OperationMetrics(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.durations = []
+
+    def get_histogram(self):
+        histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for duration in self.durations:
+            for index, bound in enumerate(HISTOGRAM_BUCKETS):
+                if duration <= bound:
+                    break
+            else:
+                index = len(HISTOGRAM_BUCKETS)
+            histogram[index] += 1
+        labels = ['%g' % bound for bound in HISTOGRAM_BUCKETS] + ['+Inf']
+        return dict(zip(labels, histogram))
+
+    def get_percentile(self, percentile):
+        if not self.durations:
+            return 0
+        durations = sorted(self.durations)
+        index = int(math.ceil(percentile / 100.0 * len(durations))) - 1
+        return durations[max(index, 0)]
+
+    def to_dict(self):
+        total_time = sum(self.durations)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'total_time': total_time,
+            'avg': total_time / len(self.durations) if self.durations else 0,
+            'min': min(self.durations) if self.durations else 0,
+            'max': max(self.durations) if self.durations else 0,
+            'p50': self.get_percentile(50),
+            'p95': self.get_percentile(95),
+            'histogram': self.get_histogram(),
+        }
+
+
+class MetricsCollector(object):
+    """Collects count, latency, retries, throttling and errors of all AWS
+    API calls made by the instrumented clients.
+    """
+
+    def __init__(self):
+        self.started_at = time()
+        self.operations = {}
+        self._lock = Lock()
+
+    def _get_operation(self, operation):
+        if operation not in self.operations:
+            self.operations[operation] = OperationMetrics()
+        return self.operations[operation]
+
+    def record(self, operation, duration, retries=0, error=False):
+        with self._lock:
+            metrics = self._get_operation(operation)
+            metrics.calls += 1
+            metrics.retries += retries
+            metrics.errors += 1 if error else 0
+            metrics.durations.append(duration)
+
+    def record_throttling(self, operation):
+        with self._lock:
+            self._get_operation(operation).throttled += 1
+
+    def get_summary(self):
+        with self._lock:
+            operations = dict((name, metrics.to_dict()) for name, metrics in self.operations.items())
+        return {
+            'duration': time() - self.started_at,
+            'calls': sum(metrics['calls'] for metrics in operations.values()),
+            'errors': sum(metrics['errors'] for metrics in operations.values()),
+            'retries': sum(metrics['retries'] for metrics in operations.values()),
+            'throttled': sum(metrics['throttled'] for metrics in operations.values()),
+            'api_time': sum(metrics['total_time'] for metrics in operations.values()),
+            'operations': operations,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.get_summary(), f, indent=2, sort_keys=True)
+
+    def format_summary(self):
+        summary = self.get_summary()
+        lines = [
+            'API calls: %d in %.3fs of %.3fs (retries: %d, throttled: %d, errors: %d)' % (
+                summary['calls'], summary['api_time'], summary['duration'],
+                summary['retries'], summary['throttled'], summary['errors']
+            )
+        ]
+        operations = sorted(summary['operations'].items(), key=lambda item: -item[1]['total_time'])
+        for name, metrics in operations:
+            lines.append(
+                '- %s: %d calls, total %.3fs, avg %.3fs, p95 %.3fs, max %.3fs, retries %d, throttled %d' % (
+                    name, metrics['calls'], metrics['total_time'], metrics['avg'], metrics['p95'],
+                    metrics['max'], metrics['retries'], metrics['throttled']
+                )
+            )
+        return '\n'.join(lines)
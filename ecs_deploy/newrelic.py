@@ -1,4 +1,4 @@
-import requests
+from ecs_deploy.notification import post
 
 
 class NewRelicException(Exception):
@@ -47,7 +47,7 @@ class Deployment(object):
 
     def deploy(self, revision, changelog, description):
         payload = self.get_payload(revision, changelog, description)
-        response = requests.post(self.endpoint, headers=self.headers, json=payload)
+        response = post(self.endpoint, headers=self.headers, json=payload)
 
         if response.status_code != 201:
             try:
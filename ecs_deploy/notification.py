@@ -0,0 +1,144 @@
+import atexit
+import logging
+from concurrent.futures import Future, wait
+from queue import Queue
+from threading import Lock, Thread
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeout of notification requests in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+REQUEST_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Maximum amount of seconds to wait for pending notifications at exit
+FLUSH_TIMEOUT = 10
+
+_http_session = None
+_dispatcher = None
+_lock = Lock()
+
+
+def get_retry():
+    """Returns the retry configuration of notification requests. POST
+    requests are retried as well, which urllib3 only does if no methods
+    are whitelisted (called allowed_methods since urllib3 1.26).
+    """
+    kwargs = dict(
+        total=REQUEST_RETRIES,
+        read=0,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        raise_on_status=False,
+    )
+    try:
+        return Retry(allowed_methods=False, **kwargs)
+    except TypeError:
+        return Retry(method_whitelist=False, **kwargs)
+
+
+def get_http_session():
+    """Returns the process-wide HTTP session, which keeps connections to the
+    notification endpoints alive and retries failed requests with backoff.
+    """
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            retry = get_retry()
+            _http_session = requests.Session()
+            _http_session.mount('https://', HTTPAdapter(max_retries=retry))
+            _http_session.mount('http://', HTTPAdapter(max_retries=retry))
+        return _http_session
+
+
+def post(url, **kwargs):
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    return get_http_session().post(url, **kwargs)
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+            atexit.register(_dispatcher.shutdown)
+        return _dispatcher
+
+
+def set_dispatcher(dispatcher):
+    """Replaces the dispatcher returned by get_dispatcher, e.g. with one per
+    command executed by the daemon. None restores the process-wide default.
+    """
+    global _dispatcher
+    with _lock:
+        _dispatcher = dispatcher
+
+
+class NotificationDispatcher(object):
+    """Sends notifications from a queue in background threads, so slow
+    webhooks overlap with the deployment instead of delaying it. With a
+    single worker, notifications are sent in the order they were submitted.
+    The threads are daemons, so pending notifications never block the exit
+    longer than the flush timeout.
+    """
+
+    def __init__(self, workers=1, flush_timeout=FLUSH_TIMEOUT):
+        self.workers = workers
+        self.flush_timeout = flush_timeout
+        self._queue = Queue()
+        self._threads = []
+        self._futures = []
+        self._lock = Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            self._futures.append(future)
+            if len(self._threads) < self.workers:
+                thread = Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def flush(self, timeout=None):
+        """Waits for the pending notifications (at most timeout seconds) and
+        returns the errors of the finished ones.
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        done, not_done = wait(futures, timeout=self.flush_timeout if timeout is None else timeout)
+        if not_done:
+            logger.warning('%d notification(s) did not finish in time', len(not_done))
+            with self._lock:
+                self._futures.extend(not_done)
+        return [future.exception() for future in done if future.exception()]
+
+    def shutdown(self, timeout=None):
+        """Flushes the pending notifications, logs their errors and stops the
+        worker threads once they finished their current notification.
+        """
+        for error in self.flush(timeout):
+            logger.warning('Sending notification failed: %s', error)
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
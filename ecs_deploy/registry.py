@@ -0,0 +1,331 @@
+"""
+Resolution of container images to the digests of their manifests.
+
+Images are resolved in parallel before a task definition is registered, so a
+wrong tag fails the command before anything is changed in ECS. Images in ECR
+are resolved via the ECR API, all others via the Docker Registry HTTP API
+(with anonymous bearer tokens, e.g. for Docker Hub). Resolved digests are
+cached for a short time, as tags may be moved to another image.
+"""
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time
+
+from ecs_deploy.cache import FileCache, get_cache_dir, is_cache_enabled
+from ecs_deploy.ecs import EcsError, get_boto_client, get_session
+
+DOCKER_HUB = u'docker.io'
+DOCKER_HUB_REGISTRY = u'registry-1.docker.io'
+DOCKER_HUB_ALIASES = (DOCKER_HUB, u'index.docker.io', DOCKER_HUB_REGISTRY)
+DEFAULT_TAG = u'latest'
+
+ECR_REGISTRY = re.compile(r'^(?P<account>\d{12})\.dkr\.ecr(-fips)?\.(?P<region>[a-z0-9-]+)\.amazonaws\.com(\.cn)?$')
+
+MANIFEST_MEDIA_TYPES = (
+    u'application/vnd.oci.image.index.v1+json',
+    u'application/vnd.docker.distribution.manifest.list.v2+json',
+    u'application/vnd.oci.image.manifest.v1+json',
+    u'application/vnd.docker.distribution.manifest.v2+json',
+)
+
+# Seconds a resolved digest is reused, before the tag is resolved again
+DIGEST_CACHE_TTL = 300
+
+# Maximum number of images resolved at the same time
+RESOLVE_WORKERS = 10
+
+# Seconds to wait for a response of a registry
+REQUEST_TIMEOUT = 10
+
+_resolver = None
+_digest_cache = None
+_digest_cache_lock = Lock()
+
+
+class RegistryError(EcsError):
+    pass
+
+
+class ImageNotFoundError(RegistryError):
+    pass
+
+
+class ImageReference(object):
+    """A parsed image reference like "nginx:1.25", "ghcr.io/org/app:v1" or
+    "123456789012.dkr.ecr.eu-central-1.amazonaws.com/app@sha256:...".
+    """
+
+    def __init__(self, image):
+        self.image = image
+        name, _, self.digest = image.partition(u'@')
+        repository_start = name.rfind(u'/') + 1
+        tag_start = name.rfind(u':')
+        if tag_start >= repository_start:
+            name, self.tag = name[:tag_start], name[tag_start + 1:]
+        else:
+            self.tag = None
+        self.name = name
+
+        first, _, rest = name.partition(u'/')
+        if rest and (u'.' in first or u':' in first or first == u'localhost'):
+            self.registry, self.repository = first, rest
+        else:
+            self.registry, self.repository = DOCKER_HUB, name
+        if self.registry in DOCKER_HUB_ALIASES:
+            self.registry = DOCKER_HUB
+            if u'/' not in self.repository:
+                self.repository = u'library/' + self.repository
+
+    def __str__(self):
+        return self.image
+
+    @property
+    def reference(self):
+        """The digest, tag or default tag, the manifest is requested by."""
+        return self.digest or self.tag or DEFAULT_TAG
+
+    @property
+    def ecr(self):
+        match = ECR_REGISTRY.match(self.registry)
+        return match.groupdict() if match else None
+
+    def with_digest(self, digest):
+        return u'%s@%s' % (self.name, digest)
+
+
+class ImageResolver(object):
+    """Resolves an ImageReference to the digest of its manifest. Raises an
+    ImageNotFoundError, if the image does not exist, or a RegistryError.
+    """
+
+    def resolve(self, reference):
+        raise NotImplementedError
+
+
+class RegistryResolver(ImageResolver):
+    """Resolves images via the Docker Registry HTTP API v2. Registries on
+    localhost and the given insecure registries are accessed via HTTP.
+    """
+
+    def __init__(self, insecure_registries=(), timeout=REQUEST_TIMEOUT):
+        self.insecure_registries = tuple(insecure_registries)
+        self.timeout = timeout
+
+    def get_manifest_url(self, reference):
+        registry = DOCKER_HUB_REGISTRY if reference.registry == DOCKER_HUB else reference.registry
+        host = registry.partition(u':')[0]
+        insecure = registry in self.insecure_registries or host in (u'localhost', u'127.0.0.1')
+        return u'%s://%s/v2/%s/manifests/%s' % (
+            u'http' if insecure else u'https', registry, reference.repository, reference.reference
+        )
+
+    def resolve(self, reference):
+        import requests
+
+        url = self.get_manifest_url(reference)
+        headers = {u'Accept': u', '.join(MANIFEST_MEDIA_TYPES)}
+        try:
+            response = requests.head(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 401:
+                headers[u'Authorization'] = u'Bearer %s' % self.get_token(reference, response)
+                response = requests.head(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RegistryError(u'Unable to reach registry %s: %s' % (reference.registry, str(e)))
+
+        if response.status_code == 404:
+            raise ImageNotFoundError(u'Image not found: %s' % reference)
+        if response.status_code != 200:
+            raise RegistryError(u'Unable to resolve image %s: HTTP %d' % (reference, response.status_code))
+        digest = response.headers.get(u'Docker-Content-Digest')
+        if not digest:
+            raise RegistryError(u'Registry %s did not return a digest for %s' % (reference.registry, reference))
+        return digest
+
+    def get_token(self, reference, response):
+        """Requests an anonymous pull token for the repository, as described
+        in the WWW-Authenticate header of the registry.
+        """
+        import requests
+
+        challenge = response.headers.get(u'WWW-Authenticate', u'')
+        if not challenge.lower().startswith(u'bearer '):
+            raise RegistryError(u'Registry %s requires authentication' % reference.registry)
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop(u'realm', None)
+        if not realm:
+            raise RegistryError(u'Registry %s requires authentication' % reference.registry)
+        params.setdefault(u'scope', u'repository:%s:pull' % reference.repository)
+        token_response = requests.get(realm, params=params, timeout=self.timeout)
+        if token_response.status_code != 200:
+            raise RegistryError(u'Registry %s requires authentication' % reference.registry)
+        try:
+            payload = token_response.json()
+        except ValueError:
+            raise RegistryError(u'Registry %s returned an invalid token response' % reference.registry)
+        token = (payload.get(u'token') or payload.get(u'access_token')) if isinstance(payload, dict) else None
+        if not token:
+            raise RegistryError(u'Registry %s requires authentication' % reference.registry)
+        return token
+
+
+class EcrResolver(ImageResolver):
+    """Resolves images in ECR via DescribeImages, in the account and region
+    of the registry.
+    """
+
+    def __init__(self, session=None):
+        self._session = session
+
+    def get_client(self, region):
+        """Returns the pooled ECR client of the region, so its calls share
+        the connection pool and are recorded in the metrics.
+        """
+        return get_boto_client(self._session or get_session(), u'ecr', region_name=region)
+
+    def resolve(self, reference):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        ecr = reference.ecr
+        image_id = {u'imageDigest': reference.digest} if reference.digest else {u'imageTag': reference.reference}
+        try:
+            response = self.get_client(ecr[u'region']).describe_images(
+                registryId=ecr[u'account'],
+                repositoryName=reference.repository,
+                imageIds=[image_id],
+            )
+        except ClientError as e:
+            if e.response.get(u'Error', {}).get(u'Code') in (u'ImageNotFoundException',
+                                                             u'RepositoryNotFoundException'):
+                raise ImageNotFoundError(u'Image not found: %s' % reference)
+            raise RegistryError(u'Unable to resolve image %s: %s' % (reference, str(e)))
+        except BotoCoreError as e:
+            # e.g. missing credentials or an unreachable endpoint
+            raise RegistryError(u'Unable to resolve image %s: %s' % (reference, str(e)))
+        return response[u'imageDetails'][0][u'imageDigest']
+
+
+class DefaultResolver(ImageResolver):
+    """Resolves images in ECR via the ECR API and all others via the
+    Docker Registry HTTP API.
+    """
+
+    def __init__(self, session=None):
+        self.ecr = EcrResolver(session)
+        self.registry = RegistryResolver()
+
+    def resolve(self, reference):
+        if reference.ecr:
+            return self.ecr.resolve(reference)
+        return self.registry.resolve(reference)
+
+
+class DigestCache(object):
+    """Resolved digests by image, which are valid for ttl seconds. Entries
+    are kept in memory and optionally on disk, to share them between
+    processes.
+    """
+
+    def __init__(self, ttl=DIGEST_CACHE_TTL, directory=None, disk=False):
+        self.ttl = ttl
+        self._memory = {}
+        self._lock = Lock()
+        self._disk = FileCache(directory or get_cache_dir('digests')) if disk else None
+
+    def get(self, image):
+        with self._lock:
+            entry = self._memory.get(image)
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(image)
+        if not entry or entry[u'resolved_at'] + self.ttl <= time():
+            return None
+        with self._lock:
+            self._memory[image] = entry
+        return entry[u'digest']
+
+    def set(self, image, digest):
+        entry = {u'digest': digest, u'resolved_at': time()}
+        with self._lock:
+            self._memory[image] = entry
+        if self._disk is not None:
+            self._disk.set(image, entry)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+
+class CachingResolver(ImageResolver):
+    """Resolves images with another resolver and caches the digests. Images
+    referenced by digest are not resolved at all.
+    """
+
+    def __init__(self, resolver, cache=None):
+        self.resolver = resolver
+        self.cache = cache or DigestCache()
+
+    def resolve(self, reference):
+        if reference.digest:
+            return reference.digest
+        digest = self.cache.get(reference.image)
+        if digest is None:
+            digest = self.resolver.resolve(reference)
+            self.cache.set(reference.image, digest)
+        return digest
+
+
+def get_digest_cache():
+    """Returns the digest cache of this process. The disk cache is enabled
+    with ECS_DEPLOY_DIGEST_CACHE=1.
+    """
+    global _digest_cache
+    with _digest_cache_lock:
+        if _digest_cache is None:
+            _digest_cache = DigestCache(disk=is_cache_enabled('ECS_DEPLOY_DIGEST_CACHE', default=False))
+        return _digest_cache
+
+
+def clear_digest_cache():
+    global _digest_cache
+    with _digest_cache_lock:
+        _digest_cache = None
+
+
+def get_resolver(session=None):
+    """Returns the resolver set via set_resolver or the default resolver,
+    backed by the digest cache of this process.
+    """
+    if _resolver is not None:
+        return _resolver
+    return CachingResolver(DefaultResolver(session), get_digest_cache())
+
+
+def set_resolver(resolver):
+    global _resolver
+    _resolver = resolver
+
+
+def resolve_images(images, resolver=None, workers=RESOLVE_WORKERS):
+    """Resolves the images in parallel and returns their digests as ordered
+    dict by image. Raises a RegistryError listing all images, which could
+    not be resolved.
+    """
+    resolver = resolver or get_resolver()
+    images = list(OrderedDict.fromkeys(images))
+
+    def resolve(image):
+        try:
+            return image, resolver.resolve(ImageReference(image)), None
+        except RegistryError as e:
+            return image, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(images)))) as executor:
+        results = list(executor.map(resolve, images))
+
+    errors = [error for _, _, error in results if error]
+    if errors:
+        raise RegistryError(u'Unable to resolve %d of %d images:\n%s' % (
+            len(errors), len(images), u'\n'.join(u'- %s' % error for error in errors)
+        ))
+    return OrderedDict((image, digest) for image, digest, _ in results)
@@ -0,0 +1,330 @@
+"""
+Optional daemon, which executes ecs commands in a long running process. The
+daemon keeps the pooled AWS sessions and clients and the task definition
+cache warm, so consecutive commands neither pay the interpreter startup nor
+the botocore model loading, credential resolution and TLS handshakes again.
+
+The ecs command forwards the commands in FORWARDED_COMMANDS to the daemon,
+if it is running, and executes them locally otherwise. The daemon executes
+one command at a time in the environment and working directory of the
+calling process. While it is busy, further commands are executed locally.
+"""
+import io
+import json
+import os
+import socket
+import sys
+import traceback
+from threading import Lock
+
+from ecs_deploy.cache import get_cache_dir, is_cache_enabled
+
+FORWARDED_COMMANDS = ('deploy', 'scale', 'run', 'update', 'diff')
+
+# Seconds after which an idle daemon shuts down (0 = never)
+IDLE_TIMEOUT = 1800
+
+# Seconds to wait for the daemon to accept a command
+CONNECT_TIMEOUT = 1
+
+# Changing one of these environment variables discards the pooled clients
+# and cached task definitions, as they depend on the AWS configuration
+POOL_ENVIRONMENT_PREFIXES = ('AWS_', 'ECS_DEPLOY_')
+
+# Changing one of these files (e.g. by aws configure or aws sso login) discards
+# the pooled clients as well, as they keep the credentials they resolved
+AWS_CONFIG_FILES = (
+    ('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'),
+    ('AWS_CONFIG_FILE', '~/.aws/config'),
+)
+AWS_SSO_CACHE_DIR = '~/.aws/sso/cache'
+
+GROUP_OPTIONS_WITH_VALUE = ('--metrics-file',)
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_socket_path():
+    return os.getenv('ECS_DEPLOY_SOCKET') or get_cache_dir('daemon.sock')
+
+
+def get_command_name(args):
+    """Returns the name of the subcommand in the arguments of the ecs
+    command, skipping the options of the command group.
+    """
+    args = iter(args)
+    for arg in args:
+        if arg in GROUP_OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def should_forward(args):
+    if not is_cache_enabled('ECS_DEPLOY_DAEMON'):
+        return False
+    return get_command_name(args) in FORWARDED_COMMANDS and os.path.exists(get_socket_path())
+
+
+def forward(args, path=None, stdout=None, stderr=None):
+    """Executes the command in the daemon and writes its output to stdout and
+    stderr. Returns the exit code of the command or None, if the daemon is
+    not available or busy and the command has to be executed locally.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            connection.settimeout(CONNECT_TIMEOUT)
+            connection.connect(path or get_socket_path())
+            request = {
+                u'args': list(args),
+                u'env': dict(os.environ),
+                u'cwd': os.getcwd(),
+                u'stdout_isatty': stdout.isatty(),
+                u'stderr_isatty': stderr.isatty(),
+            }
+            connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            response = connection.makefile('r', encoding='utf-8')
+            status = read_message(response)
+        except (OSError, ValueError):
+            return None
+        if not status or status.get(u'busy'):
+            return None
+        # The daemon accepted the command: from now on, it must not be executed
+        # locally again, as it may already have changed something
+        try:
+            # the command itself may run for a long time (e.g. a deployment)
+            connection.settimeout(None)
+            for message in iter(lambda: read_message(response), None):
+                if u'exit_code' in message:
+                    return message[u'exit_code']
+                stream = stderr if message[u'stream'] == u'stderr' else stdout
+                stream.write(message[u'data'])
+                stream.flush()
+        except (OSError, ValueError) as e:
+            raise DaemonError(u'Connection to the ecs daemon failed: %s' % str(e))
+        raise DaemonError(u'Connection to the ecs daemon closed unexpectedly')
+    finally:
+        connection.close()
+
+
+def read_message(response):
+    line = response.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class MessageStream(io.TextIOBase):
+    """Text stream, which sends everything written to it to the client as a
+    JSON message. Once the client disconnected, the output is discarded.
+    """
+
+    encoding = 'utf-8'
+    errors = 'strict'
+
+    def __init__(self, connection, name, isatty=False):
+        super(MessageStream, self).__init__()
+        self.connection = connection
+        self.name = name
+        self._isatty = isatty
+
+    def isatty(self):
+        return self._isatty
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if not isinstance(data, str):
+            raise TypeError(u'write() argument must be str, not %s' % type(data).__name__)
+        send_message(self.connection, {u'stream': self.name, u'data': data})
+        return len(data)
+
+
+def send_message(connection, message):
+    try:
+        connection.write(json.dumps(message).encode('utf-8') + b'\n')
+        connection.flush()
+    except (OSError, ValueError):
+        pass
+
+
+class Daemon(object):
+    """Executes the commands received on a Unix socket one after another in
+    the current process.
+    """
+
+    def __init__(self, command, path=None, idle_timeout=IDLE_TIMEOUT):
+        self.command = command
+        self.path = path or get_socket_path()
+        self.idle_timeout = idle_timeout
+        self.pool_environment = None
+        self._lock = Lock()
+        self._server = None
+
+    def bind(self):
+        import socketserver
+
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise DaemonError(u'ecs daemon is already running: %s' % self.path)
+            os.unlink(self.path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.handle(self.rfile, self.wfile)
+
+        umask = os.umask(0o177)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        finally:
+            os.umask(umask)
+        self._server.daemon_threads = True
+        self._server.timeout = self.idle_timeout or None
+
+    def serve(self):
+        if self._server is None:
+            self.bind()
+        server = self._server
+
+        def handle_timeout():
+            server.idle = True
+
+        server.handle_timeout = handle_timeout
+        server.idle = False
+        server.closed = False
+        try:
+            while not server.closed:
+                server.handle_request()
+                if server.idle and self._lock.acquire(False):
+                    self._lock.release()
+                    break
+                server.idle = False
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.closed = True
+            # wake up the server loop
+            is_listening(self.path)
+
+    def close(self):
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, rfile, wfile):
+        try:
+            request = json.loads(rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        if not self._lock.acquire(False):
+            send_message(wfile, {u'busy': True})
+            return
+        try:
+            send_message(wfile, {u'busy': False})
+            exit_code = self.execute(request, wfile)
+        finally:
+            self._lock.release()
+        # the daemon accepts the next command, once the client got the result
+        send_message(wfile, {u'exit_code': exit_code})
+
+    def execute(self, request, wfile):
+        """Executes the command in the environment and working directory of
+        the client and returns its exit code.
+        """
+        from ecs_deploy.notification import NotificationDispatcher, set_dispatcher
+
+        environ = dict(os.environ)
+        cwd = os.getcwd()
+        stdout, stderr = sys.stdout, sys.stderr
+        # a dispatcher per command, so its pending notifications and their
+        # errors never leak into the output of the next command
+        dispatcher = NotificationDispatcher()
+        try:
+            os.environ.clear()
+            os.environ.update(request[u'env'])
+            self.reset_pool(request[u'env'])
+            os.chdir(request[u'cwd'])
+            sys.stdout = MessageStream(wfile, u'stdout', request.get(u'stdout_isatty', False))
+            sys.stderr = MessageStream(wfile, u'stderr', request.get(u'stderr_isatty', False))
+            set_dispatcher(dispatcher)
+            try:
+                self.command.main(args=request[u'args'], prog_name='ecs')
+            except SystemExit as e:
+                return get_exit_code(e.code)
+            except Exception:
+                traceback.print_exc()
+                return 1
+            return 0
+        finally:
+            dispatcher.shutdown()
+            set_dispatcher(None)
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def reset_pool(self, env):
+        pool_environment = dict(
+            (name, value) for name, value in env.items() if name.startswith(POOL_ENVIRONMENT_PREFIXES)
+        )
+        pool_environment.update(get_aws_file_mtimes(env))
+        if self.pool_environment is not None and pool_environment != self.pool_environment:
+            from ecs_deploy.ecs import clear_client_pool, clear_task_definition_cache
+
+            clear_client_pool()
+            clear_task_definition_cache()
+        self.pool_environment = pool_environment
+
+
+def get_aws_file_mtimes(env):
+    """Returns the modification times of the AWS credentials and config files
+    and of the cached SSO tokens, which the pooled clients depend on.
+    """
+    paths = [os.path.expanduser(env.get(name) or default) for name, default in AWS_CONFIG_FILES]
+    sso_cache_dir = os.path.expanduser(AWS_SSO_CACHE_DIR)
+    if os.path.isdir(sso_cache_dir):
+        paths.extend(os.path.join(sso_cache_dir, name) for name in sorted(os.listdir(sso_cache_dir)))
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def get_exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write(u'%s\n' % code)
+    return 1
+
+
+def is_listening(path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(CONNECT_TIMEOUT)
+        connection.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        connection.close()
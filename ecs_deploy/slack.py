@@ -1,17 +1,32 @@
 import re
-import requests
 from datetime import datetime
 
+from ecs_deploy.notification import post
+
 
 class SlackException(Exception):
     pass
 
 
 class SlackNotification(object):
-    def __init__(self, url, service_match):
+    def __init__(self, url, service_match, dispatcher=None):
         self.__url = url
         self.__service_match_re = re.compile(service_match or '')
         self.__timestamp_start = datetime.utcnow()
+        self.__dispatcher = dispatcher
+
+    def send(self, payload):
+        if self.__dispatcher:
+            return self.__dispatcher.submit(self.post, payload)
+        return self.post(payload)
+
+    def post(self, payload):
+        response = post(self.__url, json=payload)
+
+        if response.status_code != 200:
+            raise SlackException('Notifying deployment failed')
+
+        return response
 
     def get_payload(self, title, messages, color=None):
         fields = []
@@ -70,12 +85,7 @@ class SlackNotification(object):
 
         payload = self.get_payload('Deployment has started', messages)
 
-        response = requests.post(self.__url, json=payload)
-
-        if response.status_code != 200:
-            raise SlackException('Notifying deployment failed')
-
-        return response
+        return self.send(payload)
 
     def notify_success(self, cluster, revision, service=None, rule=None):
         if not self.__url or not self.__service_match_re.search(service or rule):
@@ -97,10 +107,7 @@ class SlackNotification(object):
 
         payload = self.get_payload('Deployment finished successfully', messages, 'good')
 
-        response = requests.post(self.__url, json=payload)
-
-        if response.status_code != 200:
-            raise SlackException('Notifying deployment failed')
+        return self.send(payload)
 
     def notify_failure(self, cluster, error, service=None, rule=None):
         if not self.__url or not self.__service_match_re.search(service or rule):
@@ -122,9 +129,4 @@ class SlackNotification(object):
 
         payload = self.get_payload('Deployment failed', messages, 'danger')
 
-        response = requests.post(self.__url, json=payload)
-
-        if response.status_code != 200:
-            raise SlackException('Notifying deployment failed')
-
-        return response
+        return self.send(payload)
@@ -0,0 +1,73 @@
+WAITER_FIXED = 'fixed'
+WAITER_ADAPTIVE = 'adaptive'
+
+
+class Waiter(object):
+    """Decides how long to sleep between two checks of a service."""
+
+    def reset(self):
+        pass
+
+    def next_delay(self, service):
+        raise NotImplementedError
+
+
+class FixedWaiter(Waiter):
+    def __init__(self, sleep_time=1):
+        self.sleep_time = sleep_time
+
+    def next_delay(self, service):
+        return self.sleep_time
+
+
+class AdaptiveWaiter(Waiter):
+    """Polls tightly right after the service was updated, backs off
+    exponentially during the steady rollout and switches back to tight
+    polls, once the primary deployment nearly reached its desired count.
+    """
+
+    def __init__(self, min_delay=0.5, max_delay=10, factor=1.5,
+                 initial_polls=3, near_target_ratio=0.9, near_target_min_count=10):
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.factor = factor
+        self.initial_polls = initial_polls
+        self.near_target_ratio = near_target_ratio
+        self.near_target_min_count = near_target_min_count
+        self._polls = 0
+
+    def reset(self):
+        self._polls = 0
+
+    def next_delay(self, service):
+        self._polls += 1
+        if self._polls <= self.initial_polls or self.is_near_target(service):
+            return self.min_delay
+        delay = self.min_delay * self.factor ** (self._polls - self.initial_polls)
+        return min(delay, self.max_delay)
+
+    def is_near_target(self, service):
+        """The rollout is near its end, once the old deployments are gone
+        and all missing tasks of the primary deployment are starting. For
+        services with at least near_target_min_count tasks, it is enough that
+        near_target_ratio of them are running.
+        """
+        deployment = service.primary_deployment
+        if not deployment:
+            return False
+        if service.active_deployment is not deployment:
+            # old tasks are still draining, which may take minutes
+            return False
+        desired_count = deployment.desired_count
+        if not desired_count:
+            return True
+        if deployment.running_count + deployment.pending_count >= desired_count:
+            return True
+        return desired_count >= self.near_target_min_count and \
+            float(deployment.running_count) / desired_count >= self.near_target_ratio
+
+
+def get_waiter(strategy, sleep_time=1, max_sleep_time=10):
+    if strategy == WAITER_ADAPTIVE:
+        return AdaptiveWaiter(min_delay=sleep_time, max_delay=max_sleep_time)
+    return FixedWaiter(sleep_time)
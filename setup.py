@@ -39,7 +39,7 @@ setup(
     install_requires=dependencies,
     entry_points={
         'console_scripts': [
-            'ecs = ecs_deploy.cli:ecs',
+            'ecs = ecs_deploy.cli:main',
         ],
     },
     classifiers=[
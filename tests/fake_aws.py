@@ -0,0 +1,524 @@
+"""
+In-process stand-in for the ECS and EventBridge APIs.
+
+The server speaks the JSON protocol of both services, so the real boto3
+clients of ecs-deploy talk to it via the standard endpoint configuration
+(AWS_ENDPOINT_URL). Service rollouts progress with every DescribeServices
+call, latency and throttling can be simulated, and every API call is
+counted per operation.
+"""
+import json
+import math
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+from time import sleep, time
+
+from dateutil.tz import tzutc
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover (Python 2)
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+from threading import Thread
+
+REGION = u'eu-central-1'
+ACCOUNT_ID = u'123456789012'
+ARN_PREFIX = u'arn:aws:ecs:%s:%s:' % (REGION, ACCOUNT_ID)
+
+TARGET_PREFIXES = {
+    u'AmazonEC2ContainerServiceV20141113': u'ecs',
+    u'AWSEvents': u'events',
+}
+
+LIST_TASKS_MAX_RESULTS = 100
+DESCRIBE_TASKS_MAX_RESULTS = 100
+DESCRIBE_SERVICES_MAX_RESULTS = 10
+PUT_TARGETS_MAX_RESULTS = 10
+
+
+class FakeAwsError(Exception):
+    status = 400
+    code = u'ClientException'
+
+    def __init__(self, message, code=None):
+        super(FakeAwsError, self).__init__(message)
+        self.message = message
+        if code:
+            self.code = code
+
+
+class ThrottlingError(FakeAwsError):
+    code = u'ThrottlingException'
+
+
+def now():
+    return datetime.now(tz=tzutc())
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return (value - datetime(1970, 1, 1, tzinfo=tzutc())).total_seconds()
+    raise TypeError(repr(value))
+
+
+def camel_to_snake(name):
+    result = []
+    for character in name:
+        if character.isupper() and result:
+            result.append(u'_')
+        result.append(character.lower())
+    return u''.join(result)
+
+
+class FakeAwsBackend(object):
+    """State and behaviour of the fake ECS and EventBridge APIs.
+
+    latency: seconds every API call takes
+    max_calls_per_second: calls exceeding this rate are throttled (None: never)
+    rollout_polls: number of DescribeServices polls a rollout needs to finish
+    task_exit_code: exit code of the containers of tasks started by RunTask
+    run_task_capacity: tasks RunTask can start per call (None: unlimited)
+    """
+
+    def __init__(self, latency=0, max_calls_per_second=None, rollout_polls=3, task_exit_code=0,
+                 run_task_capacity=None):
+        self.latency = latency
+        self.max_calls_per_second = max_calls_per_second
+        self.rollout_polls = max(rollout_polls, 1)
+        self.task_exit_code = task_exit_code
+        self.run_task_capacity = run_task_capacity
+        self.calls = Counter()
+        self.throttled_calls = Counter()
+        self.task_definitions = {}
+        self.services = {}
+        self.tasks = {}
+        self.rules = {}
+        self._lock = Lock()
+        self._task_counter = 0
+        self._tokens = max_calls_per_second
+        self._tokens_updated = time()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled_calls.clear()
+
+    def handle(self, service_name, operation, params):
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            if self._is_throttled():
+                self.throttled_calls[operation] += 1
+                raise ThrottlingError(u'Rate exceeded')
+            self.calls[operation] += 1
+            handler = getattr(self, u'%s_%s' % (service_name, camel_to_snake(operation)), None)
+            if handler is None:
+                raise FakeAwsError(u'Operation not supported: %s' % operation, u'UnknownOperationException')
+            return handler(**params)
+
+    def _is_throttled(self):
+        if not self.max_calls_per_second:
+            return False
+        current_time = time()
+        elapsed = current_time - self._tokens_updated
+        self._tokens_updated = current_time
+        self._tokens = min(self.max_calls_per_second, self._tokens + elapsed * self.max_calls_per_second)
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    # Setup helpers
+
+    def create_task_definition(self, family, containers=None, **kwargs):
+        containers = containers or [{u'name': u'webserver', u'image': u'webserver:latest'}]
+        return self._register_task_definition(family, containers, **kwargs)
+
+    def create_service(self, cluster, name, family, desired_count=1, containers=None):
+        task_definition = self.create_task_definition(family, containers)
+        arn = task_definition[u'taskDefinitionArn']
+        deployment = self._create_deployment(arn, desired_count)
+        deployment[u'runningCount'] = desired_count
+        deployment[u'rolloutState'] = u'COMPLETED'
+        service = {
+            u'serviceArn': ARN_PREFIX + u'service/%s/%s' % (cluster, name),
+            u'serviceName': name,
+            u'clusterArn': ARN_PREFIX + u'cluster/%s' % cluster,
+            u'status': u'ACTIVE',
+            u'taskDefinition': arn,
+            u'desiredCount': desired_count,
+            u'runningCount': desired_count,
+            u'pendingCount': 0,
+            u'deployments': [deployment],
+            u'events': [],
+        }
+        self.services[(cluster, name)] = service
+        for _ in range(desired_count):
+            self._start_task(cluster, arn, group=u'service:%s' % name, status=u'RUNNING')
+        return service
+
+    def create_rule(self, name, cluster, task_definition_arn, target_id=u'target-1'):
+        self.rules[name] = []
+        self.add_target(name, cluster, task_definition_arn, target_id)
+
+    def add_target(self, rule, cluster, task_definition_arn, target_id):
+        self.rules[rule].append({
+            u'Id': target_id,
+            u'Arn': ARN_PREFIX + u'cluster/%s' % cluster,
+            u'RoleArn': u'arn:aws:iam::%s:role/ecsEventsRole' % ACCOUNT_ID,
+            u'EcsParameters': {
+                u'TaskDefinitionArn': task_definition_arn,
+                u'TaskCount': 1,
+            },
+        })
+
+    def get_service_tasks(self, cluster, name):
+        group = u'service:%s' % name
+        return [task for task in self.tasks.values()
+                if task[u'cluster'] == cluster and task[u'group'] == group and task[u'desiredStatus'] == u'RUNNING']
+
+    # ECS operations
+
+    def ecs_describe_services(self, services, cluster=u'default', **kwargs):
+        if len(services) > DESCRIBE_SERVICES_MAX_RESULTS:
+            raise FakeAwsError(u'Services cannot contain more than 10 elements', u'InvalidParameterException')
+        cluster = cluster.rpartition(u'/')[2]
+        found = []
+        failures = []
+        for name in services:
+            service = self.services.get((cluster, name.rpartition(u'/')[2]))
+            if service is None:
+                failures.append({u'arn': name, u'reason': u'MISSING'})
+                continue
+            self._advance_rollout(cluster, service)
+            found.append(service)
+        return {u'services': found, u'failures': failures}
+
+    def ecs_list_task_definitions(self, familyPrefix=u'', status=u'ACTIVE', sort=u'ASC', nextToken=None,
+                                  maxResults=100):
+        task_definitions = sorted(
+            (td for td in self.task_definitions.values()
+             if td[u'family'].startswith(familyPrefix) and td[u'status'] == status),
+            key=lambda td: (td[u'family'], td[u'revision']),
+            reverse=sort == u'DESC'
+        )
+        arns = [td[u'taskDefinitionArn'] for td in task_definitions]
+        return self._paginate(u'taskDefinitionArns', arns, nextToken, maxResults)
+
+    def ecs_list_clusters(self, nextToken=None, maxResults=100):
+        clusters = sorted(set(ARN_PREFIX + u'cluster/%s' % cluster for cluster, _ in self.services))
+        return self._paginate(u'clusterArns', clusters, nextToken, maxResults)
+
+    def ecs_list_services(self, cluster=u'default', nextToken=None, maxResults=10, **kwargs):
+        cluster = cluster.rpartition(u'/')[2]
+        arns = [service[u'serviceArn'] for (name, _), service in sorted(self.services.items()) if name == cluster]
+        return self._paginate(u'serviceArns', arns, nextToken, maxResults)
+
+    def ecs_describe_task_definition(self, taskDefinition, include=None):
+        task_definition = self._get_task_definition(taskDefinition)
+        response = {u'taskDefinition': dict(task_definition)}
+        tags = response[u'taskDefinition'].pop(u'tags', [])
+        if include and u'TAGS' in include:
+            response[u'tags'] = tags
+        return response
+
+    def ecs_register_task_definition(self, family, containerDefinitions, **kwargs):
+        task_definition = self._register_task_definition(family, containerDefinitions, **kwargs)
+        response = dict(task_definition)
+        tags = response.pop(u'tags', [])
+        return {u'taskDefinition': response, u'tags': tags}
+
+    def ecs_deregister_task_definition(self, taskDefinition):
+        task_definition = self._get_task_definition(taskDefinition)
+        task_definition[u'status'] = u'INACTIVE'
+        task_definition[u'deregisteredAt'] = now()
+        return {u'taskDefinition': task_definition}
+
+    def ecs_update_service(self, service, cluster=u'default', desiredCount=None, taskDefinition=None, **kwargs):
+        current = self.services.get((cluster, service))
+        if current is None:
+            raise FakeAwsError(u'Service not found.', u'ServiceNotFoundException')
+        desired_count = current[u'desiredCount'] if desiredCount is None else desiredCount
+        arn = self._get_task_definition(taskDefinition)[u'taskDefinitionArn'] if taskDefinition \
+            else current[u'taskDefinition']
+
+        primary = current[u'deployments'][0]
+        if arn == current[u'taskDefinition']:
+            primary[u'desiredCount'] = desired_count
+            primary[u'updatedAt'] = now()
+            primary[u'rolloutState'] = u'IN_PROGRESS'
+        else:
+            for deployment in current[u'deployments']:
+                deployment[u'status'] = u'ACTIVE'
+            current[u'deployments'].insert(0, self._create_deployment(arn, desired_count))
+        current[u'taskDefinition'] = arn
+        current[u'desiredCount'] = desired_count
+        return {u'service': current}
+
+    def ecs_list_tasks(self, cluster=u'default', serviceName=None, startedBy=None, desiredStatus=u'RUNNING',
+                       nextToken=None, maxResults=LIST_TASKS_MAX_RESULTS, **kwargs):
+        arns = [
+            task[u'taskArn'] for task in self.tasks.values()
+            if task[u'cluster'] == cluster
+            and (serviceName is None or task[u'group'] == u'service:%s' % serviceName)
+            and (startedBy is None or task.get(u'startedBy') == startedBy)
+            and task[u'desiredStatus'] == desiredStatus
+        ]
+        return self._paginate(u'taskArns', arns, nextToken, maxResults)
+
+    def ecs_describe_tasks(self, tasks, cluster=u'default', **kwargs):
+        if len(tasks) > DESCRIBE_TASKS_MAX_RESULTS:
+            raise FakeAwsError(u'Tasks cannot contain more than 100 elements', u'InvalidParameterException')
+        found = []
+        failures = []
+        for arn in tasks:
+            task = self.tasks.get(arn)
+            if task is None or task[u'cluster'] != cluster:
+                failures.append({u'arn': arn, u'reason': u'MISSING'})
+                continue
+            if task[u'group'].startswith(u'family:'):
+                self._advance_task(task)
+            found.append(self._describe_task(task))
+        return {u'tasks': found, u'failures': failures}
+
+    def ecs_run_task(self, taskDefinition, cluster=u'default', count=1, startedBy=None, **kwargs):
+        task_definition = self._get_task_definition(taskDefinition)
+        group = u'family:%s' % task_definition[u'family']
+        capacity = count if self.run_task_capacity is None else min(count, self.run_task_capacity)
+        started = [
+            self._describe_task(self._start_task(cluster, task_definition[u'taskDefinitionArn'], group,
+                                                 status=u'PROVISIONING', started_by=startedBy))
+            for _ in range(capacity)
+        ]
+        failures = [
+            {u'arn': ARN_PREFIX + u'container-instance/%s/%032x' % (cluster, index), u'reason': u'RESOURCE:MEMORY'}
+            for index in range(count - capacity)
+        ]
+        return {u'tasks': started, u'failures': failures}
+
+    # EventBridge operations
+
+    def events_list_rules(self, NextToken=None, Limit=100, NamePrefix=u'', **kwargs):
+        rules = [{u'Name': name, u'Arn': u'arn:aws:events:%s:%s:rule/%s' % (REGION, ACCOUNT_ID, name)}
+                 for name in sorted(self.rules) if name.startswith(NamePrefix)]
+        return self._paginate(u'Rules', rules, NextToken, Limit, token_key=u'NextToken')
+
+    def events_list_targets_by_rule(self, Rule, NextToken=None, Limit=100, **kwargs):
+        if Rule not in self.rules:
+            raise FakeAwsError(u'Rule %s does not exist.' % Rule, u'ResourceNotFoundException')
+        targets = [dict(target) for target in self.rules[Rule]]
+        return self._paginate(u'Targets', targets, NextToken, Limit, token_key=u'NextToken')
+
+    def events_put_targets(self, Rule, Targets, **kwargs):
+        if Rule not in self.rules:
+            raise FakeAwsError(u'Rule %s does not exist.' % Rule, u'ResourceNotFoundException')
+        if len(Targets) > PUT_TARGETS_MAX_RESULTS:
+            raise FakeAwsError(u'Targets must contain at most %d items.' % PUT_TARGETS_MAX_RESULTS,
+                               u'ValidationException')
+        targets = dict((target[u'Id'], target) for target in self.rules[Rule])
+        for target in Targets:
+            targets[target[u'Id']] = target
+        self.rules[Rule] = list(targets.values())
+        return {u'FailedEntryCount': 0, u'FailedEntries': []}
+
+    # Internals
+
+    @staticmethod
+    def _paginate(result_key, items, next_token, max_results, token_key=u'nextToken'):
+        start = int(next_token or 0)
+        response = {result_key: items[start:start + max_results]}
+        if start + max_results < len(items):
+            response[token_key] = str(start + max_results)
+        return response
+
+    def _register_task_definition(self, family, containers, tags=None, **kwargs):
+        revision = len([key for key in self.task_definitions if key[0] == family]) + 1
+        task_definition = {
+            u'taskDefinitionArn': ARN_PREFIX + u'task-definition/%s:%d' % (family, revision),
+            u'family': family,
+            u'revision': revision,
+            u'status': u'ACTIVE',
+            u'containerDefinitions': containers,
+            u'volumes': kwargs.pop(u'volumes', []),
+            u'registeredAt': now(),
+            u'tags': tags or [],
+        }
+        task_definition.update(kwargs)
+        self.task_definitions[(family, revision)] = task_definition
+        return task_definition
+
+    def _get_task_definition(self, identifier):
+        family, _, revision = identifier.rpartition(u'/')[2].partition(u':')
+        if revision:
+            task_definition = self.task_definitions.get((family, int(revision)))
+        else:
+            revisions = [td for key, td in self.task_definitions.items()
+                         if key[0] == family and td[u'status'] == u'ACTIVE']
+            task_definition = max(revisions, key=lambda td: td[u'revision']) if revisions else None
+        if task_definition is None:
+            raise FakeAwsError(u'Unable to describe task definition.')
+        return task_definition
+
+    def _create_deployment(self, task_definition_arn, desired_count):
+        created_at = now()
+        return {
+            u'id': u'ecs-svc/%d' % int(time() * 1000000),
+            u'status': u'PRIMARY',
+            u'taskDefinition': task_definition_arn,
+            u'desiredCount': desired_count,
+            u'runningCount': 0,
+            u'pendingCount': 0,
+            u'failedTasks': 0,
+            u'createdAt': created_at,
+            u'updatedAt': created_at,
+            u'rolloutState': u'IN_PROGRESS',
+        }
+
+    def _advance_rollout(self, cluster, service):
+        primary = service[u'deployments'][0]
+        if primary[u'rolloutState'] == u'COMPLETED':
+            return
+        desired_count = primary[u'desiredCount']
+        group = u'service:%s' % service[u'serviceName']
+        tasks = self.get_service_tasks(cluster, service[u'serviceName'])
+        step = int(math.ceil(float(max(desired_count, len(tasks), 1)) / self.rollout_polls))
+        current = [task for task in tasks if task[u'taskDefinitionArn'] == primary[u'taskDefinition']]
+        outdated = [task for task in tasks if task[u'taskDefinitionArn'] != primary[u'taskDefinition']]
+
+        for _ in range(min(step, desired_count - len(current))):
+            current.append(self._start_task(cluster, primary[u'taskDefinition'], group, status=u'RUNNING'))
+        for task in current[desired_count:][:step]:
+            self._stop_task(task)
+        for task in outdated[:step]:
+            self._stop_task(task)
+
+        running_count = len([task for task in current if task[u'desiredStatus'] == u'RUNNING'])
+        primary[u'runningCount'] = running_count
+        primary[u'updatedAt'] = now()
+        service[u'runningCount'] = running_count
+        if running_count == desired_count and len(outdated) <= step:
+            primary[u'rolloutState'] = u'COMPLETED'
+            del service[u'deployments'][1:]
+
+    def _start_task(self, cluster, task_definition_arn, group, status, started_by=None):
+        self._task_counter += 1
+        task = {
+            u'taskArn': ARN_PREFIX + u'task/%s/%032x' % (cluster, self._task_counter),
+            u'clusterArn': ARN_PREFIX + u'cluster/%s' % cluster,
+            u'cluster': cluster,
+            u'taskDefinitionArn': task_definition_arn,
+            u'group': group,
+            u'lastStatus': status,
+            u'desiredStatus': u'RUNNING',
+            u'createdAt': now(),
+        }
+        if started_by:
+            task[u'startedBy'] = started_by
+        self.tasks[task[u'taskArn']] = task
+        return task
+
+    def _stop_task(self, task):
+        task[u'lastStatus'] = u'STOPPED'
+        task[u'desiredStatus'] = u'STOPPED'
+        task[u'stoppedAt'] = now()
+
+    def _advance_task(self, task):
+        if task[u'lastStatus'] == u'PROVISIONING':
+            task[u'lastStatus'] = u'RUNNING'
+        elif task[u'lastStatus'] == u'RUNNING':
+            self._stop_task(task)
+            task[u'stoppedReason'] = u'Essential container in task exited'
+            task[u'containers'] = [{u'name': u'webserver', u'lastStatus': u'STOPPED',
+                                    u'exitCode': self.task_exit_code}]
+
+    @staticmethod
+    def _describe_task(task):
+        return dict((key, value) for key, value in task.items() if key != u'cluster')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeAwsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        prefix, _, operation = (self.headers.get('X-Amz-Target') or '').partition('.')
+        service_name = TARGET_PREFIXES.get(prefix)
+        try:
+            if service_name is None:
+                raise FakeAwsError(u'Unknown target: %s' % prefix, u'UnknownOperationException')
+            params = json.loads(body.decode('utf-8') or '{}')
+            response = self.server.backend.handle(service_name, operation, params)
+            self._respond(200, response)
+        except FakeAwsError as e:
+            self._respond(e.status, {u'__type': e.code, u'message': e.message})
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload, default=to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAwsServer(object):
+    """Serves a FakeAwsBackend on a random local port:
+
+        with FakeAwsServer(backend) as server:
+            os.environ.update(server.environ)
+    """
+
+    def __init__(self, backend=None, host='127.0.0.1', port=0):
+        self.backend = backend or FakeAwsBackend()
+        self._server = ThreadingHTTPServer((host, port), FakeAwsRequestHandler)
+        self._server.backend = self.backend
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def environ(self):
+        return {
+            'AWS_ENDPOINT_URL': self.endpoint_url,
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+            'AWS_DEFAULT_REGION': REGION,
+            'AWS_CONFIG_FILE': '/dev/null',
+            'AWS_SHARED_CREDENTIALS_FILE': '/dev/null',
+        }
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,132 @@
+"""
+In-process stand-in for a container registry.
+
+The server implements the manifest endpoint of the Docker Registry HTTP API
+v2 (HEAD /v2/<repository>/manifests/<reference>) and, optionally, the
+anonymous bearer token flow of Docker Hub, so the real RegistryResolver can
+be tested against it. Every manifest request is counted.
+"""
+import hashlib
+import json
+from collections import Counter
+from threading import Lock
+
+from tests.fake_aws import ThreadingHTTPServer
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # pragma: no cover (Python 2)
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
+from threading import Thread
+
+TOKEN = u'fake-token'
+
+
+def make_digest(value):
+    return u'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class FakeRegistry(object):
+    def __init__(self, require_token=False, token_body=None):
+        self.require_token = require_token
+        self.token_body = token_body
+        self.manifests = {}
+        self.requests = Counter()
+        self._lock = Lock()
+
+    def push(self, repository, tag):
+        digest = make_digest(u'%s:%s' % (repository, tag))
+        self.manifests[(repository, tag)] = digest
+        self.manifests[(repository, digest)] = digest
+        return digest
+
+    def get_digest(self, repository, reference):
+        with self._lock:
+            self.requests[(repository, reference)] += 1
+        return self.manifests.get((repository, reference))
+
+
+class FakeRegistryRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        registry = self.server.registry
+        path = urlparse(self.path).path
+        if not path.startswith('/v2/') or '/manifests/' not in path:
+            return self._respond(404)
+        if registry.require_token and self.headers.get('Authorization') != u'Bearer %s' % TOKEN:
+            return self._respond(401, {
+                'WWW-Authenticate': 'Bearer realm="%s/token",service="fake-registry"' % self.server.url,
+            })
+        repository, _, reference = path[len('/v2/'):].partition('/manifests/')
+        digest = registry.get_digest(repository, reference)
+        if digest is None:
+            return self._respond(404)
+        self._respond(200, {'Docker-Content-Digest': digest})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/token':
+            return self._respond(404)
+        query = parse_qs(url.query)
+        if query.get('service') != ['fake-registry'] or not query.get('scope'):
+            return self._respond(400)
+        body = self.server.registry.token_body
+        if body is None:
+            body = json.dumps({u'token': TOKEN}).encode('utf-8')
+        self._respond(200, {'Content-Type': 'application/json'}, body)
+
+    def _respond(self, status, headers=None, body=b''):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRegistryServer(object):
+    """Serves a FakeRegistry on a random local port:
+
+        with FakeRegistryServer(registry) as server:
+            image = server.host + '/my-app:1.2.3'
+    """
+
+    def __init__(self, registry=None, host='127.0.0.1', port=0):
+        self.registry = registry or FakeRegistry()
+        self._server = ThreadingHTTPServer((host, port), FakeRegistryRequestHandler)
+        self._server.registry = self.registry
+        self._server.url = self.url
+        self._thread = None
+
+    @property
+    def host(self):
+        host, port = self._server.server_address[:2]
+        return '%s:%d' % (host, port)
+
+    @property
+    def url(self):
+        return 'http://%s' % self.host
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
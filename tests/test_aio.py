@@ -0,0 +1,110 @@
+import asyncio
+from contextvars import ContextVar
+from threading import current_thread
+
+import pytest
+
+from ecs_deploy.aio import (AsyncEcsClient, AsyncEcsAction, AsyncDeployAction, AsyncScaleAction, AsyncRunAction,
+                            get_async_action, run)
+from ecs_deploy.ecs import EcsAction, DeployAction, ScaleAction, RunAction, EcsConnectionError
+from tests.test_ecs import EcsTestClient, CLUSTER_NAME, SERVICE_NAME, TASK_DEFINITION_ARN_1
+
+
+@pytest.fixture
+def client():
+    return AsyncEcsClient(EcsTestClient(u'access_key', u'secret_key'))
+
+
+def test_run():
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    assert run(add(1, 2)) == 3
+
+
+def test_client_offloads_calls(client):
+    main_thread = current_thread()
+    threads = []
+
+    def describe_services(cluster_name, service_name):
+        threads.append(current_thread())
+        return {u'services': [{u'serviceName': service_name}]}
+
+    client.client.describe_services = describe_services
+    response = run(client.describe_services(cluster_name=CLUSTER_NAME, service_name=SERVICE_NAME))
+
+    assert response == {u'services': [{u'serviceName': SERVICE_NAME}]}
+    assert threads and threads[0] is not main_thread
+
+
+def test_client_calls_in_context_of_task(client):
+    variable = ContextVar('variable', default=None)
+
+    async def call(value):
+        variable.set(value)
+        return await client.call(variable.get)
+
+    async def main():
+        return await asyncio.gather(call(1), call(2))
+
+    assert run(main()) == [1, 2]
+    assert variable.get() is None
+
+
+def test_client_attributes(client):
+    assert client.access_key_id == u'access_key'
+
+
+def test_create_action(client):
+    deployment = run(AsyncDeployAction.create(client, CLUSTER_NAME, SERVICE_NAME))
+
+    assert isinstance(deployment.action, DeployAction)
+    assert deployment.client is client
+    assert deployment.cluster_name == CLUSTER_NAME
+    assert deployment.service_name == SERVICE_NAME
+    assert deployment.service.task_definition == TASK_DEFINITION_ARN_1
+
+
+def test_create_action_with_unknown_service(client):
+    with pytest.raises(EcsConnectionError):
+        run(AsyncDeployAction.create(client, CLUSTER_NAME, u'unknown'))
+
+
+def test_action_methods(client):
+    deployment = run(AsyncDeployAction.create(client, CLUSTER_NAME, SERVICE_NAME))
+
+    async def deploy():
+        task_definition = await deployment.get_current_task_definition(deployment.service)
+        task_definition.set_images(u'latest')
+        new_task_definition = await deployment.update_task_definition(task_definition)
+        await deployment.deploy(new_task_definition)
+        service = await deployment.get_service_snapshot()
+        return new_task_definition, await deployment.is_deployed(service)
+
+    new_task_definition, deployed = run(deploy())
+    assert new_task_definition.revision == 2
+    assert deployed
+
+
+def test_concurrent_actions(client):
+    async def scale_all():
+        actions = await asyncio.gather(*[
+            AsyncScaleAction.create(client, CLUSTER_NAME, SERVICE_NAME) for _ in range(20)
+        ])
+        return await asyncio.gather(*[action.scale(2) for action in actions])
+
+    services = run(scale_all())
+    assert len(services) == 20
+
+
+def test_get_async_action(client):
+    sync_client = client.client
+    assert type(get_async_action(DeployAction(sync_client, CLUSTER_NAME, SERVICE_NAME))) is AsyncDeployAction
+    assert type(get_async_action(ScaleAction(sync_client, CLUSTER_NAME, SERVICE_NAME))) is AsyncScaleAction
+    assert type(get_async_action(RunAction(sync_client, CLUSTER_NAME))) is AsyncRunAction
+    assert type(get_async_action(EcsAction(sync_client, None, None))) is AsyncEcsAction
+
+    action = get_async_action(DeployAction(sync_client, CLUSTER_NAME, SERVICE_NAME), client)
+    assert action.client is client
+    assert action.action.client is sync_client
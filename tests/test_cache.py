@@ -0,0 +1,160 @@
+import os
+import stat
+from datetime import datetime, timedelta
+
+from dateutil.tz import tzutc
+from pytest import fixture
+
+from ecs_deploy.cache import FileCache, CredentialCache, TaskDefinitionCache, RuleIndexCache, get_cache_dir, \
+    is_cache_enabled, to_timestamp
+
+
+def get_credentials(expires_in):
+    return {
+        'AccessKeyId': 'key',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': datetime.now(tz=tzutc()) + timedelta(seconds=expires_in),
+    }
+
+
+@fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def test_get_cache_dir(monkeypatch):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', '/tmp/ecs-deploy-test')
+    assert get_cache_dir('sts') == '/tmp/ecs-deploy-test/sts'
+
+
+def test_is_cache_enabled(monkeypatch):
+    monkeypatch.delenv('ECS_DEPLOY_TEST_CACHE', raising=False)
+    assert is_cache_enabled('ECS_DEPLOY_TEST_CACHE') is True
+    assert is_cache_enabled('ECS_DEPLOY_TEST_CACHE', default=False) is False
+    monkeypatch.setenv('ECS_DEPLOY_TEST_CACHE', 'Off')
+    assert is_cache_enabled('ECS_DEPLOY_TEST_CACHE') is False
+    monkeypatch.setenv('ECS_DEPLOY_TEST_CACHE', '1')
+    assert is_cache_enabled('ECS_DEPLOY_TEST_CACHE', default=False) is True
+
+
+def test_to_timestamp():
+    assert to_timestamp('1970-01-01T01:00:00Z') == 3600
+    assert to_timestamp(datetime(1970, 1, 1, 0, 1, tzinfo=tzutc())) == 60
+
+
+def test_file_cache(cache_dir):
+    cache = FileCache(cache_dir)
+    assert cache.get('foo') is None
+    cache.set('foo', {'bar': 'baz'})
+    assert cache.get('foo') == {'bar': 'baz'}
+    assert stat.S_IMODE(os.stat(cache.get_path('foo')).st_mode) == 0o600
+    cache.delete('foo')
+    assert cache.get('foo') is None
+
+
+def test_file_cache_ignores_corrupt_files(cache_dir):
+    cache = FileCache(cache_dir)
+    cache.set('foo', {})
+    with open(cache.get_path('foo'), 'w') as f:
+        f.write('{corrupt')
+    assert cache.get('foo') is None
+
+
+def test_credential_cache_key():
+    assert CredentialCache.get_key('123', 'Role', 'profile') != CredentialCache.get_key('123', 'Role', 'other')
+    assert CredentialCache.get_key('123', 'Role', access_key_id='A') != CredentialCache.get_key('123', 'Role')
+
+
+def test_credential_cache_fetch(cache_dir):
+    cache = CredentialCache(cache_dir)
+    requests = []
+
+    def request_credentials():
+        requests.append(1)
+        return get_credentials(3600)
+
+    first = cache.fetch('key', request_credentials)
+    second = CredentialCache(cache_dir).fetch('key', request_credentials)
+
+    assert len(requests) == 1
+    assert first['AccessKeyId'] == second['AccessKeyId'] == 'key'
+
+
+def test_credential_cache_refreshes_credentials_within_expiry_margin(cache_dir):
+    cache = CredentialCache(cache_dir, expiry_margin=300)
+    cache.set('key', get_credentials(200))
+    credentials = cache.fetch('key', lambda: dict(get_credentials(3600), AccessKeyId='new-key'))
+    assert credentials['AccessKeyId'] == 'new-key'
+    assert cache.get('key')['AccessKeyId'] == 'new-key'
+
+
+def test_rule_index_cache_fetch(cache_dir):
+    builds = []
+
+    def build_index():
+        builds.append(1)
+        return {'my-task': {'nightly': ['target-1']}}
+
+    first = RuleIndexCache(cache_dir).fetch('scope', build_index)
+    second = RuleIndexCache(cache_dir).fetch('scope', build_index)
+
+    assert len(builds) == 1
+    assert first == second == {'my-task': {'nightly': ['target-1']}}
+
+
+def test_rule_index_cache_rebuilds_expired_index(cache_dir):
+    cache = RuleIndexCache(cache_dir, ttl=300)
+    cache.set('scope', {'index': {'my-task': {'old': ['target-1']}}, 'built_at': 0})
+
+    index = cache.fetch('scope', lambda: {'my-task': {'new': ['target-1']}})
+
+    assert index == {'my-task': {'new': ['target-1']}}
+    assert cache.get('scope')['index'] == index
+
+
+def test_task_definition_cache_has_revision():
+    assert TaskDefinitionCache.has_revision(u'arn:aws:ecs:eu-central-1:123456789012:task-definition/test:1')
+    assert TaskDefinitionCache.has_revision(u'test:1')
+    assert not TaskDefinitionCache.has_revision(u'arn:aws:ecs:eu-central-1:123456789012:task-definition/test')
+    assert not TaskDefinitionCache.has_revision(u'test')
+
+
+def test_task_definition_cache_returns_copies():
+    cache = TaskDefinitionCache()
+    payload = {u'taskDefinition': {u'family': u'test'}}
+    cache.set(u'test:1', payload)
+    payload[u'taskDefinition'][u'family'] = u'modified'
+    cache.get(u'test:1')[u'taskDefinition'][u'family'] = u'modified'
+    assert cache.get(u'test:1') == {u'taskDefinition': {u'family': u'test'}}
+
+
+def test_task_definition_cache_evicts_least_recently_used():
+    cache = TaskDefinitionCache(max_entries=2)
+    cache.set(u'test:1', {u'revision': 1})
+    cache.set(u'test:2', {u'revision': 2})
+    cache.get(u'test:1')
+    cache.set(u'test:3', {u'revision': 3})
+    assert cache.get(u'test:1') == {u'revision': 1}
+    assert cache.get(u'test:2') is None
+    assert cache.get(u'test:3') == {u'revision': 3}
+    cache.delete(u'test:3')
+    assert cache.get(u'test:3') is None
+
+
+def test_task_definition_cache_on_disk(cache_dir):
+    cache = TaskDefinitionCache(cache_dir, max_entries=2, disk=True)
+    cache.set(u'test:1', {u'revision': 1})
+    cache.set(u'test:2', {u'revision': 2})
+    os.utime(cache._disk.get_path(u'test:1'), (1000, 1000))
+    os.utime(cache._disk.get_path(u'test:2'), (2000, 2000))
+
+    cache = TaskDefinitionCache(cache_dir, max_entries=2, disk=True)
+    assert cache.get(u'test:1') == {u'revision': 1}
+    cache.set(u'test:3', {u'revision': 3})
+
+    cache = TaskDefinitionCache(cache_dir, max_entries=2, disk=True)
+    assert cache.get(u'test:1') == {u'revision': 1}
+    assert cache.get(u'test:2') is None
+    assert cache.get(u'test:3') == {u'revision': 3}
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.json')]) == 2
@@ -1,17 +1,23 @@
+import json
 from datetime import datetime
 
 import pytest
+from botocore.exceptions import NoCredentialsError
 from click.testing import CliRunner
 from mock.mock import patch
 
+from benchmarks.startup import measure_import
 from ecs_deploy import cli
 from ecs_deploy.cli import get_client, record_deployment
-from ecs_deploy.ecs import EcsClient
+from ecs_deploy.ecs import EcsClient, EcsTask
 from ecs_deploy.newrelic import Deployment, NewRelicDeploymentException
+from ecs_deploy.notification import NotificationDispatcher
+from ecs_deploy.registry import CachingResolver, set_resolver
 from tests.test_ecs import EcsTestClient, CLUSTER_NAME, SERVICE_NAME, \
     TASK_DEFINITION_ARN_1, TASK_DEFINITION_ARN_2, TASK_DEFINITION_FAMILY_1, \
     TASK_DEFINITION_REVISION_2, TASK_DEFINITION_REVISION_1, \
     TASK_DEFINITION_REVISION_3
+from tests.test_registry import StaticResolver
 
 
 @pytest.fixture
@@ -37,6 +43,11 @@ def test_ecs(runner):
     assert '  scale   ' in result.output
 
 
+def test_import_is_lightweight():
+    _, heavy_modules = measure_import()
+    assert heavy_modules == []
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_deploy_without_credentials(get_client, runner):
     get_client.return_value = EcsTestClient()
@@ -76,6 +87,19 @@ def test_deploy(get_client, runner):
     assert u"Updating task definition" not in result.output
 
 
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_reuses_unchanged_task_definition(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    with patch('ecs_deploy.ecs.EcsAction.find_task_definition') as find_task_definition:
+        result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '--reuse-task-definition'))
+    assert result.exit_code == 0, result.output
+    assert u'Reusing unchanged task definition revision: 1' in result.output
+    assert u'Successfully changed task definition to: test-task:1' in result.output
+    assert u'Creating new task definition revision' not in result.output
+    assert u'Deregister task definition revision' not in result.output
+    find_task_definition.assert_not_called()
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_deploy_with_rollback(get_client, runner):
     get_client.return_value = EcsTestClient('acces_key', 'secret_key', wait=2)
@@ -784,6 +808,15 @@ def test_deploy_with_wait_within_timeout(get_client, runner):
     assert u'...' in result.output
 
 
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_with_adaptive_waiter(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key', wait=1)
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '--waiter', 'adaptive', '--sleep-time', '0.1',
+                                        '--max-sleep-time', '0.5'))
+    assert result.exit_code == 0
+    assert u'Deployment successful' in result.output
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_deploy_without_timeout(get_client, runner):
     get_client.return_value = EcsTestClient('acces_key', 'secret_key', wait=2)
@@ -808,6 +841,126 @@ def test_deploy_unknown_task_definition_arn(get_client, runner):
     assert u"Unknown task definition arn: arn:aws:ecs:eu-central-1:123456789012:task-definition/foobar:55" in result.output
 
 
+@pytest.fixture
+def manifest(tmp_path):
+    def write(services):
+        path = tmp_path / 'manifest.json'
+        path.write_text(json.dumps(services))
+        return str(path)
+    return write
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    path = manifest([
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'tag': 'latest'},
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'env': {'webserver': {'foo': 'baz'}}},
+    ])
+    result = runner.invoke(cli.deploy_many, (path, '--concurrency', '2'))
+    assert result.exit_code == 0
+    assert not result.exception
+    assert get_client.call_count == 1
+    assert u'Changed image of container "webserver" to: "webserver:latest" (was: "webserver:123")' in result.output
+    assert u'Changed environment "foo" of container "webserver" to: "baz"' in result.output
+    assert result.output.count(u'- test-cluster/test-service: Deployed test-task:2') == 2
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many_with_failed_service(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    path = manifest({'services': [
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME},
+        {'cluster': CLUSTER_NAME, 'service': 'unknown-service'},
+    ]})
+    result = runner.invoke(cli.deploy_many, (path,))
+    assert result.exit_code == 1
+    assert u'- test-cluster/test-service: Deployed test-task:2' in result.output
+    assert u'- test-cluster/unknown-service: An error occurred when calling the DescribeServices operation: ' \
+           u'Service not found: unknown-service' in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many_with_unexpected_error(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    path = manifest([
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'tag': 'latest'},
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'task': 'test-task:1'},
+    ])
+    get_task_definition = cli.get_task_definition
+
+    def fail_for_task(action, task):
+        if task:
+            raise NoCredentialsError()
+        return get_task_definition(action, task)
+
+    with patch('ecs_deploy.cli.get_task_definition', side_effect=fail_for_task):
+        result = runner.invoke(cli.deploy_many, (path,))
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, NoCredentialsError)
+    assert u'- test-cluster/test-service: Deployed test-task:2' in result.output
+    assert u'- test-cluster/test-service: Unexpected error: NoCredentialsError: Unable to locate credentials' \
+           in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many_with_rollback(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key', wait=2)
+    path = manifest([{'cluster': CLUSTER_NAME, 'service': SERVICE_NAME}])
+    result = runner.invoke(cli.deploy_many, (path, '--timeout', '1', '--rollback'))
+    assert result.exit_code == 1
+    assert u'Deployment of test-cluster/test-service failed due to timeout' in result.output
+    assert u'- test-cluster/test-service: Rolled back to test-task:1' in result.output
+
+
+def test_deploy_many_with_invalid_manifest(runner, manifest):
+    path = manifest([{'cluster': CLUSTER_NAME}])
+    result = runner.invoke(cli.deploy_many, (path,))
+    assert result.exit_code == 1
+    assert u'requires a "cluster" and a "service"' in result.output
+
+
+@pytest.mark.parametrize('key, value, expected', (
+    ('tag', 123, u'a string'),
+    ('image', ['webserver:1.2.3'], u'an object of container names and strings'),
+    ('command', {'webserver': ['run']}, u'an object of container names and strings'),
+    ('env', {'webserver': 'foo=bar'}, u'an object of container names and objects of names and strings'),
+    ('secret', {'webserver': {'foo': 1}}, u'an object of container names and objects of names and strings'),
+))
+def test_deploy_many_with_invalid_manifest_types(runner, manifest, key, value, expected):
+    path = manifest([{'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, key: value}])
+    result = runner.invoke(cli.deploy_many, (path,))
+    assert result.exit_code == 1
+    assert u'Invalid "%s" of service test-cluster/test-service in manifest %s: expected %s' % (
+        key, path, expected) in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many_prefixes_parallel_output(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    path = manifest([
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'tag': 'latest'},
+        {'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'env': {'webserver': {'foo': 'baz'}}},
+    ])
+    result = runner.invoke(cli.deploy_many, (path, '--concurrency', '2'))
+    assert result.exit_code == 0, result.output
+    prefix = u'test-cluster/test-service: '
+    assert result.output.count(prefix + u'Creating new task definition revision') == 2
+    assert result.output.count(prefix + u'Deployment of test-cluster/test-service successful') == 2
+    # the progress dots of parallel deployments would be interleaved
+    assert not any(line.startswith(u'.') for line in result.output.splitlines())
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_many_without_concurrency_does_not_prefix_output(get_client, runner, manifest):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    path = manifest([{'cluster': CLUSTER_NAME, 'service': SERVICE_NAME, 'tag': 'latest'}])
+    result = runner.invoke(cli.deploy_many, (path, '--concurrency', '1'))
+    assert result.exit_code == 0, result.output
+    assert u'\nCreating new task definition revision' in result.output
+    assert u'test-cluster/test-service: Creating' not in result.output
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_scale_without_credentials(get_client, runner):
     get_client.return_value = EcsTestClient()
@@ -988,6 +1141,89 @@ def test_run_task_with_invalid_cluster(get_client, runner):
     assert result.output == u'An error occurred (ClusterNotFoundException) when calling the RunTask operation: Cluster not found.\n\n'
 
 
+def make_stopped_task(task_arn, exit_code):
+    return EcsTask(taskArn=task_arn, lastStatus=u'STOPPED', stoppedReason=u'Essential container in task exited',
+                   containers=[{u'name': u'webserver', u'exitCode': exit_code}])
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.RunAction.describe_tasks')
+def test_run_task_wait(describe_tasks, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    describe_tasks.side_effect = [
+        [EcsTask(taskArn=u'arn:foo:bar', lastStatus=u'RUNNING'), make_stopped_task(u'arn:lorem:ipsum', 0)],
+        [make_stopped_task(u'arn:foo:bar', 0)],
+    ]
+    result = runner.invoke(cli.run, (CLUSTER_NAME, 'test-task', '2', '--wait', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Waiting for 2 tasks to stop' in result.output
+    assert u'arn:foo:bar: Essential container in task exited\n- webserver: exit code 0' in result.output
+    assert u'All 2 tasks succeeded' in result.output
+    assert describe_tasks.call_args_list[1][0][0] == [u'arn:foo:bar']
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.RunAction.describe_tasks')
+def test_run_task_wait_with_failed_task(describe_tasks, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    failed_task = make_stopped_task(u'arn:lorem:ipsum', 2)
+    failed_task[u'containers'][0][u'reason'] = u'Migration failed'
+    describe_tasks.return_value = [make_stopped_task(u'arn:foo:bar', 0), failed_task]
+    result = runner.invoke(cli.run, (CLUSTER_NAME, 'test-task', '2', '--wait'))
+
+    assert result.exit_code == 2
+    assert u'- webserver: exit code 2 (Migration failed)' in result.output
+    assert u'1 of 2 tasks failed' in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.RunAction.describe_tasks')
+def test_run_task_wait_with_failed_sidecar(describe_tasks, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    task = make_stopped_task(u'arn:foo:bar', 0)
+    task[u'containers'].append({u'name': u'log-router', u'exitCode': 137})
+    task.essential_containers = [u'webserver']
+    describe_tasks.return_value = [task, make_stopped_task(u'arn:lorem:ipsum', 0)]
+    result = runner.invoke(cli.run, (CLUSTER_NAME, 'test-task', '2', '--wait'))
+
+    assert result.exit_code == 0, result.output
+    assert u'- log-router: exit code 137 (not essential)' in result.output
+    assert u'All 2 tasks succeeded' in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.RunAction.describe_tasks')
+def test_run_task_wait_with_tasks_not_started(describe_tasks, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    describe_tasks.return_value = [make_stopped_task(u'arn:foo:bar', 0), make_stopped_task(u'arn:lorem:ipsum', 0)]
+    with patch.object(EcsTestClient, 'run_task', return_value={
+        u'tasks': [dict(taskArn='arn:foo:bar'), dict(taskArn='arn:lorem:ipsum')],
+        u'failures': [{u'arn': u'arn:container-instance', u'reason': u'RESOURCE:MEMORY'}],
+    }):
+        result = runner.invoke(cli.run, (CLUSTER_NAME, 'test-task', '3', '--wait'))
+
+    assert result.exit_code == 1
+    assert u'Failed to start 1 instances of task: test-task:2' in result.output
+    assert u'- RESOURCE:MEMORY (arn:container-instance)' in result.output
+    assert u'Only 2 of 3 tasks started' in result.output
+    assert u'tasks succeeded' not in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.RunAction.describe_tasks')
+def test_run_task_wait_with_timeout(describe_tasks, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    describe_tasks.return_value = [make_stopped_task(u'arn:foo:bar', 0),
+                                   EcsTask(taskArn=u'arn:lorem:ipsum', lastStatus=u'RUNNING')]
+    result = runner.invoke(cli.run, (CLUSTER_NAME, 'test-task', '2', '--wait', '--timeout', '0'))
+
+    assert result.exit_code == 1
+    assert describe_tasks.call_count == 1
+    assert u'arn:foo:bar: Essential container in task exited' in result.output
+    assert u'Timeout: 1 of 2 tasks did not stop within 0 seconds' in result.output
+
+
 @patch('ecs_deploy.newrelic.Deployment')
 def test_record_deployment_without_revision(Deployment):
     result = record_deployment(None, None, None, None, None, None, None)
@@ -1026,6 +1262,76 @@ def test_record_deployment_tag(deployment_init, deployment_deploy, secho):
     assert result is True
 
 
+@patch('click.secho')
+@patch.object(Deployment, 'deploy')
+@patch.object(Deployment, '__init__')
+def test_record_deployment_with_dispatcher(deployment_init, deployment_deploy, secho):
+    deployment_init.return_value = None
+    dispatcher = NotificationDispatcher()
+    result = record_deployment('1.2.3', 'APIKEY', 'APPID', 'EU', None, 'Comment', 'user', dispatcher=dispatcher)
+
+    assert dispatcher.flush() == []
+    deployment_deploy.assert_called_once_with('1.2.3', '', 'Comment')
+    secho.assert_any_call('Recording deployment in New Relic (in the background)\n')
+    assert result is True
+
+
+@patch('ecs_deploy.slack.post')
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_with_slack_notifications(get_client, post, runner):
+    post.return_value.status_code = 200
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '-t', 'latest',
+                                        '--slack-url', 'https://hooks.slack.test'))
+
+    assert result.exit_code == 0
+    assert u'Deployment successful' in result.output
+    assert [call[1]['json']['attachments'][0]['pretext'] for call in post.call_args_list] == [
+        'Deployment has started',
+        'Deployment finished successfully',
+    ]
+
+
+@patch('ecs_deploy.slack.post')
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_with_failed_slack_notifications(get_client, post, runner, caplog):
+    post.return_value.status_code = 500
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '-t', 'latest',
+                                        '--slack-url', 'https://hooks.slack.test'))
+
+    assert result.exit_code == 0
+    assert u'Deployment successful' in result.output
+    assert u'Sending notification failed: Notifying deployment failed' in caplog.text
+
+
+@patch('ecs_deploy.slack.post')
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_with_rollback_sends_failure_notification(get_client, post, runner):
+    post.return_value.status_code = 200
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key', wait=2)
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '--timeout=1', '--rollback',
+                                        '--slack-url', 'https://hooks.slack.test'))
+
+    assert result.exit_code == 1
+    assert u'Rollback successful' in result.output
+    assert [call[1]['json']['attachments'][0]['pretext'] for call in post.call_args_list] == [
+        'Deployment has started',
+        'Deployment failed',
+    ]
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_with_newrelic_errors(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    with patch.object(Deployment, 'deploy', side_effect=NewRelicDeploymentException('Recording deployment failed')):
+        result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, 'rule', '-t', 'latest',
+                                          '--newrelic-apikey', 'test', '--newrelic-appid', 'test'))
+
+    assert result.exit_code == 1
+    assert u'Recording deployment failed' in result.output
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_update_without_credentials(get_client, runner):
     get_client.return_value = EcsTestClient()
@@ -1421,6 +1727,91 @@ def test_cron(get_client, runner):
     assert u'Successfully deregistered revision: 2' in result.output
 
 
+@patch('ecs_deploy.cli.get_client')
+def test_cron_with_multiple_rules(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, 'hourly-sync',
+                                      '--rule-prefix', 'nightly-'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Updating 3 scheduled tasks' in result.output
+    assert u'Successfully updated scheduled task hourly-sync (1 targets)' in result.output
+    assert u'Successfully updated scheduled task nightly-report (1 targets)' in result.output
+    assert u'Skipped scheduled task nightly-cleanup (no targets of test-task)' in result.output
+    assert u'Successfully deregistered revision: 2' in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_with_named_rule_of_other_family(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, 'nightly-cleanup'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Successfully updated scheduled task nightly-cleanup (1 targets)' in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_with_prefix_without_matching_targets(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, '--rule-prefix', 'nightly-c'))
+
+    assert result.exit_code == 1
+    assert u'Skipped scheduled task nightly-cleanup (no targets of test-task)' in result.output
+    assert u'No rules found with targets of task definition family: test-task' in result.output
+    assert u'Deregister task definition revision' not in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_without_rules(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1))
+
+    assert result.exit_code == 1
+    assert u'Please specify at least one rule, a --rule-prefix or --discover' in result.output
+
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, '--rule-prefix', 'weekly-'))
+
+    assert result.exit_code == 1
+    assert u'No rules found with prefix: weekly-' in result.output
+    assert u'Creating new task definition revision' not in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_discover(get_client, runner, monkeypatch, tmp_path):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path))
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, '--discover'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Updating 2 scheduled tasks' in result.output
+    assert u'Successfully updated scheduled task hourly-sync (1 targets)' in result.output
+    assert u'Successfully updated scheduled task nightly-report (1 targets)' in result.output
+    assert u'nightly-cleanup' not in result.output
+
+
+@patch('ecs_deploy.cli.get_client')
+@patch('ecs_deploy.ecs.CronAction.discover_rules', return_value=[])
+def test_cron_discover_without_rules(discover_rules, get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, '--discover', '--refresh-index'))
+
+    assert result.exit_code == 1
+    assert u'No rules found with targets of task definition family: test-task' in result.output
+    discover_rules.assert_called_once_with(u'test-task', True)
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_cron_with_failed_rule(get_client, runner):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.cron, (CLUSTER_NAME, TASK_DEFINITION_FAMILY_1, 'hourly-sync', 'failing-rule'))
+
+    assert result.exit_code == 1
+    assert u'Successfully updated scheduled task hourly-sync (1 targets)' in result.output
+    assert u'- failing-rule: Rule failing-rule has no ECS targets' in result.output
+    assert u'Failed to update 1 of 2 scheduled tasks' in result.output
+    assert u'Deregister task definition revision' not in result.output
+
+
 @patch('ecs_deploy.cli.get_client')
 def test_diff(get_client, runner):
     get_client.return_value = EcsTestClient('acces_key', 'secret_key')
@@ -1470,3 +1861,65 @@ def test_diff_without_credentials(get_client, runner):
 
     assert result.exit_code == 1
     assert u'Unable to locate credentials. Configure credentials by running "aws configure".\n\n' in result.output
+
+
+@pytest.fixture
+def resolver():
+    resolver = StaticResolver({u'webserver:latest': u'sha256:abc', u'application:latest': u'sha256:def'})
+    set_resolver(CachingResolver(resolver))
+    yield resolver
+    set_resolver(None)
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_validate_images(get_client, runner, resolver):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '-t', 'latest', '--validate-images'))
+    assert result.exit_code == 0
+    assert u'Validating 2 changed images' in result.output
+    assert u'All images exist' in result.output
+    assert sorted(resolver.resolved) == [u'application:latest', u'webserver:latest']
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_validate_images_fails_before_registration(get_client, runner, resolver):
+    client = EcsTestClient('acces_key', 'secret_key')
+    get_client.return_value = client
+    with patch.object(client, 'register_task_definition') as register_task_definition:
+        result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '-i', 'webserver', 'webserver:typo',
+                                            '--validate-images'))
+    assert result.exit_code == 1
+    assert u'Unable to resolve 1 of 1 images:\n- Image not found: webserver:typo' in result.output
+    assert not register_task_definition.called
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_update_validate_images_without_changed_images(get_client, runner, resolver):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.update, (TASK_DEFINITION_ARN_1, '-e', 'webserver', 'foo', 'bar', '--validate-images'))
+    assert result.exit_code == 0
+    assert u'Validating' not in result.output
+    assert resolver.resolved == []
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_deploy_pin_digests(get_client, runner, resolver):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.deploy, (CLUSTER_NAME, SERVICE_NAME, '-t', 'latest', '--validate-images',
+                                        '--pin-digests'))
+    assert result.exit_code == 0
+    assert u'Pinning 2 images to their digests' in result.output
+    assert u'Changed image of container "webserver" to: "webserver@sha256:abc" (was: "webserver:123")' \
+        in result.output
+    assert u'Changed image of container "application" to: "application@sha256:def" (was: "application:123")' \
+        in result.output
+    # validated images are not resolved again
+    assert sorted(resolver.resolved) == [u'application:latest', u'webserver:latest']
+
+
+@patch('ecs_deploy.cli.get_client')
+def test_update_pin_digests_with_unknown_image(get_client, runner, resolver):
+    get_client.return_value = EcsTestClient('acces_key', 'secret_key')
+    result = runner.invoke(cli.update, (TASK_DEFINITION_ARN_1, '--pin-digests'))
+    assert result.exit_code == 1
+    assert u'Unable to resolve 2 of 2 images' in result.output
@@ -0,0 +1,359 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from ecs_deploy import cli
+from ecs_deploy.ecs import clear_client_pool, clear_task_definition_cache
+from ecs_deploy.registry import clear_digest_cache
+from tests.fake_aws import FakeAwsBackend, FakeAwsServer
+from tests.fake_registry import FakeRegistryServer
+
+CLUSTER = u'test-cluster'
+SERVICE = u'test-service'
+FAMILY = u'test-task'
+
+
+@pytest.fixture
+def backend(request):
+    backend = FakeAwsBackend(rollout_polls=3, **getattr(request, 'param', {}))
+    backend.create_service(CLUSTER, SERVICE, FAMILY, desired_count=250)
+    return backend
+
+
+@pytest.fixture
+def runner(backend, monkeypatch):
+    with FakeAwsServer(backend) as server:
+        for name, value in server.environ.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv('ECS_DEPLOY_CREDENTIAL_CACHE', '0')
+        clear_client_pool()
+        clear_task_definition_cache()
+        yield CliRunner()
+        clear_client_pool()
+        clear_task_definition_cache()
+
+
+def test_deploy(backend, runner):
+    result = runner.invoke(cli.deploy, (CLUSTER, SERVICE, '-t', 'v2', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Deployment successful' in result.output
+    service = backend.services[(CLUSTER, SERVICE)]
+    assert service[u'taskDefinition'].endswith(u'task-definition/test-task:2')
+    assert len(service[u'deployments']) == 1
+    assert backend.task_definitions[(FAMILY, 1)][u'status'] == u'INACTIVE'
+    assert len(backend.get_service_tasks(CLUSTER, SERVICE)) == 250
+    assert backend.calls[u'RegisterTaskDefinition'] == 1
+    # revisions are only tagged with --reuse-task-definition (requires ecs:TagResource)
+    assert backend.task_definitions[(FAMILY, 2)][u'tags'] == []
+    assert backend.calls[u'UpdateService'] == 1
+    # 250 tasks are listed in pages and inspected in chunks of 100, once the rollout finished
+    assert backend.calls[u'ListTasks'] == 3
+    assert backend.calls[u'DescribeTasks'] == 3
+
+
+@pytest.mark.parametrize('backend', [{'latency': 0.01, 'max_calls_per_second': 5}], indirect=True)
+def test_deploy_with_throttling_and_latency(backend, runner, tmp_path):
+    metrics_file = str(tmp_path / 'metrics.json')
+    result = runner.invoke(cli.ecs, ('--metrics-file', metrics_file,
+                                     'deploy', CLUSTER, SERVICE, '-t', 'v2', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Deployment successful' in result.output
+
+    # throttled calls are retried by botocore
+    throttled_calls = sum(backend.throttled_calls.values())
+    assert throttled_calls > 0
+    with open(metrics_file) as f:
+        metrics = json.load(f)
+    assert metrics[u'throttled'] == throttled_calls
+    assert metrics[u'retries'] == throttled_calls
+    assert metrics[u'operations'][u'ecs.DescribeServices'][u'min'] >= 0.01
+
+
+def test_scale(backend, runner):
+    result = runner.invoke(cli.scale, (CLUSTER, SERVICE, '20', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Scaling successful' in result.output
+    assert len(backend.get_service_tasks(CLUSTER, SERVICE)) == 20
+
+
+def test_run(backend, runner):
+    result = runner.invoke(cli.run, (CLUSTER, FAMILY, '2'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Successfully started 2 instances of task: test-task:1' in result.output
+    assert backend.calls[u'RunTask'] == 1
+
+
+def test_run_wait(backend, runner):
+    result = runner.invoke(cli.run, (CLUSTER, FAMILY, '250', '--wait', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Waiting for 250 tasks to stop' in result.output
+    assert u'- webserver: exit code 0' in result.output
+    assert u'All 250 tasks succeeded' in result.output
+    # 2 polls, each describing the 250 tasks in 3 batches
+    assert backend.calls[u'DescribeTasks'] == 6
+
+
+@pytest.mark.parametrize('backend', [{'task_exit_code': 3}], indirect=True)
+def test_run_wait_with_failed_tasks(backend, runner):
+    result = runner.invoke(cli.run, (CLUSTER, FAMILY, '2', '--wait', '--sleep-time', '0'))
+
+    assert result.exit_code == 3
+    assert u'Essential container in task exited' in result.output
+    assert u'- webserver: exit code 3' in result.output
+    assert u'2 of 2 tasks failed' in result.output
+
+
+@pytest.mark.parametrize('backend', [{'run_task_capacity': 1}], indirect=True)
+def test_run_wait_with_tasks_not_started(backend, runner):
+    result = runner.invoke(cli.run, (CLUSTER, FAMILY, '3', '--wait', '--sleep-time', '0'))
+
+    assert result.exit_code == 1
+    assert u'Failed to start 2 instances of task: test-task:1' in result.output
+    assert u'- RESOURCE:MEMORY' in result.output
+    assert u'- webserver: exit code 0' in result.output
+    assert u'Only 1 of 3 tasks started' in result.output
+
+
+def test_cron(backend, runner):
+    backend.create_rule(u'nightly', CLUSTER, backend.task_definitions[(FAMILY, 1)][u'taskDefinitionArn'])
+
+    result = runner.invoke(cli.cron, (CLUSTER, FAMILY, u'nightly', '-t', 'v2'))
+
+    assert result.exit_code == 0, result.output
+    target = backend.rules[u'nightly'][0]
+    assert target[u'EcsParameters'][u'TaskDefinitionArn'].endswith(u'task-definition/test-task:2')
+    assert backend.calls[u'PutTargets'] == 1
+
+
+def test_cron_updates_all_matching_targets_of_all_rules(backend, runner):
+    revision_1 = backend.task_definitions[(FAMILY, 1)][u'taskDefinitionArn']
+    other = backend.create_task_definition(u'other-task')[u'taskDefinitionArn']
+    for rule in (u'nightly-report', u'nightly-cleanup', u'hourly-sync'):
+        backend.create_rule(rule, CLUSTER, revision_1)
+        for i in range(2, 13):
+            backend.add_target(rule, CLUSTER, revision_1, u'target-%d' % i)
+    backend.add_target(u'nightly-report', CLUSTER, other, u'other-target')
+
+    result = runner.invoke(cli.cron, (CLUSTER, FAMILY, u'hourly-sync', '--rule-prefix', u'nightly-', '-t', 'v2'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Updating 3 scheduled tasks' in result.output
+    assert u'Successfully updated scheduled task nightly-report (12 targets)' in result.output
+    for rule in (u'nightly-report', u'nightly-cleanup', u'hourly-sync'):
+        targets = [target for target in backend.rules[rule] if target[u'Id'] != u'other-target']
+        assert len(targets) == 12
+        for target in targets:
+            assert target[u'EcsParameters'][u'TaskDefinitionArn'].endswith(u'task-definition/test-task:2')
+    other_target = [target for target in backend.rules[u'nightly-report'] if target[u'Id'] == u'other-target'][0]
+    assert other_target[u'EcsParameters'][u'TaskDefinitionArn'] == other
+    # 12 targets per rule need 2 batches of at most 10 targets
+    assert backend.calls[u'PutTargets'] == 6
+
+
+def test_cron_skips_listed_rules_of_other_families(backend, runner):
+    revision_1 = backend.task_definitions[(FAMILY, 1)][u'taskDefinitionArn']
+    other = backend.create_task_definition(u'other-task')[u'taskDefinitionArn']
+    backend.create_rule(u'nightly-report', CLUSTER, revision_1)
+    backend.create_rule(u'nightly-cleanup', CLUSTER, other)
+    backend.create_rule(u'hourly-sync', CLUSTER, other)
+
+    result = runner.invoke(cli.cron, (CLUSTER, FAMILY, u'hourly-sync', '--rule-prefix', u'nightly-', '-t', 'v2'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Skipped scheduled task nightly-cleanup (no targets of test-task)' in result.output
+    assert backend.rules[u'nightly-cleanup'][0][u'EcsParameters'][u'TaskDefinitionArn'] == other
+    # a rule given by name gets its first target updated, as before
+    for rule in (u'nightly-report', u'hourly-sync'):
+        assert backend.rules[rule][0][u'EcsParameters'][u'TaskDefinitionArn'].endswith(u'task-definition/test-task:2')
+
+
+def test_cron_discover(backend, runner, monkeypatch, tmp_path):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path))
+    revision_1 = backend.task_definitions[(FAMILY, 1)][u'taskDefinitionArn']
+    other = backend.create_task_definition(u'other-task')[u'taskDefinitionArn']
+    for i in range(30):
+        backend.create_rule(u'rule-%02d' % i, CLUSTER, revision_1 if i % 3 == 0 else other)
+
+    result = runner.invoke(cli.cron, (CLUSTER, FAMILY, '--discover', '-t', 'v2', '--no-deregister'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Updating 10 scheduled tasks' in result.output
+    arns = [backend.rules[u'rule-%02d' % i][0][u'EcsParameters'][u'TaskDefinitionArn'] for i in range(30)]
+    assert all(arn.endswith(u'task-definition/test-task:2') for arn in arns[::3])
+    assert arns.count(other) == 20
+    assert backend.calls[u'ListRules'] == 1
+    assert backend.calls[u'ListTargetsByRule'] == 40
+
+    # the second run uses the cached index
+    result = runner.invoke(cli.cron, (CLUSTER, FAMILY, '--discover', '-t', 'v3', '--no-deregister'))
+
+    assert result.exit_code == 0, result.output
+    assert backend.calls[u'ListRules'] == 1
+    assert backend.calls[u'ListTargetsByRule'] == 50
+
+
+def test_unknown_service(runner):
+    result = runner.invoke(cli.deploy, (CLUSTER, u'unknown', '-t', 'v2'))
+
+    assert result.exit_code == 1
+    assert u'Service not found' in result.output
+
+
+def test_deploy_with_metrics(backend, runner, tmp_path):
+    metrics_file = str(tmp_path / 'metrics.json')
+    result = runner.invoke(cli.ecs, ('--metrics', '--metrics-file', metrics_file,
+                                     'deploy', CLUSTER, SERVICE, '-t', 'v2', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    assert u'API calls: %d' % backend.total_calls in result.output
+    assert u'- ecs.DescribeServices: %d calls' % backend.calls[u'DescribeServices'] in result.output
+
+    with open(metrics_file) as f:
+        metrics = json.load(f)
+    assert metrics[u'calls'] == backend.total_calls
+    assert metrics[u'operations'][u'ecs.UpdateService'][u'calls'] == 1
+    assert sum(metrics[u'operations'][u'ecs.ListTasks'][u'histogram'].values()) == 3
+
+
+def test_gc(backend, runner):
+    for _ in range(20):
+        backend.create_task_definition(FAMILY)
+    backend.create_task_definition(FAMILY + u'-other')
+    backend.create_rule(u'nightly', CLUSTER, backend.task_definitions[(FAMILY, 2)][u'taskDefinitionArn'])
+
+    result = runner.invoke(cli.gc, (FAMILY, '--keep', '5', '--rate', '1000'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Found 21 active revisions of test-task: keeping 5 newest and 2 in use' in result.output
+    assert u'Deregistered 14 revisions' in result.output
+    active = sorted(revision for (family, revision), td in backend.task_definitions.items()
+                    if family == FAMILY and td[u'status'] == u'ACTIVE')
+    # revision 1 is used by the service, revision 2 by the rule
+    assert active == [1, 2, 17, 18, 19, 20, 21]
+    assert backend.task_definitions[(FAMILY + u'-other', 1)][u'status'] == u'ACTIVE'
+
+
+@pytest.mark.parametrize(u'rate', ('0', '-1'))
+def test_gc_rejects_invalid_rate(backend, runner, rate):
+    backend.create_task_definition(FAMILY)
+
+    result = runner.invoke(cli.gc, (FAMILY, '--rate', rate))
+
+    assert result.exit_code == 2
+    assert u'Invalid value for \'--rate\'' in result.output
+    assert backend.calls[u'DeregisterTaskDefinition'] == 0
+
+
+def test_gc_dry_run(backend, runner):
+    for _ in range(3):
+        backend.create_task_definition(FAMILY)
+
+    result = runner.invoke(cli.gc, (FAMILY, '--keep', '1', '--cluster', CLUSTER, '--dry-run'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Would deregister 2 revisions:' in result.output
+    assert u'task-definition/test-task:2\n' in result.output
+    assert u'task-definition/test-task:3\n' in result.output
+    assert backend.calls[u'DeregisterTaskDefinition'] == 0
+
+
+def test_deploy_reuses_task_definition(backend, runner):
+    deploy = (CLUSTER, SERVICE, '--sleep-time', '0', '--reuse-task-definition')
+    assert runner.invoke(cli.deploy, deploy + ('-t', 'v2')).exit_code == 0
+    assert runner.invoke(cli.deploy, deploy + ('-t', 'v3', '--no-deregister')).exit_code == 0
+    backend.reset_calls()
+
+    result = runner.invoke(cli.deploy, deploy + ('-t', 'v2'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Reusing task definition revision with the same definition: 2' in result.output
+    assert backend.calls[u'RegisterTaskDefinition'] == 0
+    assert backend.services[(CLUSTER, SERVICE)][u'taskDefinition'].endswith(u'task-definition/test-task:2')
+    assert backend.task_definitions[(FAMILY, 3)][u'status'] == u'INACTIVE'
+
+    backend.reset_calls()
+    result = runner.invoke(cli.deploy, deploy + ('-t', 'v2'))
+
+    assert result.exit_code == 0, result.output
+    assert u'Reusing unchanged task definition revision: 2' in result.output
+    assert backend.calls[u'RegisterTaskDefinition'] == 0
+    assert backend.calls[u'ListTaskDefinitions'] == 0
+    assert backend.task_definitions[(FAMILY, 2)][u'status'] == u'ACTIVE'
+
+
+def test_deploy_does_not_reuse_revision_deregistered_by_another_process(backend, runner):
+    deploy = (CLUSTER, SERVICE, '--sleep-time', '0', '--reuse-task-definition', '-t', 'v2')
+    assert runner.invoke(cli.deploy, deploy).exit_code == 0
+    # describes and caches the revision
+    assert u'Reusing unchanged task definition revision: 2' in runner.invoke(cli.deploy, deploy).output
+    # e.g. deregistered by ecs gc, while the revision is still cached as active
+    backend.task_definitions[(FAMILY, 2)][u'status'] = u'INACTIVE'
+
+    result = runner.invoke(cli.deploy, deploy)
+
+    assert result.exit_code == 0, result.output
+    assert u'Reusing' not in result.output
+    assert u'Successfully created revision: 3' in result.output
+    assert backend.services[(CLUSTER, SERVICE)][u'taskDefinition'].endswith(u'task-definition/test-task:3')
+
+
+def test_deploy_many(backend, runner, tmp_path):
+    services = [u'service-%d' % index for index in range(30)]
+    for service in services:
+        backend.create_service(CLUSTER, service, FAMILY, desired_count=2)
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([{u'cluster': CLUSTER, u'service': service} for service in services]))
+
+    result = runner.invoke(cli.deploy_many, (str(manifest), '-t', 'v2', '--concurrency', '30', '--sleep-time', '0'))
+
+    assert result.exit_code == 0, result.output
+    for service in services:
+        assert u'- %s/%s: Deployed test-task:' % (CLUSTER, service) in result.output
+        assert len(backend.services[(CLUSTER, service)][u'deployments']) == 1
+
+
+def test_deploy_validates_images(backend, runner):
+    with FakeRegistryServer() as registry:
+        clear_digest_cache()
+        image = registry.host + u'/webserver'
+        registry.registry.push(u'webserver', u'v2')
+        backend.create_service(CLUSTER, u'registry-service', u'registry-task',
+                               containers=[{u'name': u'webserver', u'image': image + u':v1'}])
+        deploy = (CLUSTER, u'registry-service', '--validate-images', '--sleep-time', '0')
+
+        result = runner.invoke(cli.deploy, deploy + ('-t', 'v3'))
+
+        assert result.exit_code == 1
+        assert u'Image not found: %s:v3' % image in result.output
+        assert backend.calls[u'RegisterTaskDefinition'] == 0
+        assert backend.calls[u'UpdateService'] == 0
+
+        result = runner.invoke(cli.deploy, deploy + ('-t', 'v2'))
+
+        assert result.exit_code == 0, result.output
+        assert backend.calls[u'RegisterTaskDefinition'] == 1
+        clear_digest_cache()
+
+
+def test_deploy_pins_digests(backend, runner):
+    with FakeRegistryServer() as registry:
+        clear_digest_cache()
+        image = registry.host + u'/webserver'
+        digest = registry.registry.push(u'webserver', u'v2')
+        backend.create_service(CLUSTER, u'registry-service', u'registry-task',
+                               containers=[{u'name': u'webserver', u'image': image + u':v1'}])
+
+        result = runner.invoke(cli.deploy, (CLUSTER, u'registry-service', '-t', 'v2', '--pin-digests',
+                                            '--sleep-time', '0'))
+
+        assert result.exit_code == 0, result.output
+        task_definition = backend.task_definitions[(u'registry-task', 2)]
+        assert task_definition[u'containerDefinitions'][0][u'image'] == u'%s@%s' % (image, digest)
+        assert registry.registry.requests[(u'webserver', u'v2')] == 1
+        clear_digest_cache()
@@ -5,16 +5,23 @@ import pytest
 import tempfile
 import os
 import logging
+from threading import Event, Thread
 from boto3.session import Session
 from botocore.exceptions import ClientError, NoCredentialsError
 from dateutil.tz import tzlocal
-from mock.mock import patch, call, Mock
+from mock.mock import patch, call, Mock, ANY
 
 from ecs_deploy.ecs import EcsService, EcsTaskDefinition, \
     UnknownContainerError, EcsTaskDefinitionDiff, EcsClient, \
     EcsAction, EcsConnectionError, DeployAction, ScaleAction, RunAction, \
     EcsTaskDefinitionCommandError, UnknownTaskDefinitionError, LAUNCH_TYPE_EC2, read_env_file, EcsDeployment, \
-    EcsDeploymentError
+    EcsDeploymentError, ServiceStatusAggregator, clear_client_pool, get_session, GarbageCollectAction, \
+    clear_task_definition_cache, merge_by_key, FINGERPRINT_TAG_KEY, RateLimiter, get_family, paginate, EventMatcher, \
+    EventCursor, EcsServiceSnapshot, EcsDeploymentSnapshot, TaskDefinitionChangeSet, CronAction, EcsError, EcsTask, \
+    get_cache_scope, get_source_identity, get_boto_client
+from ecs_deploy import ecs as ecs_module
+from ecs_deploy.cache import RuleIndexCache
+from ecs_deploy.envfile import iter_env_file
 
 CLUSTER_NAME = u'test-cluster'
 CLUSTER_ARN = u'arn:aws:ecs:eu-central-1:123456789012:cluster/%s' % CLUSTER_NAME
@@ -413,6 +420,16 @@ RESPONSE_DESCRIBE_TASKS = {
 }
 
 
+@pytest.fixture(autouse=True)
+def client_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path / 'cache'))
+    clear_client_pool()
+    clear_task_definition_cache()
+    yield
+    clear_client_pool()
+    clear_task_definition_cache()
+
+
 @pytest.fixture()
 def task_definition():
     return EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
@@ -493,6 +510,55 @@ def test_service_older_errors(service_with_errors):
     assert len(service_with_errors.older_errors) == 1
 
 
+def test_service_snapshot_matches_service():
+    payload = deepcopy(PAYLOAD_SERVICE_WITH_ERRORS)
+    service = EcsService(CLUSTER_NAME, deepcopy(payload))
+    snapshot = EcsServiceSnapshot(CLUSTER_NAME, payload)
+
+    for name in (u'cluster', u'name', u'task_definition', u'desired_count', u'deployment_created_at',
+                 u'deployment_updated_at', u'errors', u'older_errors'):
+        assert getattr(snapshot, name) == getattr(service, name)
+    assert snapshot.primary_deployment.running_count == service.primary_deployment.running_count
+    assert snapshot.active_deployment.is_active == service.active_deployment.is_active
+    assert snapshot[u'deployments'] == service[u'deployments']
+    assert snapshot.get(u'unknown', u'default') == u'default'
+    assert u'events' in snapshot
+
+
+def test_service_snapshot_is_compact_and_lazy():
+    payload = deepcopy(PAYLOAD_SERVICE)
+    snapshot = EcsServiceSnapshot(CLUSTER_NAME, payload)
+
+    assert not hasattr(snapshot, '__dict__')
+    assert snapshot._deployment_snapshots is None
+    assert snapshot[u'deployments'] is payload[u'deployments']
+
+    primary_deployment = snapshot.primary_deployment
+    assert isinstance(primary_deployment, EcsDeploymentSnapshot)
+    assert not hasattr(primary_deployment, '__dict__')
+    assert snapshot._deployments is snapshot._deployments
+
+
+def test_service_snapshot_is_read_only():
+    snapshot = EcsServiceSnapshot(CLUSTER_NAME, deepcopy(PAYLOAD_SERVICE))
+    with pytest.raises(TypeError):
+        snapshot[u'taskDefinition'] = TASK_DEFINITION_ARN_2
+    with pytest.raises(AttributeError):
+        snapshot.set_task_definition
+
+
+@patch.object(EcsClient, '__init__')
+def test_get_service_snapshot(client):
+    client.describe_services.return_value = {u'services': [deepcopy(PAYLOAD_SERVICE)]}
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+
+    snapshot = action.get_service_snapshot()
+
+    assert isinstance(snapshot, EcsServiceSnapshot)
+    assert snapshot.name == SERVICE_NAME
+    assert isinstance(action.service, EcsService)
+
+
 def test_task_family(task_definition):
     assert task_definition.family == TASK_DEFINITION_FAMILY_1
 
@@ -533,6 +599,33 @@ def test_task_set_tag(task_definition):
         assert container[u'image'].endswith(u':foobar')
 
 
+def test_task_set_tag_of_pinned_image(task_definition):
+    task_definition.pin_images({u'webserver:123': u'webserver@sha256:abc'})
+    task_definition.set_images(u'foobar')
+    assert task_definition.containers_by_name[u'webserver'][u'image'] == u'webserver:foobar'
+
+
+def test_task_pin_images(task_definition):
+    task_definition.pin_images({u'webserver:123': u'webserver@sha256:abc'})
+
+    assert task_definition.containers_by_name[u'webserver'][u'image'] == u'webserver@sha256:abc'
+    assert task_definition.containers_by_name[u'application'][u'image'] == u'application:123'
+    assert len(task_definition.diff) == 1
+    assert task_definition.diff[0].value == u'webserver@sha256:abc'
+    assert task_definition.diff[0].old_value == u'webserver:123'
+
+
+def test_task_pin_changed_images(task_definition):
+    task_definition.set_images(u'latest')
+    task_definition.pin_images({u'webserver:latest': u'webserver@sha256:abc'})
+
+    assert task_definition.containers_by_name[u'webserver'][u'image'] == u'webserver@sha256:abc'
+    image_diffs = [diff for diff in task_definition.diff if diff.container == u'webserver']
+    assert len(image_diffs) == 1
+    assert image_diffs[0].value == u'webserver@sha256:abc'
+    assert image_diffs[0].old_value == u'webserver:123'
+
+
 def test_task_set_image(task_definition):
     task_definition.set_images(webserver=u'new-image:123', application=u'app-image:latest')
     for container in task_definition.containers:
@@ -637,6 +730,18 @@ def test_read_env_file_wrong_env_format():
     assert l == ()
 
 
+def test_read_env_file_is_parsed_once_for_several_containers(task_definition, tmp_path):
+    path = tmp_path / 'shared.env'
+    path.write_text(u'export SHARED="value"\nSHARED=last\n')
+
+    with patch('ecs_deploy.envfile.iter_env_file', wraps=iter_env_file) as parser:
+        task_definition.set_environment((), env_file=((u'webserver', str(path)), (u'application', str(path))))
+
+    assert parser.call_count == 1
+    assert {u'name': u'SHARED', u'value': u'last'} in task_definition.containers[0][u'environment']
+    assert task_definition.containers[1][u'environment'] == [{u'name': u'SHARED', u'value': u'last'}]
+
+
 def test_env_file_wrong_file_name():
     with pytest.raises(EcsTaskDefinitionCommandError):
         read_env_file('webserver', 'WrongFileName')
@@ -927,6 +1032,84 @@ def test_task_set_mount_points(task_definition):
            task_definition.containers[0]['mountPoints']
 
 
+def test_task_set_port_mappings_keeps_order(task_definition):
+    task_definition.set_port_mappings(((u'webserver', 9000 + port, port) for port in range(300, 0, -1)))
+
+    ports = [mapping['containerPort'] for mapping in task_definition.containers[0]['portMappings']]
+    assert ports == [8080] + [9000 + port for port in range(300, 0, -1)]
+
+
+def test_merge_by_key():
+    old = [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 2}]
+    new = [{'name': 'c', 'value': 3}, {'name': 'a', 'value': 4}, {'name': 'c', 'value': 5}]
+
+    assert merge_by_key(old, new, 'name') == [
+        {'name': 'a', 'value': 4}, {'name': 'b', 'value': 2}, {'name': 'c', 'value': 5}
+    ]
+    assert old == [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 2}]
+
+
+def test_task_containers_by_name(task_definition):
+    assert sorted(task_definition.containers_by_name) == [u'application', u'webserver']
+    assert task_definition.containers_by_name[u'webserver'] is task_definition.containers[0]
+
+    task_definition.add_containers([u'sidecar'])
+    assert u'sidecar' in task_definition.containers_by_name
+
+    task_definition.remove_containers([u'application'])
+    assert sorted(task_definition.containers_by_name) == [u'sidecar', u'webserver']
+    with pytest.raises(UnknownContainerError):
+        task_definition.set_images(application=u'application:456')
+
+
+def test_task_apply_changes(task_definition):
+    changes = TaskDefinitionChangeSet() \
+        .set_images(u'v2', application=u'application:456') \
+        .set_environment(((u'webserver', u'foo', u'baz'), (u'application', u'new', u'value'))) \
+        .set_port_mappings(((u'webserver', 81, 80),)) \
+        .set_privileged(webserver=True) \
+        .set_task_memory(1024) \
+        .set_role_arn(u'arn:new:role')
+
+    diffs = task_definition.apply_changes(changes)
+
+    assert [(diff.container, diff.field) for diff in diffs] == [
+        (u'webserver', u'image'),
+        (u'webserver', u'privileged'),
+        (u'webserver', u'environment'),
+        (u'webserver', u'portMappings'),
+        (u'application', u'image'),
+        (u'application', u'environment'),
+        (None, u'memory'),
+        (None, u'role_arn'),
+    ]
+    assert diffs == task_definition.diff
+    assert task_definition.containers[0][u'image'] == u'webserver:v2'
+    assert task_definition.containers[1][u'image'] == u'application:456'
+    assert {u'name': u'foo', u'value': u'baz'} in task_definition.containers[0][u'environment']
+    assert task_definition.containers[1][u'environment'] == [{u'name': u'new', u'value': u'value'}]
+    assert task_definition.memory == u'1024'
+    assert task_definition.role_arn == u'arn:new:role'
+
+
+def test_task_apply_changes_validates_containers_first(task_definition):
+    changes = TaskDefinitionChangeSet().set_images(webserver=u'webserver:456').set_cpu(unknown=10)
+
+    with pytest.raises(UnknownContainerError):
+        task_definition.apply_changes(changes)
+
+    assert task_definition.containers[0][u'image'] == u'webserver:123'
+    assert not task_definition.diff
+
+
+def test_task_apply_changes_with_added_container(task_definition):
+    changes = TaskDefinitionChangeSet().add_containers([u'sidecar']).set_images(sidecar=u'sidecar:1')
+
+    task_definition.apply_changes(changes)
+
+    assert task_definition.containers_by_name[u'sidecar'][u'image'] == u'sidecar:1'
+
+
 def test_task_set_task_cpu(task_definition):
     assert task_definition.cpu is None
     task_definition.set_task_cpu(256)
@@ -1136,6 +1319,35 @@ def test_task_get_overrides_secrets(task_definition):
     assert secrets[0] == dict(name='foo', valueFrom='bar')
 
 
+def test_task_definition_fingerprint_ignores_order(task_definition):
+    reordered = EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
+    reordered.containers.reverse()
+    for container in reordered.containers:
+        container[u'environment'] = tuple(reversed(container[u'environment']))
+    reordered.tags = [{u'key': FINGERPRINT_TAG_KEY, u'value': u'outdated'}]
+
+    assert reordered.fingerprint == task_definition.fingerprint
+
+
+def test_task_definition_fingerprint_changes_with_definition(task_definition):
+    fingerprint = task_definition.fingerprint
+    task_definition.set_images(tag=u'v2')
+
+    assert task_definition.fingerprint != fingerprint
+
+
+def test_task_definition_tags_with_fingerprint(task_definition):
+    task_definition.tags = [{u'key': u'team', u'value': u'a'}, {u'key': FINGERPRINT_TAG_KEY, u'value': u'outdated'}]
+
+    assert task_definition.get_tags_with_fingerprint() == [
+        {u'key': u'team', u'value': u'a'},
+        {u'key': FINGERPRINT_TAG_KEY, u'value': task_definition.fingerprint},
+    ]
+    assert task_definition.get_tags_without_fingerprint() == [{u'key': u'team', u'value': u'a'}]
+    assert task_definition.get_tag(u'team') == u'a'
+    assert task_definition.get_tag(u'unknown') is None
+
+
 def test_task_definition_diff():
     diff = EcsTaskDefinitionDiff(u'webserver', u'image', u'new', u'old')
     assert str(diff) == u'Changed image of container "webserver" to: "new" (was: "old")'
@@ -1146,23 +1358,34 @@ def test_task_definition_diff():
 def test_client_init(mocked_init, mocked_client):
     mocked_init.return_value = None
 
-    EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile', u'session_token')
+    client = EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile', u'session_token')
 
     mocked_init.assert_called_once_with(aws_access_key_id=u'access_key_id',
                                         aws_secret_access_key=u'secret_access_key',
                                         profile_name=u'profile',
                                         region_name=u'region',
                                         aws_session_token=u'session_token')
-    mocked_client.assert_any_call(u'ecs')
-    mocked_client.assert_any_call(u'events')
+    mocked_client.assert_called_once_with(u'ecs', config=ANY)
+    assert mocked_client.call_args[1]['config'].max_pool_connections == 50
+
+    client.events
+    mocked_client.assert_called_with(u'events', config=ANY)
+
+
+ROLE_CREDENTIALS = {
+    'AccessKeyId': 'sts-key',
+    'SecretAccessKey': 'sts-secret',
+    'SessionToken': 'sts-token',
+    'Expiration': datetime(2100, 1, 1, tzinfo=tzlocal()),
+}
 
 
 @patch.object(Session, 'client')
 @patch.object(Session, '__init__')
-@patch.object(EcsClient, 'assume_role')
-def test_client_init_assuming_role(assume_role_mock, mocked_init, mocked_client):
+@patch.object(EcsClient, 'get_role_credentials')
+def test_client_init_assuming_role(get_role_credentials, mocked_init, mocked_client):
     mocked_init.return_value = None
-    assume_role_mock.return_value = 'sts-key', 'sts-secret', 'sts-token'
+    get_role_credentials.return_value = ROLE_CREDENTIALS
 
     EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile',
               assume_account='1234567890', assume_role='DeployRole')
@@ -1172,8 +1395,78 @@ def test_client_init_assuming_role(assume_role_mock, mocked_init, mocked_client)
                                         profile_name=None,
                                         region_name=u'region',
                                         aws_session_token=u'sts-token')
-    mocked_client.assert_any_call(u'ecs')
-    mocked_client.assert_any_call(u'events')
+    mocked_client.assert_called_once_with(u'ecs', config=ANY)
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_init_reuses_pooled_session_and_clients(mocked_init, mocked_client):
+    mocked_init.return_value = None
+
+    client_a = EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile')
+    client_b = EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile')
+    EcsClient(u'access_key_id', u'secret_access_key', u'other-region', u'profile')
+
+    assert client_a.boto is client_b.boto
+    assert client_a.events is client_b.events
+    assert mocked_init.call_count == 2
+    assert mocked_client.call_count == 3
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+@patch.object(EcsClient, 'get_role_credentials')
+def test_client_init_reuses_assumed_role_session(get_role_credentials, mocked_init, mocked_client):
+    mocked_init.return_value = None
+    get_role_credentials.return_value = ROLE_CREDENTIALS
+
+    EcsClient(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+    EcsClient(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+    EcsClient(region=u'region', assume_account='1234567890', assume_role='OtherRole')
+
+    assert get_role_credentials.call_count == 2
+
+
+@patch('ecs_deploy.ecs.time')
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+@patch.object(EcsClient, 'get_role_credentials')
+def test_client_init_renews_expired_assumed_role_session(get_role_credentials, mocked_init, mocked_client,
+                                                         mocked_time):
+    mocked_init.return_value = None
+    mocked_time.return_value = 1000
+    get_role_credentials.return_value = dict(ROLE_CREDENTIALS, Expiration='1970-01-01T01:00:00Z')
+
+    get_session(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+    get_session(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+    mocked_time.return_value = 3600 - 300
+    get_session(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+
+    assert get_role_credentials.call_count == 2
+
+
+@patch('ecs_deploy.ecs.time')
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+@patch.object(EcsClient, 'get_role_credentials')
+def test_renewing_expired_session_evicts_its_clients(get_role_credentials, mocked_init, mocked_client, mocked_time):
+    mocked_init.return_value = None
+    mocked_client.side_effect = lambda *args, **kwargs: Mock()
+    mocked_time.return_value = 1000
+    get_role_credentials.return_value = dict(ROLE_CREDENTIALS, Expiration='1970-01-01T01:00:00Z')
+    other_session = get_session(region=u'region')
+    other_client = get_boto_client(other_session, u'ecs')
+
+    expired_session = get_session(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+    expired_client = get_boto_client(expired_session, u'ecs')
+    get_boto_client(expired_session, u'events')
+    mocked_time.return_value = 3600
+    session = get_session(region=u'region', assume_account='1234567890', assume_role='DeployRole')
+
+    assert session is not expired_session
+    assert [key for key in ecs_module._clients if key[0] is expired_session] == []
+    assert get_boto_client(session, u'ecs') is not expired_client
+    assert get_boto_client(other_session, u'ecs') is other_client
 
 
 @patch.object(Session, 'client')
@@ -1206,6 +1499,72 @@ def test_client_assume_role(session_mock, mocked_client):
     assert token == 'sts-token'
 
 
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_assume_role_from_credential_cache(session_mock, mocked_client):
+    sts = Mock()
+    mocked_client.return_value = sts
+    session_mock.return_value = None
+    sts.assume_role.return_value = {'Credentials': ROLE_CREDENTIALS}
+
+    EcsClient.assume_role('key', 'secret', 'region', 'profile', 'token', '1234567890', 'MyRole')
+    clear_client_pool()
+    key, secret, token = EcsClient.assume_role('key', 'secret', 'region', 'profile', 'token', '1234567890', 'MyRole')
+    EcsClient.assume_role('key', 'secret', 'region', 'profile', 'token', '1234567890', 'OtherRole')
+
+    assert sts.assume_role.call_count == 2
+    assert (key, secret, token) == ('sts-key', 'sts-secret', 'sts-token')
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_assume_role_credential_cache_by_source_identity(session_mock, mocked_client, resolved_identity):
+    sts = Mock()
+    mocked_client.return_value = sts
+    session_mock.return_value = None
+    sts.assume_role.return_value = {'Credentials': ROLE_CREDENTIALS}
+
+    # e.g. different AWS_ACCESS_KEY_ID or AWS_PROFILE environment variables
+    resolved_identity.return_value = (u'default', u'AKIA1')
+    EcsClient.assume_role(region='region', assume_account='1234567890', assume_role='MyRole')
+    clear_client_pool()
+    resolved_identity.return_value = (u'other', u'AKIA2')
+    EcsClient.assume_role(region='region', assume_account='1234567890', assume_role='MyRole')
+    clear_client_pool()
+    resolved_identity.return_value = (u'default', u'AKIA1')
+    EcsClient.assume_role(region='region', assume_account='1234567890', assume_role='MyRole')
+
+    assert sts.assume_role.call_count == 2
+
+
+def test_get_source_identity():
+    session = Mock(profile_name=u'my-profile')
+    session.get_credentials.return_value.access_key = u'AKIA1'
+    assert get_source_identity(session) == (u'my-profile', u'AKIA1')
+
+    session.get_credentials.return_value = None
+    assert get_source_identity(session) == (u'my-profile', None)
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_assume_role_without_credential_cache(session_mock, mocked_client, monkeypatch):
+    monkeypatch.setenv('ECS_DEPLOY_CREDENTIAL_CACHE', 'off')
+    sts = Mock()
+    mocked_client.return_value = sts
+    session_mock.return_value = None
+    sts.assume_role.return_value = {'Credentials': ROLE_CREDENTIALS}
+
+    EcsClient.assume_role('key', 'secret', 'region', 'profile', 'token', '1234567890', 'MyRole')
+    EcsClient.assume_role('key', 'secret', 'region', 'profile', 'token', '1234567890', 'MyRole')
+
+    assert sts.assume_role.call_count == 2
+
+
+def get_test_cache_scope(session, account=None):
+    return u'%s|%s' % (id(session), account or u'')
+
+
 @pytest.fixture
 @patch.object(Session, 'client')
 @patch.object(Session, '__init__')
@@ -1214,17 +1573,138 @@ def client(mocked_init, mocked_client):
     return EcsClient(u'access_key_id', u'secret_access_key', u'region', u'profile', u'session_token')
 
 
+@pytest.fixture(autouse=True)
+def resolved_identity():
+    # sessions with a mocked __init__ can not resolve their region and credentials
+    with patch('ecs_deploy.ecs.get_cache_scope', side_effect=get_test_cache_scope), \
+            patch('ecs_deploy.ecs.get_source_identity', return_value=(u'default', u'key')) as get_source_identity:
+        yield get_source_identity
+
+
 def test_client_describe_services(client):
     client.describe_services(u'test-cluster', u'test-service')
     client.boto.describe_services.assert_called_once_with(cluster=u'test-cluster', services=[u'test-service'])
 
 
+def test_client_describe_services_batch(client):
+    client.describe_services_batch(u'test-cluster', (u'service-a', u'service-b'))
+    client.boto.describe_services.assert_called_once_with(cluster=u'test-cluster',
+                                                          services=[u'service-a', u'service-b'])
+
+
 def test_client_describe_task_definition(client):
     client.describe_task_definition(u'task_definition_arn')
     client.boto.describe_task_definition.assert_called_once_with(include=['TAGS'],
                                                                  taskDefinition=u'task_definition_arn')
 
 
+def test_client_describe_task_definition_from_cache(client):
+    client.boto.describe_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+
+    first = client.describe_task_definition(TASK_DEFINITION_ARN_1)
+    first[u'taskDefinition'][u'family'] = u'modified'
+    second = client.describe_task_definition(TASK_DEFINITION_ARN_1)
+
+    client.boto.describe_task_definition.assert_called_once_with(include=['TAGS'],
+                                                                 taskDefinition=TASK_DEFINITION_ARN_1)
+    assert second[u'taskDefinition'][u'family'] == TASK_DEFINITION_FAMILY_1
+
+
+def test_client_describe_task_definition_by_revision_from_cache(client):
+    client.boto.describe_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+    reference = u'%s:%s' % (TASK_DEFINITION_FAMILY_1, TASK_DEFINITION_REVISION_1)
+
+    client.describe_task_definition(reference)
+    client.describe_task_definition(reference)
+    client.describe_task_definition(TASK_DEFINITION_ARN_1)
+
+    assert client.boto.describe_task_definition.call_count == 1
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_describe_task_definition_by_revision_is_scoped(mocked_init, mocked_client, client):
+    mocked_init.return_value = None
+    other_client = EcsClient(u'access_key_id', u'secret_access_key', u'other-region')
+    client.boto.describe_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+    other_client.boto.describe_task_definition.return_value = {
+        u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)
+    }
+    reference = u'%s:%s' % (TASK_DEFINITION_FAMILY_1, TASK_DEFINITION_REVISION_1)
+
+    client.describe_task_definition(reference)
+    other_client.describe_task_definition(reference)
+
+    client.boto.describe_task_definition.assert_called_once()
+    other_client.boto.describe_task_definition.assert_called_once()
+
+
+def test_client_describe_task_definition_without_cache(client):
+    inactive = dict(deepcopy(PAYLOAD_TASK_DEFINITION_1), status=u'INACTIVE')
+    client.boto.describe_task_definition.side_effect = [
+        {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)},
+        {u'taskDefinition': inactive},
+    ]
+
+    client.describe_task_definition(TASK_DEFINITION_ARN_1)
+    fresh = client.describe_task_definition(TASK_DEFINITION_ARN_1, use_cache=False)
+
+    assert fresh[u'taskDefinition'][u'status'] == u'INACTIVE'
+    assert client.describe_task_definition(TASK_DEFINITION_ARN_1)[u'taskDefinition'][u'status'] == u'INACTIVE'
+    assert client.boto.describe_task_definition.call_count == 2
+
+
+def test_client_describe_task_definition_by_family_is_not_cached(client):
+    client.boto.describe_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+
+    client.describe_task_definition(TASK_DEFINITION_FAMILY_1)
+    client.describe_task_definition(TASK_DEFINITION_FAMILY_1)
+
+    assert client.boto.describe_task_definition.call_count == 2
+
+
+def test_client_deregister_task_definition_evicts_cache(client):
+    client.boto.describe_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+    client.boto.deregister_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+
+    client.describe_task_definition(TASK_DEFINITION_ARN_1)
+    client.deregister_task_definition(TASK_DEFINITION_ARN_1)
+    client.describe_task_definition(TASK_DEFINITION_ARN_1)
+
+    assert client.boto.describe_task_definition.call_count == 2
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_deregister_task_definition_evicts_all_revision_references(mocked_init, mocked_client, client):
+    mocked_init.return_value = None
+    other_client = EcsClient(u'access_key_id', u'secret_access_key', u'region', u'other-profile')
+    for ecs_client in (client, other_client):
+        ecs_client.boto.describe_task_definition.return_value = {
+            u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)
+        }
+    reference = u'%s:%s' % (TASK_DEFINITION_FAMILY_1, TASK_DEFINITION_REVISION_1)
+
+    client.describe_task_definition(reference)
+    other_client.describe_task_definition(reference)
+    client.boto.deregister_task_definition.return_value = {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1)}
+    client.deregister_task_definition(reference)
+    other_client.describe_task_definition(reference)
+
+    assert client.boto.describe_task_definition.call_count == 1
+    assert other_client.boto.describe_task_definition.call_count == 2
+
+
+def test_get_cache_scope():
+    session = Mock(region_name=u'eu-central-1')
+    session.get_credentials.return_value.access_key = u'AKIA1'
+
+    assert get_cache_scope(session) == u'eu-central-1|AKIA1'
+    assert get_cache_scope(session, u'123456789012') == u'eu-central-1|123456789012'
+    session.get_credentials.return_value = None
+    assert get_cache_scope(session) == u'eu-central-1|'
+
+
 def test_client_describe_unknown_task_definition(client):
     error_response = {u'Error': {u'Code': u'ClientException', u'Message': u'Unable to describe task definition.'}}
     client.boto.describe_task_definition.side_effect = ClientError(error_response, u'DescribeServices')
@@ -1237,11 +1717,42 @@ def test_client_list_tasks(client):
     client.boto.list_tasks.assert_called_once_with(cluster=u'test-cluster', serviceName=u'test-service')
 
 
+def test_client_list_tasks_with_next_token(client):
+    client.list_tasks(u'test-cluster', u'test-service', next_token=u'next')
+    client.boto.list_tasks.assert_called_once_with(cluster=u'test-cluster', serviceName=u'test-service',
+                                                   nextToken=u'next')
+
+
 def test_client_describe_tasks(client):
     client.describe_tasks(u'test-cluster', u'task-arns')
     client.boto.describe_tasks.assert_called_once_with(cluster=u'test-cluster', tasks=u'task-arns')
 
 
+def test_client_list_task_definitions(client):
+    client.list_task_definitions(u'test-task')
+    client.list_task_definitions(u'test-task', next_token=u'next')
+    client.boto.list_task_definitions.assert_has_calls([
+        call(familyPrefix=u'test-task', status=u'ACTIVE', sort=u'DESC'),
+        call(familyPrefix=u'test-task', status=u'ACTIVE', sort=u'DESC', nextToken=u'next'),
+    ])
+
+
+def test_client_list_services(client):
+    client.list_clusters()
+    client.list_services(u'test-cluster', next_token=u'next')
+    client.boto.list_clusters.assert_called_once_with()
+    client.boto.list_services.assert_called_once_with(cluster=u'test-cluster', nextToken=u'next')
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_list_rules(get_boto_client, client):
+    client.list_rules(next_token=u'next')
+    client.list_targets_by_rule(u'rule')
+    events = get_boto_client.return_value
+    events.list_rules.assert_called_once_with(NextToken=u'next')
+    events.list_targets_by_rule.assert_called_once_with(Rule=u'rule')
+
+
 def test_client_register_task_definition(client):
     containers = [{u'name': u'foo'}]
     volumes = [{u'foo': u'bar'}]
@@ -1473,7 +1984,8 @@ def test_ecs_action_get_current_task_definition(client, service):
     task_definition = action.get_current_task_definition(service)
 
     client.describe_task_definition.assert_called_once_with(
-        task_definition_arn=service.task_definition
+        task_definition_arn=service.task_definition,
+        use_cache=True
     )
 
     assert isinstance(task_definition, EcsTaskDefinition)
@@ -1497,7 +2009,7 @@ def test_update_task_definition(client, task_definition):
         role_arn=task_definition.role_arn,
         execution_role_arn=task_definition.execution_role_arn,
         runtime_platform=task_definition.runtime_platform,
-        tags=task_definition.tags,
+        tags=[],
         additional_properties={
             u'networkMode': u'host',
             u'placementConstraints': {},
@@ -1508,6 +2020,53 @@ def test_update_task_definition(client, task_definition):
     )
 
 
+@patch.object(EcsClient, '__init__')
+def test_update_task_definition_with_fingerprint(client, task_definition):
+    client.register_task_definition.return_value = RESPONSE_TASK_DEFINITION
+    task_definition.tags = [{u'key': u'team', u'value': u'a'}]
+
+    action = EcsAction(client, u'test-cluster', u'test-service')
+    action.update_task_definition(task_definition, fingerprint=True)
+
+    assert client.register_task_definition.call_args[1][u'tags'] == [
+        {u'key': u'team', u'value': u'a'},
+        {u'key': FINGERPRINT_TAG_KEY, u'value': task_definition.fingerprint},
+    ]
+
+
+@patch.object(EcsClient, '__init__')
+def test_find_task_definition(client, task_definition):
+    registered = EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_3))
+    registered.tags = registered.get_tags_with_fingerprint()
+    matching = EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
+    matching.tags = matching.get_tags_with_fingerprint()
+    client.list_task_definitions.return_value = {
+        u'taskDefinitionArns': [TASK_DEFINITION_ARN_3, u'arn:aws:ecs:task-definition/test-task-other:1',
+                                TASK_DEFINITION_ARN_1]
+    }
+    client.describe_task_definition.side_effect = [
+        {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_3), u'tags': registered.tags},
+        {u'taskDefinition': deepcopy(PAYLOAD_TASK_DEFINITION_1), u'tags': matching.tags},
+    ]
+
+    action = EcsAction(client, u'test-cluster', u'test-service')
+    found = action.find_task_definition(task_definition)
+
+    assert found.arn == TASK_DEFINITION_ARN_1
+    client.list_task_definitions.assert_called_once_with(TASK_DEFINITION_FAMILY_1)
+    assert client.describe_task_definition.call_count == 2
+
+
+@patch.object(EcsClient, '__init__')
+def test_find_task_definition_without_match(client, task_definition):
+    client.list_task_definitions.return_value = {u'taskDefinitionArns': [TASK_DEFINITION_ARN_1]}
+    client.describe_task_definition.return_value = deepcopy(RESPONSE_TASK_DEFINITION)
+
+    action = EcsAction(client, u'test-cluster', u'test-service')
+
+    assert action.find_task_definition(task_definition) is None
+
+
 @patch.object(EcsClient, '__init__')
 def test_deregister_task_definition(client, task_definition):
     action = EcsAction(client, u'test-cluster', u'test-service')
@@ -1534,6 +2093,178 @@ def test_update_service(client, service):
     )
 
 
+@patch.object(EcsClient, '__init__')
+def test_update_service_resets_waiter(client, service):
+    client.update_service.return_value = RESPONSE_SERVICE
+    waiter = Mock()
+
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    action.set_waiter(waiter)
+    action.update_service(service)
+
+    assert action.waiter is waiter
+    waiter.reset.assert_called_once_with()
+
+
+def describe_services_batch(cluster_name, service_names):
+    return {
+        u'services': [dict(PAYLOAD_SERVICE, serviceName=name) for name in service_names if name != u'unknown'],
+        u'failures': [
+            dict(arn=u'arn:aws:ecs:eu-central-1:123456789012:service/%s/unknown' % cluster_name, reason=u'MISSING')
+            for name in service_names if name == u'unknown'
+        ],
+    }
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_batches_services_per_cluster(client):
+    client.describe_services_batch.side_effect = describe_services_batch
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+    for i in range(12):
+        aggregator.register(u'cluster-a', u'service-%02d' % i)
+    aggregator.register(u'cluster-b', u'service-b')
+
+    service = aggregator.get_service(u'cluster-a', u'service-11')
+    for i in range(12):
+        aggregator.get_service(u'cluster-a', u'service-%02d' % i)
+
+    assert isinstance(service, EcsService)
+    assert service.name == u'service-11'
+    assert service.cluster == u'cluster-a'
+    client.describe_services_batch.assert_has_calls([
+        call(cluster_name=u'cluster-a', service_names=[u'service-%02d' % i for i in range(10)]),
+        call(cluster_name=u'cluster-a', service_names=[u'service-10', u'service-11']),
+    ])
+    assert client.describe_services_batch.call_count == 2
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_refreshes_stale_services(client):
+    client.describe_services_batch.side_effect = describe_services_batch
+    aggregator = ServiceStatusAggregator(client, max_age=0)
+    aggregator.get_service(u'cluster-a', u'service-a')
+    aggregator.get_service(u'cluster-a', u'service-a')
+    assert client.describe_services_batch.call_count == 2
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_get_service_snapshot(client):
+    client.describe_services_batch.side_effect = describe_services_batch
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+
+    snapshot = aggregator.get_service_snapshot(u'cluster-a', u'service-a')
+
+    assert isinstance(snapshot, EcsServiceSnapshot)
+    assert snapshot.name == u'service-a'
+    assert snapshot.cluster == u'cluster-a'
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_unknown_service(client):
+    client.describe_services_batch.side_effect = describe_services_batch
+    aggregator = ServiceStatusAggregator(client)
+    with pytest.raises(EcsConnectionError) as excinfo:
+        aggregator.get_service(u'cluster-a', u'unknown')
+    assert str(excinfo.value) == (
+        u'An error occurred when calling the DescribeServices operation: Service not found: unknown (MISSING)'
+    )
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_describes_outside_of_lock(client):
+    started = Event()
+    release = Event()
+
+    def slow_describe_services_batch(cluster_name, service_names):
+        if cluster_name == u'cluster-a':
+            started.set()
+            release.wait(5)
+        return describe_services_batch(cluster_name, service_names)
+
+    client.describe_services_batch.side_effect = slow_describe_services_batch
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+    results = []
+    threads = [Thread(target=lambda name=name: results.append(aggregator.get_service(u'cluster-a', name)))
+               for name in (u'service-a', u'service-b')]
+    threads[0].start()
+    started.wait(5)
+    threads[1].start()
+
+    # another cluster is not blocked by the request in flight
+    assert aggregator.get_service(u'cluster-b', u'service-c').name == u'service-c'
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(service.name for service in results) == [u'service-a', u'service-b']
+    # service-b waited for the request in flight and was described afterwards
+    client.describe_services_batch.assert_has_calls([
+        call(cluster_name=u'cluster-a', service_names=[u'service-a']),
+        call(cluster_name=u'cluster-b', service_names=[u'service-c']),
+        call(cluster_name=u'cluster-a', service_names=[u'service-a', u'service-b']),
+    ])
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_ignores_refresh_started_before_invalidation(client):
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+
+    def invalidate_while_in_flight(cluster_name, service_names):
+        if client.describe_services_batch.call_count == 1:
+            aggregator.invalidate(cluster_name, u'service-a')
+        return describe_services_batch(cluster_name, service_names)
+
+    client.describe_services_batch.side_effect = invalidate_while_in_flight
+
+    aggregator.get_service(u'cluster-a', u'service-a')
+
+    assert client.describe_services_batch.call_count == 2
+
+
+@patch.object(EcsClient, '__init__')
+def test_status_aggregator_shares_errors_of_refresh(client):
+    client.describe_services_batch.side_effect = ClientError(
+        {u'Error': {u'Code': u'ClusterNotFoundException', u'Message': u'Cluster not found.'}}, u'DescribeServices'
+    )
+    aggregator = ServiceStatusAggregator(client)
+    with pytest.raises(ClientError):
+        aggregator.get_service(u'cluster-a', u'service-a')
+    with pytest.raises(ClientError):
+        aggregator.get_service(u'cluster-a', u'service-a')
+    assert client.describe_services_batch.call_count == 2
+
+
+@patch.object(EcsClient, '__init__')
+def test_ecs_action_fetches_service_from_status_aggregator(client):
+    client.describe_services_batch.side_effect = describe_services_batch
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME, status_aggregator=aggregator)
+    action.get_service()
+
+    assert action.service.name == SERVICE_NAME
+    client.describe_services.assert_not_called()
+    client.describe_services_batch.assert_called_once_with(cluster_name=CLUSTER_NAME, service_names=[SERVICE_NAME])
+
+
+@patch.object(EcsClient, '__init__')
+def test_ecs_action_get_service_from_status_aggregator(client, service):
+    client.describe_services_batch.side_effect = describe_services_batch
+    client.update_service.return_value = RESPONSE_SERVICE
+    aggregator = ServiceStatusAggregator(client, max_age=60)
+
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    action.set_status_aggregator(aggregator)
+    action.get_service()
+    action.get_service()
+    action.update_service(service)
+    action.get_service()
+
+    assert action.status_aggregator is aggregator
+    client.describe_services_batch.assert_called_with(cluster_name=CLUSTER_NAME, service_names=[SERVICE_NAME])
+    assert client.describe_services_batch.call_count == 2
+
+
 @patch.object(EcsClient, '__init__')
 def test_is_deployed(client, service):
     client.list_tasks.return_value = RESPONSE_LIST_TASKS_1
@@ -1604,6 +2335,42 @@ def test_get_running_tasks_count(client, service):
     assert running_count == 2
 
 
+@patch.object(EcsClient, '__init__')
+def test_is_deployed_with_paginated_tasks(client, service):
+    client.list_tasks.side_effect = [
+        {u'taskArns': [TASK_ARN_1], u'nextToken': u'next'},
+        {u'taskArns': [TASK_ARN_2]},
+    ]
+    client.describe_tasks.side_effect = lambda cluster_name, task_arns: {
+        u'tasks': [PAYLOAD_TASK_1 if arn == TASK_ARN_1 else PAYLOAD_TASK_2 for arn in task_arns]
+    }
+
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    is_deployed = action.is_deployed(service)
+
+    assert is_deployed is True
+    client.list_tasks.assert_has_calls([
+        call(cluster_name=service.cluster, service_name=service.name),
+        call(cluster_name=service.cluster, service_name=service.name, next_token=u'next'),
+    ])
+
+
+@patch.object(EcsClient, '__init__')
+def test_get_running_tasks_count_in_chunks(client, service):
+    task_arns = [u'arn:aws:ecs:eu-central-1:123456789012:task/%d' % i for i in range(250)]
+    client.describe_tasks.side_effect = lambda cluster_name, task_arns: {
+        u'tasks': [dict(PAYLOAD_TASK_1, taskArn=arn) for arn in task_arns]
+    }
+
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    running_count = action.get_running_tasks_count(service, iter(task_arns))
+
+    assert running_count == 250
+    assert client.describe_tasks.call_count == 3
+    chunk_sizes = sorted(len(c[1][u'task_arns']) for c in client.describe_tasks.call_args_list)
+    assert chunk_sizes == [50, 100, 100]
+
+
 @patch.object(EcsClient, '__init__')
 def test_get_running_tasks_count_new_revision(client, service, task_definition_revision_2):
     client.describe_tasks.return_value = RESPONSE_DESCRIBE_TASKS
@@ -1680,6 +2447,80 @@ def test_run_action_run(client, task_definition):
     assert len(action.started_tasks) == 2
 
 
+@patch.object(EcsClient, '__init__')
+def test_run_action_describe_tasks_in_chunks(client):
+    action = RunAction(client, CLUSTER_NAME)
+    task_arns = [u'task-%d' % i for i in range(250)]
+    client.describe_tasks.side_effect = lambda cluster_name, task_arns: {
+        u'tasks': [dict(taskArn=arn, lastStatus=u'RUNNING') for arn in task_arns if arn != u'task-0'],
+        u'failures': [dict(arn=u'task-0', reason=u'MISSING')] if u'task-0' in task_arns else [],
+    }
+
+    tasks = action.describe_tasks(task_arns)
+
+    assert sorted(len(call_args[1][u'task_arns']) for call_args in client.describe_tasks.call_args_list) == \
+        [50, 100, 100]
+    assert sorted(task.arn for task in tasks) == sorted(task_arns)
+    missing = [task for task in tasks if task.arn == u'task-0'][0]
+    assert missing.is_stopped
+    assert missing.stopped_reason == u'MISSING'
+    assert missing.exit_code is None
+
+
+@pytest.mark.parametrize('containers, exit_code', [
+    ([{u'name': u'app', u'exitCode': 0}, {u'name': u'sidecar', u'exitCode': 0}], 0),
+    ([{u'name': u'app', u'exitCode': 0}, {u'name': u'sidecar', u'exitCode': 137}], 137),
+    ([{u'name': u'app', u'exitCode': 2}, {u'name': u'sidecar'}], 2),
+    ([{u'name': u'app', u'exitCode': 0}, {u'name': u'sidecar'}], None),
+    ([], None),
+])
+def test_task_exit_code(containers, exit_code):
+    task = EcsTask(taskArn=u'task', lastStatus=u'STOPPED', containers=containers)
+    assert task.exit_code == exit_code
+    assert task.succeeded is (exit_code == 0)
+
+
+def test_task_exit_code_of_essential_containers():
+    containers = [{u'name': u'app', u'exitCode': 0}, {u'name': u'log-router', u'exitCode': 137}]
+    task = EcsTask(taskArn=u'task', lastStatus=u'STOPPED', containers=containers, essential_containers=[u'app'])
+    assert task.exit_code == 0
+    assert task.succeeded
+    assert task.deciding_containers == containers[:1]
+
+    task = EcsTask(taskArn=u'task', lastStatus=u'STOPPED', containers=[{u'name': u'log-router', u'exitCode': 1}],
+                   essential_containers=[u'app'])
+    assert task.exit_code == 1
+
+
+def test_task_definition_essential_container_names():
+    task_definition = EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
+    task_definition.containers[1][u'essential'] = False
+    assert list(task_definition.essential_container_names) == [task_definition.containers[0][u'name']]
+
+
+@patch.object(EcsClient, '__init__')
+def test_run_action_run_records_failures_and_essential_containers(client):
+    client.run_task.return_value = {
+        u'tasks': [{u'taskArn': u'task-1'}],
+        u'failures': [{u'arn': u'instance-1', u'reason': u'RESOURCE:MEMORY'}],
+    }
+    client.describe_tasks.return_value = {u'tasks': [{u'taskArn': u'task-1', u'lastStatus': u'STOPPED'}]}
+    task_definition = EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
+    task_definition.containers[1][u'essential'] = False
+    action = RunAction(client, CLUSTER_NAME)
+
+    action.run(task_definition, 2, u'test', LAUNCH_TYPE_EC2, (), (), False, None)
+
+    assert action.failures == [{u'arn': u'instance-1', u'reason': u'RESOURCE:MEMORY'}]
+    assert action.essential_containers == [task_definition.containers[0][u'name']]
+    assert action.describe_tasks([u'task-1'])[0].essential_containers == action.essential_containers
+
+
+def test_task_is_stopped():
+    assert not EcsTask(lastStatus=u'RUNNING', containers=[{u'exitCode': 0}]).succeeded
+    assert EcsTask(lastStatus=u'STOPPED').is_stopped
+
+
 def test_ecs_server_get_warnings():
     since = datetime.now() - timedelta(hours=1)
     until = datetime.now() + timedelta(hours=1)
@@ -1702,6 +2543,82 @@ def test_ecs_server_get_warnings():
     assert len(service.get_warnings(since, until)) == 1
 
 
+def test_ecs_server_get_warnings_with_matcher():
+    since = datetime.now() - timedelta(hours=1)
+    until = datetime.now() + timedelta(hours=1)
+    service = EcsService('foo', {
+        u'deployments': [],
+        u'events': [
+            {u'createdAt': datetime.now(), u'message': u'unable to foo'},
+            {u'createdAt': datetime.now() - timedelta(seconds=1), u'message': u'task failed ELB health checks'},
+        ],
+    })
+    matcher = EventMatcher([u'unable'])
+    matcher.add(u'failed .* health checks')
+
+    assert len(service.get_warnings(since, until, matcher=matcher)) == 2
+    assert matcher.patterns == (u'unable', u'failed .* health checks')
+
+
+def test_event_matcher_without_patterns():
+    assert not EventMatcher().matches(u'unable to foo')
+
+
+def get_event(event_id, message=u'unable to foo', seconds_ago=0):
+    return {u'id': event_id, u'createdAt': datetime.now() - timedelta(seconds=seconds_ago), u'message': message}
+
+
+def test_event_cursor():
+    cursor = EventCursor()
+    events = [get_event(u'2', seconds_ago=1), get_event(u'1', seconds_ago=2)]
+
+    assert cursor.get_new_events({u'events': events}) == events
+    assert cursor.last_event_id == u'2'
+    assert cursor.get_new_events({u'events': events}) == []
+
+    new_event = get_event(u'3')
+    assert cursor.get_new_events({u'events': [new_event] + events}) == [new_event]
+    assert cursor.last_event_id == u'3'
+
+
+def test_event_cursor_without_event_ids():
+    cursor = EventCursor()
+    events = [{u'createdAt': datetime.now(), u'message': u'unable to foo'}]
+    assert cursor.get_new_events({u'events': events}) == events
+    assert cursor.get_new_events({u'events': events}) == events
+
+
+def test_ecs_server_get_warnings_with_cursor():
+    since = datetime.now() - timedelta(hours=1)
+    until = datetime.now() + timedelta(hours=1)
+    cursor = EventCursor()
+    events = [get_event(u'2', seconds_ago=1), get_event(u'1', u'steady state', seconds_ago=2)]
+
+    service = EcsService('foo', {u'deployments': [], u'events': events})
+    assert len(service.get_warnings(since, until, cursor=cursor)) == 1
+
+    service = EcsService('foo', {u'deployments': [], u'events': [get_event(u'3')] + events})
+    assert list(service.get_warnings(since, until, cursor=cursor).values()) == [u'unable to foo']
+    assert len(service.get_warnings(since, until, cursor=cursor)) == 0
+
+
+def test_ecs_server_get_warnings_with_cursor_keeps_events_ahead_of_local_clock():
+    since = datetime.now(tz=tzlocal()) - timedelta(hours=1)
+    cursor = EventCursor()
+    event = {u'id': u'1', u'createdAt': datetime.now(tz=tzlocal()) + timedelta(seconds=30),
+             u'message': u'unable to foo'}
+    service = EcsService('foo', {u'deployments': [], u'events': [event]})
+
+    assert list(service.get_warnings(since, cursor=cursor).values()) == [u'unable to foo']
+    assert service.get_warnings(since, cursor=cursor) == {}
+
+
+def test_service_older_errors_are_memoized(service_with_errors):
+    with patch.object(EcsService, 'get_warnings', wraps=service_with_errors.get_warnings) as get_warnings:
+        assert service_with_errors.older_errors is service_with_errors.older_errors
+        get_warnings.assert_called_once()
+
+
 def test_init_deployment():
     service = EcsService('foo', PAYLOAD_SERVICE)
     assert service.primary_deployment.has_failed is False
@@ -1769,6 +2686,311 @@ def test_deployment_rollout_state_reason():
     assert deployment.rollout_state_reason == "ECS deployment circuit breaker: tasks failed to start."
 
 
+def test_get_family():
+    assert get_family(u'arn:aws:ecs:eu-central-1:123456789012:task-definition/test-task:12') == u'test-task'
+
+
+def test_paginate():
+    list_method = Mock(side_effect=[
+        {u'items': [1, 2], u'NextToken': u'next'},
+        {u'items': [3]},
+    ])
+    assert list(paginate(list_method, u'items', token_key=u'NextToken', rule=u'rule')) == [1, 2, 3]
+    list_method.assert_has_calls([call(rule=u'rule'), call(rule=u'rule', next_token=u'next')])
+
+
+@patch('ecs_deploy.ecs.sleep')
+@patch('ecs_deploy.ecs.time')
+def test_rate_limiter(time, sleep):
+    time.return_value = 100
+    rate_limiter = RateLimiter(rate=4)
+    for _ in range(3):
+        rate_limiter.wait()
+    sleep.assert_has_calls([call(0.25), call(0.5)])
+
+
+@patch('ecs_deploy.ecs.sleep')
+def test_rate_limiter_without_rate(sleep):
+    rate_limiter = RateLimiter(rate=None)
+    rate_limiter.wait()
+    rate_limiter.wait()
+    sleep.assert_not_called()
+
+
+def get_task_definition_arn(family, revision):
+    return u'arn:aws:ecs:eu-central-1:123456789012:task-definition/%s:%d' % (family, revision)
+
+
+@pytest.fixture
+def gc_client():
+    client = Mock()
+    client.list_task_definitions.side_effect = [
+        {u'taskDefinitionArns': [get_task_definition_arn(u'test-task', rev) for rev in (6, 5, 4)],
+         u'nextToken': u'next'},
+        {u'taskDefinitionArns': [get_task_definition_arn(u'test-task-other', 1)] +
+                                [get_task_definition_arn(u'test-task', rev) for rev in (3, 2, 1)]},
+    ]
+    client.list_services.return_value = {u'serviceArns': [u'service-a', u'service-b']}
+    client.describe_services_batch.return_value = {u'services': [
+        {u'taskDefinition': get_task_definition_arn(u'test-task', 6),
+         u'deployments': [{u'taskDefinition': get_task_definition_arn(u'test-task', 6)},
+                          {u'taskDefinition': get_task_definition_arn(u'test-task', 3)}]},
+    ]}
+    client.list_rules.return_value = {u'Rules': [{u'Name': u'rule'}]}
+    client.list_targets_by_rule.return_value = {u'Targets': [
+        {u'Id': u'lambda'},
+        {u'Id': u'task', u'EcsParameters': {u'TaskDefinitionArn': get_task_definition_arn(u'test-task', 1)}},
+    ]}
+    return client
+
+
+def test_gc_action_get_obsolete_revisions(gc_client):
+    action = GarbageCollectAction(gc_client)
+
+    kept, in_use, obsolete = action.get_obsolete_revisions(u'test-task', 2, clusters=[u'test-cluster'])
+
+    assert kept == [get_task_definition_arn(u'test-task', rev) for rev in (6, 5)]
+    assert in_use == [get_task_definition_arn(u'test-task', rev) for rev in (3, 1)]
+    assert obsolete == [get_task_definition_arn(u'test-task', rev) for rev in (4, 2)]
+    gc_client.describe_services_batch.assert_called_once_with(u'test-cluster', [u'service-a', u'service-b'])
+    gc_client.list_clusters.assert_not_called()
+
+
+def test_gc_action_keeps_newest_revision_of_rule_without_revision(gc_client):
+    gc_client.list_targets_by_rule.return_value = {u'Targets': [
+        {u'Id': u'task', u'EcsParameters': {
+            u'TaskDefinitionArn': u'arn:aws:ecs:eu-central-1:123456789012:task-definition/test-task'
+        }},
+    ]}
+    action = GarbageCollectAction(gc_client)
+
+    kept, in_use, obsolete = action.get_obsolete_revisions(u'test-task', 0, clusters=[u'test-cluster'])
+
+    assert kept == []
+    assert in_use == [get_task_definition_arn(u'test-task', rev) for rev in (6, 3)]
+    assert obsolete == [get_task_definition_arn(u'test-task', rev) for rev in (5, 4, 2, 1)]
+
+
+def test_gc_action_checks_all_clusters(gc_client):
+    gc_client.list_clusters.return_value = {u'clusterArns': [u'cluster-a', u'cluster-b']}
+    action = GarbageCollectAction(gc_client)
+
+    action.get_used_task_definitions()
+
+    gc_client.list_services.assert_has_calls([call(cluster_name=u'cluster-a'), call(cluster_name=u'cluster-b')])
+
+
+def test_gc_action_deregister_revisions(gc_client):
+    error = ClientError({u'Error': {u'Code': u'ClientException', u'Message': u'Failed'}}, u'DeregisterTaskDefinition')
+    gc_client.deregister_task_definition.side_effect = [None, error, None]
+    action = GarbageCollectAction(gc_client)
+
+    results = action.deregister_revisions([u'arn-1', u'arn-2', u'arn-3'], concurrency=1)
+
+    assert results[0] == (u'arn-1', None)
+    assert results[1][0] == u'arn-2'
+    assert u'Failed' in results[1][1]
+    assert results[2] == (u'arn-3', None)
+
+
+def make_rule_target(target_id, family, revision=1):
+    return {
+        u'Id': target_id,
+        u'Arn': u'arn:aws:ecs:eu-central-1:123456789012:cluster/old-cluster',
+        u'EcsParameters': {u'TaskDefinitionArn': get_task_definition_arn(family, revision), u'TaskCount': 1},
+    }
+
+
+def make_rule_task_definition():
+    return EcsTaskDefinition(containerDefinitions=[], volumes=[], family=u'test-task', revision=2, status=u'ACTIVE',
+                             taskDefinitionArn=get_task_definition_arn(u'test-task', 2))
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_list_rules_with_prefix(get_boto_client, client):
+    client.list_rules(name_prefix=u'nightly-')
+    get_boto_client.return_value.list_rules.assert_called_once_with(NamePrefix=u'nightly-')
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_update_rule(get_boto_client, client):
+    events = get_boto_client.return_value
+    events.list_targets_by_rule.side_effect = [
+        {u'Targets': [make_rule_target(u'target-%d' % i, u'test-task') for i in range(8)] +
+                     [{u'Id': u'lambda', u'Arn': u'arn:aws:lambda:eu-central-1:123456789012:function:f'}],
+         u'NextToken': u'next'},
+        {u'Targets': [make_rule_target(u'other', u'other-task')] +
+                     [make_rule_target(u'target-%d' % i, u'test-task') for i in range(8, 12)]},
+    ]
+    events.put_targets.return_value = {u'FailedEntryCount': 0, u'FailedEntries': []}
+    task_definition = make_rule_task_definition()
+
+    target_ids = client.update_rule(u'test-cluster', u'nightly', task_definition)
+
+    assert target_ids == [u'target-%d' % i for i in range(12)]
+    events.list_targets_by_rule.assert_has_calls([call(Rule=u'nightly'), call(Rule=u'nightly', NextToken=u'next')])
+    assert events.put_targets.call_count == 2
+    batches = [put_call[1][u'Targets'] for put_call in events.put_targets.call_args_list]
+    assert [len(batch) for batch in batches] == [10, 2]
+    for target in batches[0] + batches[1]:
+        assert target[u'Arn'] == u'arn:aws:ecs:eu-central-1:123456789012:cluster/test-cluster'
+        assert target[u'EcsParameters'][u'TaskDefinitionArn'] == get_task_definition_arn(u'test-task', 2)
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_update_rule_without_matching_targets(get_boto_client, client):
+    events = get_boto_client.return_value
+    events.list_targets_by_rule.return_value = {u'Targets': [make_rule_target(u'other', u'other-task')]}
+    task_definition = make_rule_task_definition()
+
+    assert client.update_rule(u'test-cluster', u'nightly', task_definition) == []
+    events.put_targets.assert_not_called()
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_update_rule_of_any_family(get_boto_client, client):
+    events = get_boto_client.return_value
+    events.list_targets_by_rule.return_value = {u'Targets': [
+        {u'Id': u'lambda', u'Arn': u'arn:aws:lambda:eu-central-1:123456789012:function:f'},
+        make_rule_target(u'other-1', u'other-task'),
+        make_rule_target(u'other-2', u'other-task'),
+    ]}
+    events.put_targets.return_value = {u'FailedEntryCount': 0, u'FailedEntries': []}
+    task_definition = make_rule_task_definition()
+
+    assert client.update_rule(u'test-cluster', u'nightly', task_definition, any_family=True) == [u'other-1']
+    targets = events.put_targets.call_args[1][u'Targets']
+    assert [target[u'Id'] for target in targets] == [u'other-1']
+    assert targets[0][u'EcsParameters'][u'TaskDefinitionArn'] == get_task_definition_arn(u'test-task', 2)
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_update_rule_of_any_family_without_targets(get_boto_client, client):
+    events = get_boto_client.return_value
+    events.list_targets_by_rule.return_value = {u'Targets': []}
+    task_definition = make_rule_task_definition()
+
+    with pytest.raises(EcsError) as e:
+        client.update_rule(u'test-cluster', u'nightly', task_definition, any_family=True)
+
+    assert str(e.value) == u'Rule nightly has no ECS targets'
+    events.put_targets.assert_not_called()
+
+
+@patch('ecs_deploy.ecs.get_boto_client')
+def test_client_update_rule_with_failed_entries(get_boto_client, client):
+    events = get_boto_client.return_value
+    events.list_targets_by_rule.return_value = {u'Targets': [make_rule_target(u'target-1', u'test-task')]}
+    events.put_targets.return_value = {u'FailedEntryCount': 1, u'FailedEntries': [
+        {u'TargetId': u'target-1', u'ErrorCode': u'ConcurrentModificationException', u'ErrorMessage': u'Conflict'}
+    ]}
+    task_definition = make_rule_task_definition()
+
+    with pytest.raises(EcsError) as e:
+        client.update_rule(u'test-cluster', u'nightly', task_definition)
+
+    assert str(e.value) == u'Unable to update targets of rule nightly:\n- target-1: Conflict'
+
+
+def test_cron_action_get_rules():
+    action = CronAction(EcsTestClient(u'access_key', u'secret_key'), u'test-cluster')
+
+    assert action.get_rules([u'hourly-sync']) == [u'hourly-sync']
+    assert action.get_rules([u'nightly-report'], u'nightly-') == [u'nightly-report', u'nightly-cleanup']
+    assert action.get_rules(rule_prefix=u'weekly-') == []
+
+
+def test_cron_action_update_rules():
+    action = CronAction(EcsTestClient(u'access_key', u'secret_key'), u'test-cluster')
+    task_definition = EcsTaskDefinition(**PAYLOAD_TASK_DEFINITION_1)
+
+    results = action.update_rules([u'nightly-report', u'failing-rule', u'hourly-sync', u'nightly-cleanup'],
+                                  task_definition)
+
+    assert results[0] == (u'nightly-report', [u'target-1'], None)
+    assert results[1] == (u'failing-rule', [], u'Rule failing-rule has no ECS targets')
+    assert results[2] == (u'hourly-sync', [u'target-1'], None)
+    assert results[3] == (u'nightly-cleanup', [], None)
+
+
+def test_cron_action_update_named_rules():
+    action = CronAction(EcsTestClient(u'access_key', u'secret_key'), u'test-cluster')
+    task_definition = EcsTaskDefinition(**PAYLOAD_TASK_DEFINITION_1)
+
+    results = action.update_rules([u'nightly-cleanup'], task_definition, named_rules=(u'nightly-cleanup',))
+
+    assert results == [(u'nightly-cleanup', [u'target-1'], None)]
+
+
+def test_cron_action_get_rule_index():
+    client = Mock()
+    client.list_rules.side_effect = [
+        {u'Rules': [{u'Name': u'nightly'}], u'NextToken': u'next'},
+        {u'Rules': [{u'Name': u'hourly'}, {u'Name': u'lambda'}]},
+    ]
+    targets = {
+        u'nightly': {u'Targets': [make_rule_target(u'target-1', u'test-task'),
+                                  make_rule_target(u'target-2', u'other-task')]},
+        u'hourly': {u'Targets': [make_rule_target(u'target-1', u'test-task')]},
+        u'lambda': {u'Targets': [{u'Id': u'lambda', u'Arn': u'arn:aws:lambda:eu-central-1:123456789012:function:f'}]},
+    }
+    client.list_targets_by_rule.side_effect = lambda rule, next_token=None: targets[rule]
+    action = CronAction(client, u'test-cluster')
+
+    index = action.get_rule_index()
+
+    assert index == {
+        u'test-task': {u'nightly': [u'target-1'], u'hourly': [u'target-1']},
+        u'other-task': {u'nightly': [u'target-2']},
+    }
+    client.list_rules.assert_has_calls([call(), call(next_token=u'next')])
+
+
+def test_cron_action_discover_rules(monkeypatch, tmp_path):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path))
+    action = CronAction(EcsTestClient(u'access_key', u'secret_key'), u'test-cluster')
+
+    with patch.object(action, 'get_rule_index', wraps=action.get_rule_index) as get_rule_index:
+        assert action.discover_rules(u'test-task') == [u'hourly-sync', u'nightly-report']
+        assert action.discover_rules(u'other-task') == [u'nightly-cleanup']
+        assert action.discover_rules(u'unknown-task') == []
+        assert get_rule_index.call_count == 1
+
+        action.discover_rules(u'test-task', refresh=True)
+        assert get_rule_index.call_count == 2
+
+        monkeypatch.setenv('ECS_DEPLOY_RULE_INDEX_CACHE', '0')
+        action.discover_rules(u'test-task')
+        assert get_rule_index.call_count == 3
+
+
+def test_cron_action_discover_rules_by_cache_scope(monkeypatch, tmp_path):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path))
+    client = EcsTestClient(u'access_key', u'secret_key')
+    client.cache_scope = u'eu-central-1|123456789012'
+    other_client = EcsTestClient(u'access_key', u'secret_key')
+    other_client.cache_scope = u'eu-west-1|123456789012'
+    action = CronAction(client, u'test-cluster')
+    other_action = CronAction(other_client, u'test-cluster')
+
+    with patch.object(action, 'get_rule_index', return_value={u'test-task': {u'nightly': [u'target-1']}}), \
+            patch.object(other_action, 'get_rule_index', return_value={}) as other_get_rule_index:
+        assert action.discover_rules(u'test-task') == [u'nightly']
+        assert other_action.discover_rules(u'test-task') == []
+        assert other_get_rule_index.call_count == 1
+
+    assert RuleIndexCache().get(u'rules|eu-central-1|123456789012')[u'index'] == {
+        u'test-task': {u'nightly': [u'target-1']}
+    }
+
+
+def test_cron_action_get_rules_with_family(monkeypatch, tmp_path):
+    monkeypatch.setenv('ECS_DEPLOY_CACHE_DIR', str(tmp_path))
+    action = CronAction(EcsTestClient(u'access_key', u'secret_key'), u'test-cluster')
+
+    assert action.get_rules([u'nightly-report'], family=u'test-task') == [u'nightly-report', u'hourly-sync']
+
+
 class EcsTestClient(object):
     def __init__(self, access_key_id=None, secret_access_key=None, region=None,
                  profile=None, deployment_errors=False, client_errors=False,
@@ -1781,6 +3003,8 @@ class EcsTestClient(object):
         self.deployment_errors = deployment_errors
         self.client_errors = client_errors
         self.wait_until = datetime.now() + timedelta(seconds=wait)
+        self.session = None
+        self.cache_scope = u'test-scope'
 
     def describe_services(self, cluster_name, service_name):
         if not self.access_key_id or not self.secret_access_key:
@@ -1800,7 +3024,17 @@ class EcsTestClient(object):
             u"failures": []
         }
 
-    def describe_task_definition(self, task_definition_arn):
+    def describe_services_batch(self, cluster_name, service_names):
+        services = [
+            self.describe_services(cluster_name, service_name)[u'services'][0]
+            for service_name in service_names if service_name == u'test-service'
+        ]
+        return {
+            u"services": services,
+            u"failures": []
+        }
+
+    def describe_task_definition(self, task_definition_arn, use_cache=True):
         if not self.access_key_id or not self.secret_access_key:
             raise EcsConnectionError(u'Unable to locate credentials. Configure credentials by running "aws configure".')
         if task_definition_arn in RESPONSE_TASK_DEFINITIONS:
@@ -1845,9 +3079,22 @@ class EcsTestClient(object):
             raise ClientError(error, 'fake_error')
         return dict(tasks=[dict(taskArn='arn:foo:bar'), dict(taskArn='arn:lorem:ipsum')])
 
-    def update_rule(self, cluster, rule, task_definition):
+    def update_rule(self, cluster, rule, task_definition, any_family=False):
         if not self.access_key_id or not self.secret_access_key:
             raise EcsConnectionError(u'Unable to locate credentials. Configure credentials by running "aws configure".')
         if cluster == 'unknown-cluster':
             raise EcsConnectionError(
                 u'An error occurred (ClusterNotFoundException) when calling the RunTask operation: Cluster not found.')
+        if rule == u'failing-rule':
+            raise EcsError(u'Rule failing-rule has no ECS targets')
+        if rule == u'nightly-cleanup' and not any_family:
+            return []
+        return [u'target-1']
+
+    def list_rules(self, next_token=None, name_prefix=None):
+        rules = [u'nightly-report', u'nightly-cleanup', u'hourly-sync']
+        return {u'Rules': [{u'Name': rule} for rule in rules if rule.startswith(name_prefix or u'')]}
+
+    def list_targets_by_rule(self, rule, next_token=None):
+        family = u'other-task' if rule == u'nightly-cleanup' else u'test-task'
+        return {u'Targets': [make_rule_target(u'target-1', family)]}
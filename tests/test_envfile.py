@@ -0,0 +1,112 @@
+import os
+
+import pytest
+from mock.mock import patch
+
+from ecs_deploy import envfile
+from ecs_deploy.envfile import iter_env_file, parse_env_file, clear_env_file_cache
+
+
+@pytest.fixture(autouse=True)
+def env_file_cache():
+    clear_env_file_cache()
+    yield
+    clear_env_file_cache()
+
+
+def write_env_file(tmp_path, content, name='.env'):
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_iter_env_file():
+    lines = [
+        u'# comment\n',
+        u'\n',
+        u'FOO=bar\n',
+        u'export EXPORTED = value \n',
+        u'SPACED= "not quoted"\n',
+        u'EMPTY=\n',
+        u'EQUALS=a=b\n',
+        u'IncompleteDescription\n',
+        u"SINGLE='  keep \\n $raw  '\n",
+        u'DOUBLE="line\\nbreak \\"quoted\\""\n',
+        u'TRAILING="value" # comment\n',
+    ]
+    assert list(iter_env_file(lines)) == [
+        (u'FOO', u'bar'),
+        (u'EXPORTED', u' value'),
+        (u'SPACED', u' "not quoted"'),
+        (u'EMPTY', u''),
+        (u'EQUALS', u'a=b'),
+        (u'SINGLE', u'  keep \\n $raw  '),
+        (u'DOUBLE', u'line\nbreak "quoted"'),
+        (u'TRAILING', u'value'),
+    ]
+
+
+def test_iter_env_file_multiline_values():
+    lines = [
+        u'KEY="-----BEGIN KEY-----\n',
+        u'  abc\n',
+        u'-----END KEY-----"\n',
+        u"JSON='{\n",
+        u'  "a": 1\n',
+        u"}'\n",
+        u'AFTER=1\n',
+    ]
+    assert list(iter_env_file(lines)) == [
+        (u'KEY', u'-----BEGIN KEY-----\n  abc\n-----END KEY-----'),
+        (u'JSON', u'{\n  "a": 1\n}'),
+        (u'AFTER', u'1'),
+    ]
+
+
+def test_iter_env_file_unterminated_quote():
+    lines = [u'KEY="value\n', u"SINGLE='a\n", u'OTHER=1\n']
+    assert list(iter_env_file(lines)) == [
+        (u'KEY', u'"value'),
+        (u'SINGLE', u"'a"),
+        (u'OTHER', u'1'),
+    ]
+
+
+@pytest.mark.parametrize(u'line', (u'A="a"b\n', u"A='a' b\n", u'A="a""b"\n'))
+def test_iter_env_file_trailing_text_after_quoted_value(line):
+    with pytest.raises(ValueError) as e:
+        list(iter_env_file([line]))
+    assert u'Unexpected characters after the quoted value of A' in str(e.value)
+
+
+def test_parse_env_file_last_definition_wins(tmp_path):
+    path = write_env_file(tmp_path, u'A=1\nB=2\nA=3\n')
+    assert list(parse_env_file(path).items()) == [(u'A', u'3'), (u'B', u'2')]
+
+
+def test_parse_env_file_is_cached(tmp_path):
+    path = write_env_file(tmp_path, u'A=1\n')
+
+    with patch.object(envfile, 'iter_env_file', wraps=iter_env_file) as parser:
+        first = parse_env_file(path)
+        first[u'A'] = u'modified'
+        second = parse_env_file(os.path.join(str(tmp_path), '.', '.env'))
+
+    assert parser.call_count == 1
+    assert second == {u'A': u'1'}
+
+
+def test_parse_env_file_detects_changes(tmp_path):
+    path = write_env_file(tmp_path, u'A=1\n')
+    assert parse_env_file(path) == {u'A': u'1'}
+
+    write_env_file(tmp_path, u'A=1\nB=22\n')
+    assert parse_env_file(path) == {u'A': u'1', u'B': u'22'}
+
+
+def test_parse_env_file_cache_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(envfile, 'ENV_FILE_CACHE_SIZE', 2)
+    paths = [write_env_file(tmp_path, u'A=%d\n' % index, name='%d.env' % index) for index in range(3)]
+    for path in paths:
+        parse_env_file(path)
+    assert list(envfile._cache) == [os.path.realpath(path) for path in paths[1:]]
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from boto3.session import Session
+from botocore.stub import Stubber
+
+from ecs_deploy import metrics
+from ecs_deploy.metrics import MetricsCollector, instrument, set_collector
+
+
+@pytest.fixture
+def collector():
+    collector = MetricsCollector()
+    set_collector(collector)
+    yield collector
+    set_collector(None)
+
+
+@pytest.fixture
+def client():
+    session = Session(aws_access_key_id='key', aws_secret_access_key='secret', region_name='eu-central-1')
+    return instrument(session.client('ecs'))
+
+
+def test_record(collector):
+    collector.record('ecs.DescribeServices', 0.02)
+    collector.record('ecs.DescribeServices', 0.2, retries=2)
+    collector.record('ecs.UpdateService', 3, error=True)
+    collector.record_throttling('ecs.DescribeServices')
+
+    summary = collector.get_summary()
+
+    assert summary['calls'] == 3
+    assert summary['errors'] == 1
+    assert summary['retries'] == 2
+    assert summary['throttled'] == 1
+    assert summary['api_time'] == pytest.approx(3.22)
+
+    describe_services = summary['operations']['ecs.DescribeServices']
+    assert describe_services['calls'] == 2
+    assert describe_services['avg'] == pytest.approx(0.11)
+    assert describe_services['min'] == 0.02
+    assert describe_services['max'] == 0.2
+    assert describe_services['histogram']['0.025'] == 1
+    assert describe_services['histogram']['0.25'] == 1
+    assert summary['operations']['ecs.UpdateService']['histogram']['5'] == 1
+
+
+def test_histogram_overflow(collector):
+    collector.record('ecs.DescribeServices', 60)
+    assert collector.get_summary()['operations']['ecs.DescribeServices']['histogram']['+Inf'] == 1
+
+
+def test_percentiles(collector):
+    for duration in range(1, 101):
+        collector.record('ecs.ListTasks', duration / 100.0)
+    operation = collector.get_summary()['operations']['ecs.ListTasks']
+    assert operation['p50'] == 0.5
+    assert operation['p95'] == 0.95
+
+
+def test_format_summary(collector):
+    collector.record('ecs.DescribeServices', 0.5)
+    collector.record('ecs.UpdateService', 1, retries=1)
+
+    lines = collector.format_summary().splitlines()
+
+    assert lines[0].startswith('API calls: 2 in 1.500s of ')
+    assert lines[0].endswith('(retries: 1, throttled: 0, errors: 0)')
+    assert lines[1].startswith('- ecs.UpdateService: 1 calls, total 1.000s')
+    assert lines[2].startswith('- ecs.DescribeServices: 1 calls, total 0.500s')
+
+
+def test_write(collector, tmp_path):
+    collector.record('ecs.DescribeServices', 0.5)
+    path = str(tmp_path / 'metrics.json')
+
+    collector.write(path)
+
+    with open(path) as f:
+        assert json.load(f)['operations']['ecs.DescribeServices']['calls'] == 1
+
+
+def test_instrumented_client(collector, client):
+    with Stubber(client) as stubber:
+        stubber.add_response('list_tasks', {'taskArns': []})
+        stubber.add_client_error('describe_services', service_error_code='ClientException')
+        client.list_tasks(cluster='cluster')
+        with pytest.raises(Exception):
+            client.describe_services(cluster='cluster', services=['service'])
+
+    summary = collector.get_summary()
+    assert summary['operations']['ecs.ListTasks']['calls'] == 1
+    assert summary['operations']['ecs.ListTasks']['errors'] == 0
+    assert summary['operations']['ecs.DescribeServices']['errors'] == 1
+
+
+def test_instrumented_client_without_collector(client):
+    assert metrics.get_collector() is None
+    with Stubber(client) as stubber:
+        stubber.add_response('list_tasks', {'taskArns': []})
+        assert client.list_tasks(cluster='cluster')['taskArns'] == []
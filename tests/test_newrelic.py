@@ -106,7 +106,7 @@ def test_get_payload(api_key, app_id, user, region, revision, changelog, descrip
     assert deployment.get_payload(revision, changelog, description) == payload
 
 
-@patch('requests.post')
+@patch('ecs_deploy.newrelic.post')
 def test_deploy_sucessful(post, api_key, app_id, user, region, revision, changelog, description):
     post.return_value = DeploymentResponseSuccessfulMock()
 
@@ -118,7 +118,7 @@ def test_deploy_sucessful(post, api_key, app_id, user, region, revision, changel
     assert response.status_code == 201
 
 
-@patch('requests.post')
+@patch('ecs_deploy.newrelic.post')
 def test_deploy_unsucessful(post, api_key, app_id, user, region, revision, changelog, description):
     with raises(NewRelicDeploymentException):
         post.return_value = DeploymentResponseUnsuccessfulMock()
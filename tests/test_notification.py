@@ -0,0 +1,120 @@
+from threading import Event
+
+from mock import patch
+
+from ecs_deploy import notification
+from ecs_deploy.notification import NotificationDispatcher, REQUEST_TIMEOUT, get_dispatcher, get_http_session, post, \
+    set_dispatcher
+
+
+def test_submit_runs_in_order():
+    dispatcher = NotificationDispatcher()
+    calls = []
+
+    futures = [dispatcher.submit(calls.append, i) for i in range(5)]
+
+    assert dispatcher.flush() == []
+    assert calls == [0, 1, 2, 3, 4]
+    assert all(future.done() for future in futures)
+
+
+def test_flush_returns_errors():
+    dispatcher = NotificationDispatcher()
+    error = ValueError('Notifying failed')
+
+    def fail():
+        raise error
+
+    dispatcher.submit(fail)
+    dispatcher.submit(lambda: 'ok')
+
+    assert dispatcher.flush() == [error]
+    assert dispatcher.flush() == []
+
+
+def test_flush_is_bounded():
+    dispatcher = NotificationDispatcher(flush_timeout=0.05)
+    release = Event()
+    future = dispatcher.submit(release.wait)
+
+    assert dispatcher.flush() == []
+    assert not future.done()
+
+    release.set()
+    assert dispatcher.flush(timeout=1) == []
+    assert future.done()
+
+
+def test_submit_overlaps_with_caller():
+    dispatcher = NotificationDispatcher()
+    release = Event()
+    dispatcher.submit(release.wait)
+    # the caller continues, while the notification is still pending
+    release.set()
+    assert dispatcher.flush(timeout=1) == []
+
+
+def test_shutdown_stops_workers():
+    dispatcher = NotificationDispatcher()
+    calls = []
+    dispatcher.submit(calls.append, 1)
+    threads = list(dispatcher._threads)
+
+    dispatcher.shutdown(timeout=1)
+
+    for thread in threads:
+        thread.join(1)
+        assert not thread.is_alive()
+    assert calls == [1]
+
+
+@patch('ecs_deploy.notification.atexit')
+def test_get_dispatcher(atexit, monkeypatch):
+    monkeypatch.setattr(notification, '_dispatcher', None)
+    dispatcher = get_dispatcher()
+    assert get_dispatcher() is dispatcher
+    atexit.register.assert_called_once_with(dispatcher.shutdown)
+
+
+@patch('ecs_deploy.notification.atexit')
+def test_set_dispatcher(atexit, monkeypatch):
+    monkeypatch.setattr(notification, '_dispatcher', None)
+    dispatcher = NotificationDispatcher()
+    set_dispatcher(dispatcher)
+    assert get_dispatcher() is dispatcher
+    set_dispatcher(None)
+    assert get_dispatcher() is not dispatcher
+
+
+def test_get_http_session():
+    session = get_http_session()
+    assert get_http_session() is session
+    retry = session.get_adapter('https://hooks.slack.test').max_retries
+    assert retry.total == notification.REQUEST_RETRIES
+    assert 503 in retry.status_forcelist
+
+
+def test_get_retry_with_old_urllib3():
+    class OldRetry(object):
+        def __init__(self, total, read, backoff_factor, status_forcelist, raise_on_status, method_whitelist=None):
+            self.total = total
+            self.method_whitelist = method_whitelist
+
+    with patch.object(notification, 'Retry', OldRetry):
+        retry = notification.get_retry()
+
+    assert retry.method_whitelist is False
+    assert retry.total == notification.REQUEST_RETRIES
+
+
+@patch.object(notification, 'get_http_session')
+def test_post_with_default_timeout(get_http_session):
+    post('https://hooks.slack.test', json={})
+    get_http_session.return_value.post.assert_called_once_with('https://hooks.slack.test', json={},
+                                                               timeout=REQUEST_TIMEOUT)
+
+
+@patch.object(notification, 'get_http_session')
+def test_post_with_timeout(get_http_session):
+    post('https://hooks.slack.test', timeout=1)
+    get_http_session.return_value.post.assert_called_once_with('https://hooks.slack.test', timeout=1)
@@ -0,0 +1,237 @@
+import pytest
+from botocore.exceptions import ClientError, NoCredentialsError
+from mock.mock import ANY, Mock, patch
+
+from ecs_deploy import registry
+from ecs_deploy.ecs import MAX_POOL_CONNECTIONS, clear_client_pool
+from ecs_deploy.registry import (ImageReference, RegistryResolver, EcrResolver, DefaultResolver, CachingResolver,
+                                 DigestCache, ImageResolver, RegistryError, ImageNotFoundError, resolve_images,
+                                 get_resolver, set_resolver, clear_digest_cache)
+from tests.fake_registry import FakeRegistry, FakeRegistryServer
+
+ECR_IMAGE = u'123456789012.dkr.ecr.eu-central-1.amazonaws.com/my-app:1.2.3'
+
+
+class StaticResolver(ImageResolver):
+    def __init__(self, digests):
+        self.digests = digests
+        self.resolved = []
+
+    def resolve(self, reference):
+        self.resolved.append(reference.image)
+        if reference.image not in self.digests:
+            raise ImageNotFoundError(u'Image not found: %s' % reference)
+        return self.digests[reference.image]
+
+
+@pytest.fixture(autouse=True)
+def resolver_state():
+    set_resolver(None)
+    clear_digest_cache()
+    clear_client_pool()
+    yield
+    set_resolver(None)
+    clear_digest_cache()
+    clear_client_pool()
+
+
+@pytest.fixture
+def registry_server():
+    with FakeRegistryServer() as server:
+        yield server
+
+
+@pytest.mark.parametrize('image, registry_name, repository, tag, digest, name', [
+    (u'nginx', u'docker.io', u'library/nginx', None, u'', u'nginx'),
+    (u'nginx:1.25', u'docker.io', u'library/nginx', u'1.25', u'', u'nginx'),
+    (u'docker.io/org/app:v1', u'docker.io', u'org/app', u'v1', u'', u'docker.io/org/app'),
+    (u'ghcr.io/org/app:v1', u'ghcr.io', u'org/app', u'v1', u'', u'ghcr.io/org/app'),
+    (u'localhost:5000/app', u'localhost:5000', u'app', None, u'', u'localhost:5000/app'),
+    (u'localhost:5000/app:v2', u'localhost:5000', u'app', u'v2', u'', u'localhost:5000/app'),
+    (u'app@sha256:abc', u'docker.io', u'library/app', None, u'sha256:abc', u'app'),
+    (ECR_IMAGE, u'123456789012.dkr.ecr.eu-central-1.amazonaws.com', u'my-app', u'1.2.3', u'', ECR_IMAGE[:-6]),
+])
+def test_image_reference(image, registry_name, repository, tag, digest, name):
+    reference = ImageReference(image)
+    assert reference.registry == registry_name
+    assert reference.repository == repository
+    assert reference.tag == tag
+    assert reference.digest == digest
+    assert reference.name == name
+    assert str(reference) == image
+
+
+def test_image_reference_manifest_reference():
+    assert ImageReference(u'nginx').reference == u'latest'
+    assert ImageReference(u'nginx:1.25').reference == u'1.25'
+    assert ImageReference(u'nginx:1.25@sha256:abc').reference == u'sha256:abc'
+
+
+def test_image_reference_ecr():
+    assert ImageReference(ECR_IMAGE).ecr == {u'account': u'123456789012', u'region': u'eu-central-1'}
+    assert ImageReference(u'ghcr.io/org/app:v1').ecr is None
+
+
+def test_image_reference_with_digest():
+    assert ImageReference(u'ghcr.io/org/app:v1').with_digest(u'sha256:abc') == u'ghcr.io/org/app@sha256:abc'
+
+
+def test_registry_resolver_manifest_url():
+    resolver = RegistryResolver(insecure_registries=(u'registry.local:5000',))
+    assert resolver.get_manifest_url(ImageReference(u'nginx:1.25')) == \
+        u'https://registry-1.docker.io/v2/library/nginx/manifests/1.25'
+    assert resolver.get_manifest_url(ImageReference(u'registry.local:5000/app')) == \
+        u'http://registry.local:5000/v2/app/manifests/latest'
+
+
+def test_registry_resolver(registry_server):
+    digest = registry_server.registry.push(u'org/app', u'v1')
+    resolver = RegistryResolver()
+
+    assert resolver.resolve(ImageReference(registry_server.host + u'/org/app:v1')) == digest
+    with pytest.raises(ImageNotFoundError):
+        resolver.resolve(ImageReference(registry_server.host + u'/org/app:v2'))
+
+
+def test_registry_resolver_with_token():
+    with FakeRegistryServer(FakeRegistry(require_token=True)) as server:
+        digest = server.registry.push(u'app', u'v1')
+        assert RegistryResolver().resolve(ImageReference(server.host + u'/app:v1')) == digest
+
+
+@pytest.mark.parametrize(u'token_body', (b'<html>not json</html>', b'{}', b'[]'))
+def test_registry_resolver_invalid_token_response(token_body):
+    with FakeRegistryServer(FakeRegistry(require_token=True, token_body=token_body)) as server:
+        server.registry.push(u'app', u'v1')
+        with pytest.raises(RegistryError) as e:
+            RegistryResolver().resolve(ImageReference(server.host + u'/app:v1'))
+    assert not isinstance(e.value, ImageNotFoundError)
+
+
+def test_registry_resolver_unreachable_registry():
+    with pytest.raises(RegistryError) as e:
+        RegistryResolver(timeout=1).resolve(ImageReference(u'127.0.0.1:1/app:v1'))
+    assert not isinstance(e.value, ImageNotFoundError)
+
+
+def test_ecr_resolver():
+    session = Mock()
+    session.client.return_value.describe_images.return_value = {
+        u'imageDetails': [{u'imageDigest': u'sha256:abc'}]
+    }
+    resolver = EcrResolver(session)
+
+    assert resolver.resolve(ImageReference(ECR_IMAGE)) == u'sha256:abc'
+    session.client.assert_called_once_with(u'ecr', region_name=u'eu-central-1', config=ANY)
+    assert session.client.call_args[1][u'config'].max_pool_connections == MAX_POOL_CONNECTIONS
+    session.client.return_value.describe_images.assert_called_once_with(
+        registryId=u'123456789012',
+        repositoryName=u'my-app',
+        imageIds=[{u'imageTag': u'1.2.3'}],
+    )
+
+
+def test_ecr_resolver_uses_pooled_clients():
+    session = Mock()
+    session.client.side_effect = lambda *args, **kwargs: Mock()
+
+    first = EcrResolver(session).get_client(u'eu-central-1')
+
+    assert EcrResolver(session).get_client(u'eu-central-1') is first
+    assert EcrResolver(session).get_client(u'us-east-1') is not first
+    assert session.client.call_count == 2
+
+
+def test_ecr_resolver_image_not_found():
+    session = Mock()
+    error = {u'Error': {u'Code': u'ImageNotFoundException', u'Message': u'not found'}}
+    session.client.return_value.describe_images.side_effect = ClientError(error, u'DescribeImages')
+
+    with pytest.raises(ImageNotFoundError):
+        EcrResolver(session).resolve(ImageReference(ECR_IMAGE))
+
+
+def test_ecr_resolver_botocore_error():
+    session = Mock()
+    session.client.return_value.describe_images.side_effect = NoCredentialsError()
+
+    with pytest.raises(RegistryError) as e:
+        EcrResolver(session).resolve(ImageReference(ECR_IMAGE))
+    assert not isinstance(e.value, ImageNotFoundError)
+    assert u'Unable to locate credentials' in str(e.value)
+
+
+def test_ecr_resolver_client_creation_error():
+    session = Mock()
+    session.client.side_effect = NoCredentialsError()
+
+    with pytest.raises(RegistryError):
+        EcrResolver(session).resolve(ImageReference(ECR_IMAGE))
+
+
+def test_default_resolver(registry_server):
+    digest = registry_server.registry.push(u'app', u'v1')
+    resolver = DefaultResolver(session=Mock())
+
+    with patch.object(resolver.ecr, 'resolve', return_value=u'sha256:ecr') as resolve_ecr:
+        assert resolver.resolve(ImageReference(ECR_IMAGE)) == u'sha256:ecr'
+        assert resolver.resolve(ImageReference(registry_server.host + u'/app:v1')) == digest
+        assert resolve_ecr.call_count == 1
+
+
+def test_caching_resolver():
+    resolver = StaticResolver({u'app:v1': u'sha256:abc'})
+    caching_resolver = CachingResolver(resolver)
+
+    assert caching_resolver.resolve(ImageReference(u'app:v1')) == u'sha256:abc'
+    assert caching_resolver.resolve(ImageReference(u'app:v1')) == u'sha256:abc'
+    assert caching_resolver.resolve(ImageReference(u'app@sha256:def')) == u'sha256:def'
+    assert resolver.resolved == [u'app:v1']
+
+
+def test_digest_cache_ttl():
+    cache = DigestCache(ttl=60)
+    with patch.object(registry, 'time', return_value=1000):
+        cache.set(u'app:v1', u'sha256:abc')
+    with patch.object(registry, 'time', return_value=1059):
+        assert cache.get(u'app:v1') == u'sha256:abc'
+    with patch.object(registry, 'time', return_value=1060):
+        assert cache.get(u'app:v1') is None
+
+
+def test_digest_cache_on_disk(tmp_path):
+    DigestCache(directory=str(tmp_path), disk=True).set(u'app:v1', u'sha256:abc')
+
+    assert DigestCache(directory=str(tmp_path), disk=True).get(u'app:v1') == u'sha256:abc'
+    assert DigestCache(directory=str(tmp_path), disk=False).get(u'app:v1') is None
+
+
+def test_resolve_images():
+    resolver = StaticResolver({u'app:v1': u'sha256:abc', u'worker:v1': u'sha256:def'})
+
+    digests = resolve_images([u'app:v1', u'worker:v1', u'app:v1'], resolver)
+
+    assert list(digests.items()) == [(u'app:v1', u'sha256:abc'), (u'worker:v1', u'sha256:def')]
+    assert sorted(resolver.resolved) == [u'app:v1', u'worker:v1']
+
+
+def test_resolve_images_reports_all_errors():
+    resolver = StaticResolver({u'app:v1': u'sha256:abc'})
+
+    with pytest.raises(RegistryError) as e:
+        resolve_images([u'app:v1', u'app:v2', u'worker:v2'], resolver)
+
+    assert str(e.value) == u'Unable to resolve 2 of 3 images:\n' \
+                           u'- Image not found: app:v2\n' \
+                           u'- Image not found: worker:v2'
+
+
+def test_get_resolver():
+    resolver = get_resolver()
+    assert isinstance(resolver, CachingResolver)
+    assert isinstance(resolver.resolver, DefaultResolver)
+    assert get_resolver().cache is resolver.cache
+
+    static_resolver = StaticResolver({})
+    set_resolver(static_resolver)
+    assert get_resolver() is static_resolver
@@ -0,0 +1,230 @@
+import os
+import socket
+from io import BytesIO, StringIO
+from threading import Thread
+
+import click
+import pytest
+from mock.mock import patch
+
+from ecs_deploy import cli, ecs as ecs_module, server
+from ecs_deploy.ecs import clear_client_pool, clear_task_definition_cache
+from ecs_deploy.notification import get_dispatcher
+from ecs_deploy.server import Daemon, forward, get_command_name, should_forward
+from tests.fake_aws import FakeAwsBackend, FakeAwsServer
+
+CLUSTER = u'test-cluster'
+SERVICE = u'test-service'
+FAMILY = u'test-task'
+
+
+@pytest.fixture
+def backend():
+    backend = FakeAwsBackend(rollout_polls=3)
+    backend.create_service(CLUSTER, SERVICE, FAMILY, desired_count=2)
+    return backend
+
+
+@pytest.fixture
+def daemon(backend, monkeypatch, tmp_path):
+    with FakeAwsServer(backend) as aws:
+        for name, value in aws.environ.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv('ECS_DEPLOY_CREDENTIAL_CACHE', '0')
+        monkeypatch.setenv('ECS_DEPLOY_SOCKET', str(tmp_path / 'daemon.sock'))
+        clear_client_pool()
+        clear_task_definition_cache()
+
+        daemon = Daemon(cli.ecs, idle_timeout=0)
+        daemon.bind()
+        thread = Thread(target=daemon.serve)
+        thread.start()
+        yield daemon
+        daemon.shutdown()
+        thread.join()
+        clear_client_pool()
+        clear_task_definition_cache()
+
+
+def invoke(*args):
+    stdout = StringIO()
+    stderr = StringIO()
+    exit_code = forward(args, stdout=stdout, stderr=stderr)
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+def test_get_command_name():
+    assert get_command_name(['deploy', 'cluster', 'service']) == u'deploy'
+    assert get_command_name(['--metrics', '--metrics-file', 'metrics.json', 'scale', 'cluster']) == u'scale'
+    assert get_command_name(['--metrics-file=metrics.json', 'diff']) == u'diff'
+    assert get_command_name(['--version']) is None
+
+
+def test_should_forward(tmp_path, monkeypatch):
+    socket_path = tmp_path / 'daemon.sock'
+    monkeypatch.setenv('ECS_DEPLOY_SOCKET', str(socket_path))
+    assert not should_forward(['deploy', 'cluster', 'service'])
+
+    socket_path.touch()
+    assert should_forward(['deploy', 'cluster', 'service'])
+    assert not should_forward(['gc', 'family'])
+    assert not should_forward(['serve'])
+
+    monkeypatch.setenv('ECS_DEPLOY_DAEMON', 'off')
+    assert not should_forward(['deploy', 'cluster', 'service'])
+
+
+def test_forward_without_daemon(tmp_path):
+    assert forward(['deploy', 'cluster', 'service'], path=str(tmp_path / 'missing.sock')) is None
+
+
+def serve_once(path, *lines):
+    """Accepts one connection on the socket and answers with the raw lines."""
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def answer():
+        connection, _ = listener.accept()
+        connection.makefile('rb').readline()
+        for line in lines:
+            connection.sendall(line)
+        connection.close()
+        listener.close()
+
+    thread = Thread(target=answer)
+    thread.start()
+    return thread
+
+
+def test_forward_invalid_status_falls_back(tmp_path):
+    path = str(tmp_path / 'daemon.sock')
+    thread = serve_once(path, b'not json\n')
+    assert forward(['deploy', 'cluster', 'service'], path=path, stdout=StringIO(), stderr=StringIO()) is None
+    thread.join()
+
+
+def test_forward_fails_after_command_was_accepted(tmp_path):
+    path = str(tmp_path / 'daemon.sock')
+    thread = serve_once(path, b'{"busy": false}\n', b'{"stream": "stdout", "data": "Deploying"}\n', b'{"str')
+    stdout = StringIO()
+    with pytest.raises(server.DaemonError):
+        forward(['deploy', 'cluster', 'service'], path=path, stdout=stdout, stderr=StringIO())
+    thread.join()
+    assert stdout.getvalue() == u'Deploying'
+
+
+@patch('ecs_deploy.server.forward', side_effect=server.DaemonError(u'Connection to the ecs daemon failed'))
+@patch('ecs_deploy.server.should_forward', return_value=True)
+def test_main_does_not_execute_accepted_command_again(should_forward, forward):
+    with patch.object(cli, 'ecs') as ecs:
+        with pytest.raises(SystemExit) as e:
+            cli.main(['deploy', CLUSTER, SERVICE])
+    assert e.value.code == 1
+    ecs.assert_not_called()
+
+
+def test_bind_refuses_running_daemon(daemon):
+    with pytest.raises(server.DaemonError):
+        Daemon(cli.ecs, daemon.path).bind()
+
+
+def test_forwarded_commands_share_clients(backend, daemon):
+    exit_code, stdout, stderr = invoke('deploy', CLUSTER, SERVICE, '-t', 'v2', '--sleep-time', '0')
+
+    assert exit_code == 0, stdout + stderr
+    assert u'Deployment successful' in stdout
+    assert backend.services[(CLUSTER, SERVICE)][u'taskDefinition'].endswith(u'task-definition/test-task:2')
+    sessions = dict(ecs_module._sessions)
+    assert len(sessions) == 1
+
+    exit_code, stdout, stderr = invoke('scale', CLUSTER, SERVICE, '3', '--sleep-time', '0')
+
+    assert exit_code == 0, stdout + stderr
+    assert u'Scaling successful' in stdout
+    assert ecs_module._sessions == sessions
+
+
+def test_forwarded_command_fails(daemon):
+    exit_code, stdout, stderr = invoke('deploy', CLUSTER, u'unknown', '-t', 'v2')
+
+    assert exit_code == 1
+    assert u'Service not found' in stderr
+
+
+def test_forwarded_usage_error(daemon):
+    exit_code, stdout, stderr = invoke('scale', CLUSTER)
+
+    assert exit_code == 2
+    assert u'Missing argument' in stderr
+
+
+def test_busy_daemon(daemon):
+    with daemon._lock:
+        assert invoke('diff', FAMILY, '1', '2') == (None, u'', u'')
+
+
+def test_changed_aws_environment_clears_pool(tmp_path):
+    daemon = Daemon(cli.ecs, str(tmp_path / 'daemon.sock'))
+    with patch('ecs_deploy.ecs.clear_client_pool') as clear:
+        daemon.reset_pool({u'AWS_PROFILE': u'a', u'BUILD_ID': u'1'})
+        daemon.reset_pool({u'AWS_PROFILE': u'a', u'BUILD_ID': u'2'})
+        assert not clear.called
+
+        daemon.reset_pool({u'AWS_PROFILE': u'b', u'BUILD_ID': u'2'})
+        assert clear.call_count == 1
+
+
+def test_changed_aws_credentials_file_clears_pool(tmp_path):
+    credentials = tmp_path / 'credentials'
+    credentials.write_text(u'[default]\n')
+    env = {u'AWS_SHARED_CREDENTIALS_FILE': str(credentials)}
+    daemon = Daemon(cli.ecs, str(tmp_path / 'daemon.sock'))
+    with patch('ecs_deploy.ecs.clear_client_pool') as clear:
+        daemon.reset_pool(env)
+        daemon.reset_pool(env)
+        assert not clear.called
+
+        os.utime(str(credentials), (1, 1))
+        daemon.reset_pool(env)
+        assert clear.call_count == 1
+
+
+def test_execute_uses_dispatcher_per_command(tmp_path):
+    dispatchers = []
+
+    @click.command()
+    def notify():
+        dispatcher = get_dispatcher()
+        dispatchers.append(dispatcher)
+        dispatcher.submit(fail)
+
+    def fail():
+        raise Exception(u'Webhook failed')
+
+    daemon = Daemon(notify, str(tmp_path / 'daemon.sock'))
+    request = {u'args': [], u'env': dict(os.environ), u'cwd': str(tmp_path)}
+    for _ in range(2):
+        wfile = BytesIO()
+        assert daemon.execute(request, wfile) == 0
+        assert u'Sending notification failed: Webhook failed' in wfile.getvalue().decode('utf-8')
+
+    assert dispatchers[0] is not dispatchers[1]
+    assert get_dispatcher() not in dispatchers
+
+
+@patch('ecs_deploy.server.forward', return_value=3)
+@patch('ecs_deploy.server.should_forward', return_value=True)
+def test_main_forwards_command(should_forward, forward):
+    with pytest.raises(SystemExit) as e:
+        cli.main(['scale', CLUSTER, SERVICE, '2'])
+    assert e.value.code == 3
+    forward.assert_called_once_with(['scale', CLUSTER, SERVICE, '2'])
+
+
+@patch('ecs_deploy.server.forward', return_value=None)
+@patch('ecs_deploy.server.should_forward', return_value=True)
+def test_main_falls_back_to_local_execution(should_forward, forward):
+    with patch.object(cli, 'ecs') as ecs:
+        cli.main(['scale', CLUSTER, SERVICE, '2'])
+    ecs.assert_called_once_with(args=['scale', CLUSTER, SERVICE, '2'])
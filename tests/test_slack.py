@@ -5,6 +5,7 @@ from pytest import fixture, raises
 from mock import patch
 
 from ecs_deploy.ecs import EcsTaskDefinition
+from ecs_deploy.notification import NotificationDispatcher
 from ecs_deploy.slack import SlackNotification, SlackException
 from tests.test_ecs import PAYLOAD_TASK_DEFINITION_1
 
@@ -79,7 +80,7 @@ def test_get_payload_with_messages(url, service_match):
     assert payload == expected
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_start_without_url(post_mock, url, service_match, task_definition):
     slack = SlackNotification(None, None)
     slack.notify_start('my-cluster', 'my-tag', task_definition, 'my-comment', 'my-user', 'my-service', 'my-rule')
@@ -87,7 +88,7 @@ def test_notify_start_without_url(post_mock, url, service_match, task_definition
     post_mock.assert_not_called()
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_start(post_mock, url, service_match, task_definition):
     post_mock.return_value = NotifyResponseSuccessfulMock()
 
@@ -120,7 +121,7 @@ def test_notify_start(post_mock, url, service_match, task_definition):
     post_mock.assert_called_with(url, json=payload)
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_start_without_tag(post_mock, url, service_match, task_definition):
     post_mock.return_value = NotifyResponseSuccessfulMock()
 
@@ -153,7 +154,7 @@ def test_notify_start_without_tag(post_mock, url, service_match, task_definition
     post_mock.assert_called_with(url, json=payload)
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 @freeze_time()
 def test_notify_success(post_mock, url, service_match, task_definition):
     post_mock.return_value = NotifyResponseSuccessfulMock()
@@ -181,7 +182,7 @@ def test_notify_success(post_mock, url, service_match, task_definition):
     post_mock.assert_called_with(url, json=payload)
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 @freeze_time()
 def test_notify_success(post_mock, url, service_match, task_definition):
     post_mock.return_value = NotifyResponseSuccessfulMock()
@@ -209,21 +210,21 @@ def test_notify_success(post_mock, url, service_match, task_definition):
     post_mock.assert_called_with(url, json=payload)
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_start_without_url(post_mock, url, service_match, task_definition):
     slack = SlackNotification(None, None)
     slack.notify_start('my-cluster', 'my-tag', task_definition, 'my-comment', 'my-user', 'my-service', 'my-rule')
     post_mock.assert_not_called()
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_success_without_url(post_mock, url, service_match, task_definition):
     slack = SlackNotification(None, None)
     slack.notify_success('my-cluster', 13, 'my-service', 'my-rule')
     post_mock.assert_not_called()
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_failure_without_url(post_mock, url, service_match, task_definition):
     slack = SlackNotification(None, None)
     slack.notify_failure('my-cluster', 'my-error', 'my-service', 'my-rule')
@@ -231,7 +232,7 @@ def test_notify_failure_without_url(post_mock, url, service_match, task_definiti
 
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_start_failed(post, url, service_match, task_definition):
     with raises(SlackException):
         post.return_value = NotifyResponseUnsuccessfulMock()
@@ -239,7 +240,7 @@ def test_notify_start_failed(post, url, service_match, task_definition):
         slack.notify_start('my-cluster', 'my-tag', task_definition, 'my-comment', 'my-user', 'my-service', 'my-rule')
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_success_failed(post, url, service_match, task_definition):
     with raises(SlackException):
         post.return_value = NotifyResponseUnsuccessfulMock()
@@ -247,9 +248,40 @@ def test_notify_success_failed(post, url, service_match, task_definition):
         slack.notify_success('my-cluster', 'my-tag', 'my-service', 'my-rule')
 
 
-@patch('requests.post')
+@patch('ecs_deploy.slack.post')
 def test_notify_failure_failed(post, url, service_match, task_definition):
     with raises(SlackException):
         post.return_value = NotifyResponseUnsuccessfulMock()
         slack = SlackNotification(url, service_match)
         slack.notify_failure('my-cluster', 'my-error', 'my-service', 'my-rule')
+
+
+@patch('ecs_deploy.slack.post')
+def test_notify_with_dispatcher(post, url, service_match, task_definition):
+    post.return_value = NotifyResponseSuccessfulMock()
+    dispatcher = NotificationDispatcher()
+    slack = SlackNotification(url, service_match, dispatcher=dispatcher)
+
+    start = slack.notify_start('my-cluster', 'my-tag', task_definition, 'my-comment', 'my-user', 'my-service')
+    success = slack.notify_success('my-cluster', 'my-tag', 'my-service')
+
+    assert dispatcher.flush() == []
+    assert start.result().status_code == 200
+    assert success.result().status_code == 200
+    assert [call[1]['json']['attachments'][0]['pretext'] for call in post.call_args_list] == [
+        'Deployment has started',
+        'Deployment finished successfully',
+    ]
+
+
+@patch('ecs_deploy.slack.post')
+def test_notify_with_dispatcher_failed(post, url, service_match, task_definition):
+    post.return_value = NotifyResponseUnsuccessfulMock()
+    dispatcher = NotificationDispatcher()
+    slack = SlackNotification(url, service_match, dispatcher=dispatcher)
+
+    slack.notify_failure('my-cluster', 'my-error', 'my-service')
+
+    errors = dispatcher.flush()
+    assert len(errors) == 1
+    assert isinstance(errors[0], SlackException)
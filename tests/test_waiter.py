@@ -0,0 +1,73 @@
+from copy import deepcopy
+
+from ecs_deploy.ecs import EcsService
+from ecs_deploy.waiter import FixedWaiter, AdaptiveWaiter, get_waiter, WAITER_FIXED, WAITER_ADAPTIVE
+from tests.test_ecs import CLUSTER_NAME, PAYLOAD_SERVICE
+
+
+def get_service(running_count, desired_count=10, pending_count=0, draining=False):
+    payload = deepcopy(PAYLOAD_SERVICE)
+    payload[u'deployments'][0][u'runningCount'] = running_count
+    payload[u'deployments'][0][u'desiredCount'] = desired_count
+    payload[u'deployments'][0][u'pendingCount'] = pending_count
+    if draining:
+        payload[u'deployments'].append(dict(payload[u'deployments'][0], status=u'ACTIVE', desiredCount=0))
+    return EcsService(CLUSTER_NAME, payload)
+
+
+def test_fixed_waiter():
+    waiter = FixedWaiter(3)
+    assert waiter.next_delay(get_service(0)) == 3
+    assert waiter.next_delay(get_service(5)) == 3
+
+
+def test_adaptive_waiter_polls_tightly_after_update():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=10, factor=2, initial_polls=2)
+    service = get_service(0)
+    assert waiter.next_delay(service) == 0.5
+    assert waiter.next_delay(service) == 0.5
+
+
+def test_adaptive_waiter_backs_off_during_rollout():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=3, factor=2, initial_polls=1)
+    service = get_service(2)
+    delays = [waiter.next_delay(service) for _ in range(5)]
+    assert delays == [0.5, 1, 2, 3, 3]
+
+
+def test_adaptive_waiter_polls_tightly_near_target():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=10, factor=2, initial_polls=0)
+    assert waiter.next_delay(get_service(2)) == 1
+    assert waiter.next_delay(get_service(9)) == 0.5
+    assert waiter.next_delay(get_service(0, desired_count=0)) == 0.5
+
+
+def test_adaptive_waiter_near_target_of_small_service():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=10, factor=2, initial_polls=0)
+    assert not waiter.is_near_target(get_service(1, desired_count=2))
+    assert not waiter.is_near_target(get_service(0, desired_count=1))
+    assert waiter.is_near_target(get_service(1, desired_count=2, pending_count=1))
+    assert waiter.is_near_target(get_service(2, desired_count=2))
+
+
+def test_adaptive_waiter_backs_off_while_draining():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=10, factor=2, initial_polls=0)
+    assert not waiter.is_near_target(get_service(2, desired_count=2, draining=True))
+    assert not waiter.is_near_target(get_service(10, draining=True))
+
+
+def test_adaptive_waiter_reset():
+    waiter = AdaptiveWaiter(min_delay=0.5, max_delay=10, factor=2, initial_polls=1)
+    service = get_service(2)
+    waiter.next_delay(service)
+    assert waiter.next_delay(service) == 1
+    waiter.reset()
+    assert waiter.next_delay(service) == 0.5
+
+
+def test_get_waiter():
+    assert isinstance(get_waiter(WAITER_FIXED, 2), FixedWaiter)
+    waiter = get_waiter(WAITER_ADAPTIVE, 0.2, 5)
+    assert isinstance(waiter, AdaptiveWaiter)
+    assert waiter.min_delay == 0.2
+    assert waiter.max_delay == 5